@@ -0,0 +1,72 @@
+"""
+Import-time benchmark of the processing modules (what a batch worker pays on spawn).
+
+Usage:
+    python bench_import.py [-n REPEAT] [module ...]
+
+Every import is timed in a fresh interpreter (run in this directory, from wherever the
+script is started); the report shows the median time, whether matplotlib got loaded, and
+the eager baseline: the same import with matplotlib.pyplot loaded first, as every module
+did before the plotting code was made lazy.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ['envelop_core', 'envelop_detection', 'envelop_streaming', 'display_scans',
+           'extern_functions', 'us_classes']
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = '''
+import sys, time, json
+t = time.perf_counter()
+{imports}
+dt = time.perf_counter() - t
+print(json.dumps({{"time": dt, "matplotlib": "matplotlib" in sys.modules}}))
+'''
+
+
+def _median_time(imports, repeat):
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(imports=imports)],
+                             capture_output=True, text=True, check=True, cwd=_HERE)
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(res['time'])
+    times.sort()
+    return times[len(times)//2], res['matplotlib']
+
+
+def time_import(module, repeat=5):
+    """
+    Median import time [s] of `module` in fresh interpreters, whether matplotlib was loaded,
+    and the eager baseline (matplotlib.pyplot imported with the module).
+    """
+    time, matplotlib = _median_time(f'import {module}', repeat)
+    eager, _ = _median_time(f'import matplotlib.pyplot\nimport {module}', repeat)
+    return {'module': module, 'time': time, 'matplotlib': matplotlib, 'eager_time': eager,
+            'speedup': eager / time}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import-time benchmark of the processing modules.')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--json', help='save the results to this file')
+    args = parser.parse_args(argv)
+
+    results = [time_import(module, args.repeat) for module in args.modules]
+    print(f"{'module':<22}{'import [ms]':>12}{'eager [ms]':>12}{'speedup':>9}  matplotlib loaded")
+    for res in results:
+        print(f"{res['module']:<22}{1e3*res['time']:>12.1f}{1e3*res['eager_time']:>12.1f}"
+              f"{res['speedup']:>8.1f}x  {res['matplotlib']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
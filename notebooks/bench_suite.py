@@ -0,0 +1,289 @@
+"""
+Benchmark suite of the processing paths, on the bundled data and on scalable synthetic inputs.
+
+Usage:
+    python bench_suite.py [-o results.json] [--scales 1 2 4] [--dims scanlines samples ...]
+                          [--cases envelope contrast ...] [--compare old.json]
+
+Every case is run at the base sizes and, for every dimension it depends on, with that
+dimension multiplied by each of the scales (one dimension at a time):
+    scanlines, samples, rx      synthetic pulse-echo RF block (base: the tx4rx4 block)
+    frames, nx, nz              synthetic reconstructed image scored against the bundled phantom
+    duration                    synthetic CW Doppler recording [s]
+The bundled tx*rx*-v1-block.npy files are benchmarked as they are.
+
+Reported per run: best wall time of `--repeat` runs, peak traced memory (tracemalloc, in a
+separate run) and throughput (input samples/s). The JSON output holds the environment and
+all runs; `--compare` prints the time ratio against a previous result file.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from scipy.io.wavfile import write as write_wav
+from scipy.signal import fftconvolve
+
+import envelop_detection
+from display_scans import SF, detect_envelope_scanlines, display_video_env_detect
+from doppler_stream import DopplerSpectrogram
+from extern_functions import get_envelope, hl_envelopes_idx
+from hemodynamics import cardiac_points, max_velocity_trace
+from rf_dataset import US_RFDataset
+from us_classes import US_Contrast, US_Phantom, US_RecoImage, save_reco_image
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+PHANTOM = os.path.join(DATA_DIR, 'ex3-imaging', 'simulation', 'contrast_speckle_simu_phantom.hdf5')
+
+BASE = {'scanlines': 125, 'samples': 4096, 'rx': 4,      # tx4rx4 block
+        'frames': 4, 'nx': 200, 'nz': 300,              # PICMUS-like image
+        'duration': 10.}                                # Doppler recording [s]
+DOPPLER_FS = 44100
+DETECTORS = ['asynchronous_half_wave', 'asynchronous_full_wave', 'asynchronous_real_square_law',
+             'asynchronous_complex_hilbert', 'asynchronous_complex_square_law']
+
+
+# -- synthetic inputs ------------------------------------------------------------------------
+
+def synthetic_rf(scanlines, samples, rx, fc=5e6, seed=0):
+    """ int16 pulse-echo block (1, scanline, sample, RX channel): sparse reflectors * 5 MHz pulse + noise """
+    rng = np.random.default_rng(seed)
+    t = np.arange(-64, 65) / SF
+    pulse = np.exp(-(t * fc / 1.5)**2 * 8) * np.sin(2 * np.pi * fc * t)
+    reflectors = rng.standard_normal((scanlines, samples)) * (rng.random((scanlines, samples)) < 0.002)
+    rf = fftconvolve(reflectors, pulse[np.newaxis], mode='same', axes=1)
+    rf = 8000 * rf[..., np.newaxis] / np.max(np.abs(rf)) + 50 * rng.standard_normal((scanlines, samples, rx))
+    return rf.astype(np.int16)[np.newaxis]
+
+
+def synthetic_reco(file_path, frames, nx, nz, seed=0):
+    """ Fully developed speckle with anechoic cysts at the bundled phantom's occlusions """
+    pht = US_Phantom(PHANTOM)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-0.018, 0.018, nx, dtype=np.float32)
+    z = np.linspace(0.01, 0.05, nz, dtype=np.float32)
+    inside = np.zeros((nx, nz), dtype=bool)
+    for cx, cz, d in zip(pht.occlusionCenterX, pht.occlusionCenterZ, pht.occlusionDiameter):
+        inside |= (x[:, np.newaxis] - cx)**2 + (z[np.newaxis] - cz)**2 <= (d / 2)**2
+    gain = np.where(inside, 0.05, 1.).astype(np.float32)
+    speckle = (rng.standard_normal((frames, nx, nz), dtype=np.float32)
+               + 1j * rng.standard_normal((frames, nx, nz), dtype=np.float32)) * gain
+    save_reco_image(file_path, x, z, speckle, np.arange(1, frames + 1))
+
+
+def synthetic_doppler_wav(file_path, duration, fs=DOPPLER_FS, heart_rate=70, seed=0):
+    """ CW Doppler audio: noise band whose upper frequency follows a pulsatile velocity waveform """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * fs)) / fs
+    phase = (t * heart_rate / 60) % 1
+    f_max = 300 + 2500 * np.exp(-((phase - 0.15) / 0.07)**2)
+    # random-phase sum of tones below f_max (chirp with instantaneous frequency u*f_max)
+    sig = np.zeros_like(t)
+    for u in rng.random(16):
+        sig += np.sin(2 * np.pi * np.cumsum(u * f_max) / fs + rng.uniform(0, 2 * np.pi))
+    sig += 0.05 * rng.standard_normal(len(t))
+    write_wav(file_path, fs, (8000 * sig / np.max(np.abs(sig))).astype(np.int16))
+
+
+# -- measurement -----------------------------------------------------------------------------
+
+def measure(func, n_samples, repeat=3):
+    """ Best wall time [s] of `repeat` runs, peak traced memory [bytes] and samples/s of func() """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            t = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t)
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    best = min(times)
+    return {'time_s': best, 'peak_mem_bytes': peak, 'samples': int(n_samples),
+            'samples_per_s': n_samples / best if best else float('inf')}
+
+
+# -- cases: setup(sizes, tmp_dir) -> list of (name, func, n_samples) --------------------------
+
+def _rf_block(sizes, tmp_dir):
+    path = os.path.join(tmp_dir, 'rf_{scanlines}_{samples}_{rx}.npy'.format(**sizes))
+    if not os.path.exists(path):
+        np.save(path, synthetic_rf(sizes['scanlines'], sizes['samples'], sizes['rx']))
+    return path
+
+
+def _envelope_cases(rf):
+    n = rf.rf.size
+    cases = [('rx_sum', lambda: rf.rx_sum(), n)]
+    summed = rf.rx_sum()
+    for name in DETECTORS:
+        func = getattr(envelop_detection, name)
+        cases.append((name, lambda func=func: detect_envelope_scanlines(summed, func), summed.size))
+    return cases
+
+
+def case_envelope(sizes, tmp_dir):
+    return _envelope_cases(US_RFDataset(_rf_block(sizes, tmp_dir)))
+
+
+def case_video(sizes, tmp_dir):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    summed = US_RFDataset(_rf_block(sizes, tmp_dir)).rx_sum()
+
+    def run():
+        display_video_env_detect(summed, envelop_detection.asynchronous_full_wave)
+        plt.gcf().canvas.draw()
+        plt.close('all')
+    return [('display_video_env_detect', run, summed.size)]
+
+
+def case_contrast(sizes, tmp_dir):
+    path = os.path.join(tmp_dir, 'reco_{frames}_{nx}_{nz}.hdf5'.format(**sizes))
+    if not os.path.exists(path):
+        synthetic_reco(path, sizes['frames'], sizes['nx'], sizes['nz'])
+    pht = US_Phantom(PHANTOM)
+
+    def run():
+        with US_RecoImage(path) as image:
+            US_Contrast(pht, image, 0).evaluate()
+    return [('US_Contrast.evaluate', run, sizes['frames'] * sizes['nx'] * sizes['nz'])]
+
+
+def case_peaks(sizes, tmp_dir):
+    n = int(sizes['duration'] * 1000)      # max-velocity trace at ~1 kHz frame rate
+    t = np.arange(n) / 1000
+    rng = np.random.default_rng(0)
+    trace = np.abs(np.sin(2 * np.pi * 1.2 * t))**8 + 0.05 * rng.standard_normal(n)
+    return [('hl_envelopes_idx', lambda: hl_envelopes_idx(trace), n),
+            ('get_envelope', lambda: get_envelope(t, trace), n)]
+
+
+def case_doppler(sizes, tmp_dir):
+    wav = os.path.join(tmp_dir, 'doppler_{duration:g}.wav'.format(**sizes))
+    if not os.path.exists(wav):
+        synthetic_doppler_wav(wav, sizes['duration'])
+    n = int(sizes['duration'] * DOPPLER_FS)
+    out = os.path.join(tmp_dir, 'spectrogram.npy')
+    spec = DopplerSpectrogram.compute(wav, out)
+    Pxx_dB = 10 * np.log10(np.asarray(spec.Pxx) + 1e-12)
+    trace = max_velocity_trace(Pxx_dB, spec.freqs)
+    return [('doppler_spectrogram', lambda: DopplerSpectrogram.compute(wav, out), n),
+            ('max_velocity_trace', lambda: max_velocity_trace(Pxx_dB, spec.freqs), Pxx_dB.size),
+            ('cardiac_points', lambda: cardiac_points(spec.bins, trace), len(trace))]
+
+
+# case group -> (setup, size dimensions it depends on)
+CASES = {
+    'envelope': (case_envelope, ('scanlines', 'samples', 'rx')),
+    'video': (case_video, ('scanlines', 'samples')),
+    'contrast': (case_contrast, ('frames', 'nx', 'nz')),
+    'peaks': (case_peaks, ('duration',)),
+    'doppler': (case_doppler, ('duration',)),
+}
+
+
+def bundled_runs(repeat=3):
+    """ Envelope cases on the bundled tx*rx*-v1-block.npy files """
+    results = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, 'ex1-pulse-echo', '*-block.npy'))):
+        for name, func, n in _envelope_cases(US_RFDataset(path)):
+            results.append({'case': name, 'input': os.path.basename(path), **measure(func, n, repeat)})
+    return results
+
+
+def size_sets(dims, scales):
+    """ Base sizes, then every dimension in `dims` scaled by every factor (one at a time) """
+    sets = [('base', dict(BASE))]
+    for dim in dims:
+        for scale in scales:
+            if scale == 1:
+                continue
+            sizes = dict(BASE)
+            sizes[dim] = type(BASE[dim])(BASE[dim] * scale)
+            sets.append((dim, sizes))
+    return sets
+
+
+def run_suite(cases=tuple(CASES), dims=tuple(BASE), scales=(1, 2, 4), repeat=3, bundled=True, verbose=True):
+    results = bundled_runs(repeat) if bundled else []
+    tmp_dir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        for varied, sizes in size_sets(dims, scales):
+            for group in cases:
+                setup, depends = CASES[group]
+                if varied != 'base' and varied not in depends:
+                    continue
+                params = {dim: sizes[dim] for dim in depends}
+                for name, func, n in setup(sizes, tmp_dir):
+                    res = {'case': name, 'input': 'synthetic', 'varied': varied, 'params': params,
+                           **measure(func, n, repeat)}
+                    results.append(res)
+                    if verbose:
+                        print_result(res)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_key(res):
+    return res['case'], res['input'], json.dumps(res.get('params'), sort_keys=True)
+
+
+def print_result(res, ref=None):
+    params = ' '.join(f'{k}={v:g}' for k, v in res.get('params', {}).items()) or res['input']
+    line = (f"{res['case']:<32}{params:<36}{1e3*res['time_s']:>10.2f} ms{res['peak_mem_bytes']/2**20:>9.1f} MiB"
+            f"{res['samples_per_s']/1e6:>10.2f} MS/s")
+    if ref is not None:
+        line += f"   x{res['time_s']/ref['time_s']:.2f} vs ref"
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite of the processing paths.')
+    parser.add_argument('-o', '--output', help='save the results to this JSON file')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--dims', nargs='+', choices=list(BASE), default=list(BASE),
+                        help='size dimensions to scale')
+    parser.add_argument('--scales', nargs='+', type=float, default=[1, 2, 4])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--no-bundled', action='store_true', help='skip the bundled data files')
+    parser.add_argument('--compare', help='previous JSON result file to compare against')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.cases, args.dims, args.scales, args.repeat, not args.no_bundled,
+                        verbose=not args.compare)
+    if args.compare:
+        with open(args.compare) as f:
+            ref = {run_key(r): r for r in json.load(f)['results']}
+        for res in results:
+            print_result(res, ref.get(run_key(res)))
+    elif not args.no_bundled:
+        for res in results:
+            if res['input'] != 'synthetic':
+                print_result(res)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'base_sizes': BASE, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Real-time cine-loop pipeline for pulse-echo imaging.
+
+    acquisition -> RX channel sum -> envelope detection -> log compression -> sink
+
+Every stage runs in its own thread and the stages are connected by bounded queues: a slow
+stage blocks its producer (backpressure) and only the acquisition, which cannot wait for
+the hardware, drops frames when the first queue is full. The acquisition is simulated by
+replaying the tx*rx*-v1-block.npy files at a fixed frame rate.
+
+Usage:
+    python cine_pipeline.py ../data/ex1-pulse-echo/tx*rx*-v1-block.npy --fps 20 --frames 200
+
+The report gives the achieved frame rate, the dropped frames and, for every stage, the
+processing time and the time frames waited in its input queue.
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+import numpy as np
+
+import envelop_detection
+from envelop_core import log_compress
+from display_scans import SF, detect_envelope_scanlines
+from rf_dataset import US_RFDataset
+
+_STOP = object()    # end-of-stream marker passed down the queues
+
+
+class Frame:
+    """
+    One acquired frame travelling through the pipeline
+    Public properties:
+        index           acquisition number
+        source          file the frame was replayed from
+        data            current data (replaced by every stage)
+        t_acquired      acquisition time (time.perf_counter)
+        timings         {stage name: (queue wait [s], processing time [s])}
+    """
+    __slots__ = ('index', 'source', 'data', 't_acquired', 't_queued', 'timings')
+
+    def __init__(self, index, source, data):
+        self.index = index
+        self.source = source
+        self.data = data
+        self.t_acquired = self.t_queued = time.perf_counter()
+        self.timings = {}
+
+
+class AcquisitionSimulator:
+    """
+    Replays RF blocks as a stream of frames at a fixed frame rate
+    Input:
+        file_paths:     *-block.npy files, replayed in turn (one frame each)
+        frame_rate:     frames per second (None: as fast as the pipeline accepts them)
+        n_frames:       number of frames to acquire (None: until `stop`)
+        drop:           if True, a frame arriving when the output queue is full is dropped
+                        (as by real hardware); if False, the acquisition waits
+    Frames are (scanline x RF sample x RX channel) views on the memory-mapped files.
+    """
+    def __init__(self, file_paths, frame_rate=20., n_frames=None, drop=True):
+        self.datasets = [US_RFDataset(path) for path in file_paths]
+        self.frame_rate = frame_rate
+        self.n_frames = n_frames
+        self.drop = drop
+        self.acquired = 0
+        self.dropped = 0
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, out_queue):
+        t_start = time.perf_counter()
+        self.acquired = self.dropped = 0
+        i = 0
+        while not self._stop.is_set() and (self.n_frames is None or i < self.n_frames):
+            if self.frame_rate:
+                delay = t_start + i / self.frame_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            ds = self.datasets[i % len(self.datasets)]
+            frame = Frame(i, ds.file_path, ds.rf)
+            self.acquired += 1
+            if self.drop:
+                try:
+                    out_queue.put_nowait(frame)
+                except queue.Full:
+                    self.dropped += 1
+            else:
+                out_queue.put(frame)
+            i += 1
+        out_queue.put(_STOP)
+
+
+class Stage:
+    """
+    Pipeline stage applying `func` to the data of every frame
+    Input:
+        name:           stage name used in the report
+        func:           data -> data
+    """
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.frames = 0
+
+    def run(self, in_queue, out_queue, on_error=None):
+        """
+        Process frames until the end-of-stream marker, which is always forwarded. After an
+        exception (reported to on_error(stage, exception)) the remaining input is drained
+        without processing, so the upstream threads can finish.
+        """
+        failed = False
+        try:
+            while True:
+                frame = in_queue.get()
+                if frame is _STOP:
+                    return
+                if failed:
+                    continue
+                t = time.perf_counter()
+                try:
+                    frame.data = self.func(frame.data)
+                except Exception as err:
+                    failed = True
+                    if on_error is not None:
+                        on_error(self, err)
+                    continue
+                t_done = time.perf_counter()
+                frame.timings[self.name] = (t - frame.t_queued, t_done - t)
+                frame.t_queued = t_done
+                self.frames += 1
+                out_queue.put(frame)
+        finally:
+            out_queue.put(_STOP)
+
+
+def pulse_echo_stages(selected_func=envelop_detection.asynchronous_full_wave, cutoff_freq=0.1*SF,
+                      dynamic_range=60):
+    """ Stages of the pulse-echo chain: RX channel sum, envelope detection, log compression """
+    return [Stage('channel_sum', lambda rf: np.sum(rf, axis=2, dtype=np.float32)),
+            Stage('envelope', lambda rf: detect_envelope_scanlines(rf, selected_func, cutoff_freq)),
+            Stage('log_compress', lambda env: log_compress(env, dynamic_range))]
+
+
+class CineLoop:
+    """
+    Ring buffer of the last `length` output frames (sink storing the cine loop)
+    Public properties:
+        frames          list of (index, B-mode) pairs, oldest first
+    """
+    def __init__(self, length=100):
+        self.length = length
+        self.frames = []
+
+    def __call__(self, frame):
+        self.frames.append((frame.index, frame.data))
+        del self.frames[:-self.length]
+
+
+class CinePipeline:
+    """
+    Threaded pipeline: source -> stages -> sink, connected by bounded queues
+    Input:
+        source:         AcquisitionSimulator (or any object with run(out_queue))
+        stages:         list of Stage
+        sink:           callable(frame) run on every output frame (display, storage ...)
+        queue_size:     capacity of every queue (frames in flight per stage)
+    """
+    def __init__(self, source, stages, sink=None, queue_size=2):
+        self.source = source
+        self.stages = stages
+        self.sink = sink if sink is not None else CineLoop()
+        self.queue_size = queue_size
+        self.timings = []       # (frame index, end-to-end latency, {stage: (wait, processing)})
+        self.elapsed = 0.
+        self.error = None       # first exception raised by the source, a stage or the sink
+        self._lock = threading.Lock()
+
+    def _fail(self, err):
+        """ Record the first exception and stop the acquisition (the stages drain their queues) """
+        with self._lock:
+            if self.error is None:
+                self.error = err
+        if hasattr(self.source, 'stop'):
+            self.source.stop()
+
+    def _run_source(self, out_queue):
+        try:
+            self.source.run(out_queue)
+        except Exception as err:
+            self._fail(err)
+            out_queue.put(_STOP)
+
+    def run(self):
+        """
+        Run until the source ends (or `stop` is called); returns the report.
+        An exception raised in any thread stops the pipeline and is re-raised here.
+        """
+        # every run reports only its own frames
+        self.error = None
+        self.timings = []
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), daemon=True)]
+        threads += [threading.Thread(target=stage.run, args=(queues[i], queues[i+1], lambda _, err: self._fail(err)),
+                                     daemon=True)
+                    for i, stage in enumerate(self.stages)]
+        t_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        out = queues[-1]
+        while True:
+            frame = out.get()
+            if frame is _STOP:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.sink(frame)
+            except Exception as err:
+                self._fail(err)
+                continue
+            self.timings.append((frame.index, time.perf_counter() - frame.t_acquired, frame.timings))
+        self.elapsed = time.perf_counter() - t_start
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.report()
+
+    def stop(self):
+        self.source.stop()
+
+    def report(self):
+        """ Frame rate, dropped frames, end-to-end and per-stage latency statistics [ms] """
+        def stats(values):
+            values = 1e3 * np.asarray(values)
+            if len(values) == 0:
+                return {}
+            return {'mean_ms': float(np.mean(values)), 'p95_ms': float(np.percentile(values, 95)),
+                    'max_ms': float(np.max(values))}
+
+        n = len(self.timings)
+        report = {
+            'frames_acquired': getattr(self.source, 'acquired', n),
+            'frames_dropped': getattr(self.source, 'dropped', 0),
+            'frames_processed': n,
+            'elapsed_s': self.elapsed,
+            'fps': n / self.elapsed if self.elapsed else 0.,
+            'latency': stats([t[1] for t in self.timings]),
+            'stages': {}}
+        for stage in self.stages:
+            waits = [t[2][stage.name][0] for t in self.timings]
+            procs = [t[2][stage.name][1] for t in self.timings]
+            report['stages'][stage.name] = {'queue_wait': stats(waits), 'processing': stats(procs),
+                                            'max_fps': 1 / np.mean(procs) if procs else 0.}
+        return report
+
+
+def print_report(report):
+    print(f"frames: {report['frames_processed']} processed, {report['frames_acquired']} acquired, "
+          f"{report['frames_dropped']} dropped")
+    print(f"throughput: {report['fps']:.1f} fps, latency (acquisition -> sink): "
+          f"{report['latency'].get('mean_ms', 0):.1f} ms mean / {report['latency'].get('p95_ms', 0):.1f} ms p95")
+    print(f"{'stage':<14}{'proc [ms]':>10}{'p95':>8}{'wait [ms]':>11}{'max fps':>9}")
+    for name, s in report['stages'].items():
+        print(f"{name:<14}{s['processing'].get('mean_ms', 0):>10.2f}{s['processing'].get('p95_ms', 0):>8.2f}"
+              f"{s['queue_wait'].get('mean_ms', 0):>11.2f}{s['max_fps']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Real-time pulse-echo cine-loop pipeline on replayed RF blocks.')
+    parser.add_argument('files', nargs='+', help='*-block.npy files replayed in turn')
+    parser.add_argument('--fps', type=float, default=20., help='acquisition frame rate (0: as fast as possible)')
+    parser.add_argument('--frames', type=int, default=100, help='number of frames to acquire')
+    parser.add_argument('--detector', default='asynchronous_full_wave',
+                        help='asynchronous_* function of envelop_detection')
+    parser.add_argument('--cutoff', type=float, default=0.1*SF, help='LP filter cutoff [Hz]')
+    parser.add_argument('--dynamic-range', type=float, default=60)
+    parser.add_argument('--queue-size', type=int, default=2)
+    parser.add_argument('--no-drop', action='store_true', help='acquisition waits instead of dropping frames')
+    parser.add_argument('--json', help='save the report to this file')
+    args = parser.parse_args(argv)
+
+    source = AcquisitionSimulator(args.files, args.fps or None, args.frames, drop=not args.no_drop)
+    stages = pulse_echo_stages(getattr(envelop_detection, args.detector), args.cutoff, args.dynamic_range)
+    report = CinePipeline(source, stages, queue_size=args.queue_size).run()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
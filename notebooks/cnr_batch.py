@@ -0,0 +1,121 @@
+"""
+Batch CNR scoring of many beamformed reconstructions against their phantoms.
+
+Usage:
+    python cnr_batch.py manifest.json -o report.csv -j 8
+
+The manifest lists (phantom, image) HDF5 pairs, either as JSON
+    [{"name": "simu", "phantom": "phantom.hdf5", "image": "img.hdf5"}, ...]
+or as CSV with the columns `phantom,image` (optional `name`).
+Relative paths are resolved against the manifest directory.
+Each pair is scored by one worker process; the report (CSV or JSON, chosen by the output
+extension) holds one CNR value per frame and occlusion together with the timings.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from us_classes import US_Phantom, US_RecoImage, US_ContrastEngine
+
+
+def read_manifest(manifest_path):
+    """ List of {'name', 'phantom', 'image'} entries with absolute paths. """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='') as f:
+        if manifest_path.lower().endswith('.csv'):
+            entries = list(csv.DictReader(f))
+        else:
+            entries = json.load(f)
+
+    pairs = []
+    for entry in entries:
+        phantom = os.path.join(base, entry['phantom'])
+        image = os.path.join(base, entry['image'])
+        name = entry.get('name') or os.path.splitext(os.path.basename(image))[0]
+        pairs.append({'name': name, 'phantom': phantom, 'image': image})
+    return pairs
+
+
+def score_pair(pair):
+    """ Worker: CNR scores of one (phantom, image) pair, with load/score timings [s]. """
+    result = dict(pair)
+    t0 = time.perf_counter()
+    try:
+        phantom = US_Phantom(pair['phantom'])
+        with US_RecoImage(pair['image'], lazy=True) as image:
+            t1 = time.perf_counter()
+            engine = US_ContrastEngine(phantom, image.x_axis, image.z_axis)
+            score = engine.score(image.data)
+            number_plane_waves = image.number_plane_waves[:].tolist()
+        t2 = time.perf_counter()
+    except Exception as err:
+        result.update(status='error', error=f'{type(err).__name__}: {err}',
+                      total_time=time.perf_counter() - t0)
+        return result
+
+    result.update(status='ok', score=score.tolist(), number_plane_waves=number_plane_waves,
+                  mean_score=score.mean(axis=1).tolist(),
+                  load_time=t1 - t0, score_time=t2 - t1, total_time=t2 - t0)
+    return result
+
+
+def run_batch(pairs, jobs=None):
+    """ Score all pairs on a process pool (one task per dataset), results in manifest order. """
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(score_pair, pairs))
+
+
+def write_report(results, output_path, wall_time):
+    """ CSV: one row per frame and occlusion. JSON: full results with the batch timing. """
+    if output_path.lower().endswith('.csv'):
+        fields = ['name', 'phantom', 'image', 'status', 'frame', 'number_plane_waves',
+                  'occlusion', 'cnr_db', 'load_time', 'score_time', 'total_time', 'error']
+        with open(output_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for res in results:
+                if res['status'] != 'ok':
+                    writer.writerow(res)
+                    continue
+                for frame, row in enumerate(res['score']):
+                    for occlusion, value in enumerate(row):
+                        writer.writerow(dict(res, frame=frame, occlusion=occlusion, cnr_db=value,
+                                             number_plane_waves=res['number_plane_waves'][frame]))
+    else:
+        with open(output_path, 'w') as f:
+            json.dump({'wall_time': wall_time, 'results': results}, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch CNR scoring of (phantom, image) HDF5 pairs.')
+    parser.add_argument('manifest', help='JSON or CSV manifest of (phantom, image) pairs')
+    parser.add_argument('-o', '--output', default='cnr_report.csv',
+                        help='report path (.csv or .json)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    pairs = read_manifest(args.manifest)
+    t0 = time.perf_counter()
+    results = run_batch(pairs, args.jobs)
+    wall_time = time.perf_counter() - t0
+    write_report(results, args.output, wall_time)
+
+    n_failed = 0
+    for res in results:
+        if res['status'] == 'ok':
+            print(f"{res['name']}: mean CNR per frame (dB) {[round(v, 2) for v in res['mean_score']]}"
+                  f" [{res['total_time']:.3f} s]")
+        else:
+            n_failed += 1
+            print(f"{res['name']}: FAILED ({res['error']})")
+    print(f'{len(results)} datasets in {wall_time:.2f} s -> {args.output}')
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
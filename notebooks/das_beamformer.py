@@ -0,0 +1,211 @@
+"""
+Delay-and-sum (DAS) beamforming of multi-channel RF data.
+
+Delays and apodization weights are precomputed once per probe/grid geometry as float32
+tables; pixels are then processed in tiles on a thread pool. Plane-wave reconstructions
+can be written in the HDF5 layout read by US_RecoImage (see `save_reco_image`).
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.signal import hilbert
+from us_classes import save_reco_image
+
+
+def rx_apodization(x_pixels, z_pixels, element_x, f_number, window='boxcar'):
+    """
+    Receive apodization (pixel x element) with a dynamic aperture of width z / F-number.
+    ARGS:
+        window - 'boxcar' or 'hanning' (weight over the active aperture)
+    """
+    half_aperture = z_pixels[:, np.newaxis] / (2 * f_number) if f_number else np.inf
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # pixels at z = 0: zero aperture, only an element right below the pixel (0/0) is active
+        u = (x_pixels[:, np.newaxis] - element_x[np.newaxis, :]) / half_aperture
+    u[np.isnan(u)] = 0
+    active = np.abs(u) <= 1
+    if window == 'boxcar':
+        apod = active.astype(np.float32)
+    elif window == 'hanning':
+        apod = np.where(active, 0.5 + 0.5*np.cos(math.pi*u), 0).astype(np.float32)
+    else:
+        raise ValueError(f'unknown apodization window: {window}')
+    # pixels close to the probe always keep at least the nearest element
+    empty = ~active.any(axis=1)
+    apod[empty, np.argmin(np.abs(u[empty]), axis=1)] = 1
+    return apod
+
+
+class DAS_Beamformer:
+    """
+    Plane-wave delay-and-sum beamformer on a rectangular (x, z) pixel grid
+    Input:
+        element_x:          x positions of the RX elements [m]
+        fs:                 sampling frequency [Hz]
+        sos:                speed of sound [m/s]
+        x_axis, z_axis:     image grid [m]
+        tx_angles:          plane-wave steering angles [rad], one per transmit event
+        f_number:           receive F-number (0 -> full aperture)
+        window:             receive apodization window ('boxcar' or 'hanning')
+        t0:                 time of the first RF sample [s] (sample offset / fs)
+        tile_size:          number of pixels processed per task
+        n_workers:          threads of the pool (default: number of cores)
+        executor:           optional thread pool to use (shared with other processing); by
+                            default the beamformer creates its own on the first multi-tile
+                            event and keeps it until `close`
+    Public properties:
+        rx_delay            (pixel x element) receive delays [samples]
+        tx_delay            (angle x pixel) transmit delays [samples]
+        apodization         (pixel x element) receive weights
+    """
+    def __init__(self, element_x, fs, sos, x_axis, z_axis, tx_angles=(0.,), f_number=1.75,
+                 window='boxcar', t0=0., tile_size=4096, n_workers=None, executor=None):
+        self.element_x = np.asarray(element_x, dtype=np.float64)
+        self.fs = fs
+        self.sos = sos
+        self.x_axis = np.asarray(x_axis, dtype=np.float64)
+        self.z_axis = np.asarray(z_axis, dtype=np.float64)
+        self.tx_angles = np.atleast_1d(np.asarray(tx_angles, dtype=np.float64))
+        self.f_number = f_number
+        self.window = window
+        self.tile_size = tile_size
+        self.n_workers = n_workers
+        self.executor = executor
+        self._own_executor = None
+
+        # pixels in (x, z) order, i.e. the layout of a US_RecoImage frame
+        x_pix = np.repeat(self.x_axis, len(self.z_axis))
+        z_pix = np.tile(self.z_axis, len(self.x_axis))
+
+        # delay tables [samples]: receive path per element, transmit path per plane wave
+        rx_dist = np.hypot(x_pix[:, np.newaxis] - self.element_x[np.newaxis, :], z_pix[:, np.newaxis])
+        self.rx_delay = (rx_dist * fs / sos - t0 * fs).astype(np.float32)
+        # plane wave reaches the first element of the probe at t = 0
+        sin, cos = np.sin(self.tx_angles), np.cos(self.tx_angles)
+        tx_offset = np.where(sin >= 0, self.element_x.min() * sin, self.element_x.max() * sin)
+        tx_dist = (z_pix[np.newaxis, :] * cos[:, np.newaxis] + x_pix[np.newaxis, :] * sin[:, np.newaxis]
+                   - tx_offset[:, np.newaxis])
+        self.tx_delay = (tx_dist * fs / sos).astype(np.float32)
+        self.apodization = rx_apodization(x_pix, z_pix, self.element_x, f_number, window)
+
+    def _pool(self):
+        if self.executor is not None:
+            return self.executor
+        if self._own_executor is None:
+            self._own_executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        return self._own_executor
+
+    def close(self):
+        """ Shut down the pool created by the beamformer (a given executor is left running) """
+        if self._own_executor is not None:
+            self._own_executor.shutdown()
+            self._own_executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def image_shape(self):
+        return (len(self.x_axis), len(self.z_axis))
+
+    def _beamform_tile(self, rf, angle_index, tile, out):
+        n_samples, n_elements = rf.shape
+        delay = self.rx_delay[tile] + self.tx_delay[angle_index, tile, np.newaxis]
+        valid = (delay >= 0) & (delay <= n_samples - 1)
+        # the last sample is reached with i0 = n_samples - 2 and frac = 1
+        i0 = np.clip(np.floor(delay), 0, max(n_samples - 2, 0))
+        frac = delay - i0
+        i0 = i0.astype(np.intp)
+        # linear interpolation between neighbouring samples, gathered from the flat RF array
+        idx = np.where(valid, i0, 0) * n_elements + np.arange(n_elements)
+        rf_flat = rf.reshape(-1)
+        # a single-sample event has no next sample (frac is 0 there)
+        step = n_elements if n_samples > 1 else 0
+        samples = rf_flat[idx] * (1 - frac) + rf_flat[idx + step] * frac
+        samples *= self.apodization[tile]
+        samples[~valid] = 0
+        out[tile] += samples.sum(axis=1)
+
+    def beamform(self, rf, angle_index=0, out=None):
+        """
+        Beamformed RF image (x, z) of one transmit event.
+        ARGS:
+            rf - (RF sample x element) RF data of the transmit event
+            angle_index - index of the transmit angle in `tx_angles`
+            out - optional flat float32 accumulator (pixels) to add the result to
+        """
+        rf = np.ascontiguousarray(rf, dtype=np.float32)
+        n_pixels = self.rx_delay.shape[0]
+        if out is None:
+            out = np.zeros(n_pixels, dtype=np.float32)
+        tiles = [slice(i, min(i + self.tile_size, n_pixels)) for i in range(0, n_pixels, self.tile_size)]
+        if len(tiles) == 1:
+            self._beamform_tile(rf, angle_index, tiles[0], out)
+            return out.reshape(self.image_shape)
+        # tiles are disjoint, so the workers write to separate parts of `out`
+        list(self._pool().map(lambda tile: self._beamform_tile(rf, angle_index, tile, out), tiles))
+        return out.reshape(self.image_shape)
+
+    def compound(self, rf, angle_indices=None):
+        """ Coherent compounding (x, z) of transmit events rf[i] (RF sample x element) at angle_indices[i]. """
+        if angle_indices is None:
+            angle_indices = range(len(rf))
+        out = np.zeros(self.rx_delay.shape[0], dtype=np.float32)
+        for event, angle_index in zip(rf, angle_indices):
+            self.beamform(event, angle_index, out=out)
+        return out.reshape(self.image_shape)
+
+    def envelope(self, image):
+        """ Envelope of beamformed RF image(s) (Hilbert transform along z). """
+        return np.abs(hilbert(image, axis=-1)).astype(np.float32)
+
+    def reconstruct(self, rf, angle_sets):
+        """
+        Envelope frames (frame x X x Z), one per set of transmit events.
+        ARGS:
+            rf - (transmit event x RF sample x element) RF data, event i fired at tx_angles[i]
+            angle_sets - list of lists of event indices compounded into each frame
+        """
+        frames = np.empty((len(angle_sets),) + self.image_shape, dtype=np.float32)
+        for f, events in enumerate(angle_sets):
+            frames[f] = self.envelope(self.compound(rf[list(events)], events))
+        return frames
+
+    def save(self, file_path, frames, angle_sets):
+        """ Write envelope frames in the HDF5 layout read by US_RecoImage. """
+        save_reco_image(file_path, self.x_axis, self.z_axis, frames,
+                        [len(events) for events in angle_sets],
+                        receive_f_number=self.f_number, receive_apodization_window=self.window)
+
+
+def beamform_scanlines(rf, pitch, fs, sos, f_number=0., window='boxcar', sample_offset=0, n_workers=None):
+    """
+    DAS of linear-scan pulse-echo blocks (e.g. tx*rx*-v1-block.npy), replacing the undelayed
+    sum over RX channels: each scanline is beamformed along the axis of its own aperture.
+    ARGS:
+        rf - (scanline x RF sample x RX channel) data, e.g. US_RFDataset.rf
+        pitch - element pitch [m]
+        fs, sos - sampling frequency [Hz] and speed of sound [m/s]
+        sample_offset - index of the first RF sample in rf
+    Output:
+        (scanline x RF sample) beamformed RF on the depth grid z = sos * n / (2 * fs)
+    """
+    n_scan, n_samples, n_rx = rf.shape
+    element_x = (np.arange(n_rx) - (n_rx - 1) / 2) * pitch
+    z_axis = sos * (np.arange(n_samples) + sample_offset) / (2 * fs)
+    das = DAS_Beamformer(element_x, fs, sos, [0.], z_axis, f_number=f_number, window=window,
+                         t0=sample_offset / fs, tile_size=n_samples, n_workers=1)
+    # the unfocused transmit starts from the aperture centre (delay z / sos)
+    das.tx_delay[:] = (z_axis * fs / sos).astype(np.float32)
+
+    out = np.empty((n_scan, n_samples), dtype=np.float32)
+
+    def beamform_line(n):
+        out[n] = das.beamform(rf[n])[0]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        list(pool.map(beamform_line, range(n_scan)))
+    return out
@@ -2,11 +2,8 @@
 Helper visialization functions for display ultrasound A/B-scans
 """
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-from scipy.fft import fft, fftshift
-from scipy.signal import iirfilter, lfilter
 from envelop_detection import *
+from lod_rendering import lod_plot, lod_imshow
 
 # CONST
 SF = 65e6           # Sampling Frequency
@@ -21,11 +18,12 @@ def display_Ascan(data, norm=False, sample_offset=0):
         norm - True/False normalization
         sample_offset - scanline time axis offest in samples
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
     _, axs = plt.subplots(figsize=(12, 6))
-    if norm:
-        axs.plot(data[:] / np.max(data[:]))
-    else:
-        axs.plot(data[:])
+    # level-of-detail line: only about two points per pixel are drawn (zoom redraws)
+    lod_plot(axs, data, scale=1 / np.max(data) if norm else 1.)
     axs.set_title('RF scan-line')
     axs.set_xlabel('depth [mm]', loc='right')
     ticks_x = ticker.FuncFormatter(
@@ -35,8 +33,13 @@ def display_Ascan(data, norm=False, sample_offset=0):
 
 def display_Bmode_from_RF(data, dynamic_range=100, sample_offset=0):
     """ Display B-mode image from RF signal. """
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
     fig, axs = plt.subplots(figsize=(13, 8))
-    imB = axs.imshow(data.copy().T, cmap='viridis', aspect=0.05)
+    # level-of-detail image of the transposed view (no copy of the RF data); bipolar RF is
+    # reduced to its signed peak per block ('mean' would cancel the signal in the overview)
+    imB = lod_imshow(axs, data.T, mode='max-abs', cmap='viridis', aspect=0.05)
     fig.colorbar(imB)
     imB.set_clim(vmin=-dynamic_range, vmax=dynamic_range)
     axs.set_title('B-mode image')
@@ -47,7 +50,20 @@ def display_Bmode_from_RF(data, dynamic_range=100, sample_offset=0):
     axs.yaxis.set_major_formatter(ticks_y)
 
 
-def display_video_env_detect(data, selected_func, cutoff_freq=0.1*SF, dynamic_range=500, n_scan_display=1, sample_offset=0):
+def detect_envelope_scanlines(data, selected_func, cutoff_freq=0.1*SF, fs=SF):
+    """
+    Envelope Detection of all scanlines at once (no plotting).
+    ARGS:
+        data - matrix with RF signal (scanline x RF samples)
+        selected_func - asynchronous function selected from envelop_functions
+        cutoff_freq - cuttoff frequency for LP filter in selected_func
+        fs - sampling frequency of the RF samples
+    """
+    t = np.arange(data.shape[1])/fs
+    return selected_func(data, t, fs, cutoff_freq=cutoff_freq, display=0, axis=1)
+
+
+def display_video_env_detect(data, selected_func, cutoff_freq=0.1*SF, dynamic_range=500, n_scan_display=1, sample_offset=0, cache=None):
     """ 
     Display signal after Envelop Detection (aka 'Video')
     ARGS:
@@ -58,29 +74,28 @@ def display_video_env_detect(data, selected_func, cutoff_freq=0.1*SF, dynamic_ra
         dynamic range - max value to visualize (necessary for colorbar)
         n_scan_display - number of scan line which will be plotted
         sample_offset - sample from which signal should be cut to remove noise
+        cache - optional result_cache.ResultCache: envelopes are reused for identical data/parameters
     """
-    arrV = data.copy()
+    import matplotlib.pyplot as plt
 
-    for n_scan in range(data.shape[0]):
-
-        t = np.arange(len(data[n_scan, :]))/SF
-        if n_scan == n_scan_display:
-            output = selected_func(
-                data[n_scan, :], t, SF, cutoff_freq=cutoff_freq, display=1)
-        else:
-            output = selected_func(
-                data[n_scan, :], t, SF, cutoff_freq=cutoff_freq, display=0)
+    t = np.arange(data.shape[1])/SF
+    if cache is not None:
+        arrV = cache.call(detect_envelope_scanlines, np.asarray(data), selected_func, cutoff_freq=cutoff_freq)
+    else:
+        arrV = detect_envelope_scanlines(data, selected_func, cutoff_freq=cutoff_freq)
 
-        if n_scan == n_scan_display:
-            plt.figure(figsize=[6, 4])
-            plt.plot(1e6 * t, data[n_scan, :], label="Raw signal")
-            plt.plot(1e6 * t, output, label="Detected envelope")
-            plt.xlabel("Time [us]")  # [in microseconds]
-            plt.ylabel("Amplitude")
-            plt.legend(loc="lower center", bbox_to_anchor=[0.5, 1],
-                       ncol=2, fontsize="smaller")
+    if 0 <= n_scan_display < data.shape[0]:
+        # repeat detection on the selected scanline only to plot the intermediate steps
+        output = selected_func(
+            data[n_scan_display, :], t, SF, cutoff_freq=cutoff_freq, display=1)
 
-        arrV[n_scan, :] = output
+        plt.figure(figsize=[6, 4])
+        plt.plot(1e6 * t, data[n_scan_display, :], label="Raw signal")
+        plt.plot(1e6 * t, output, label="Detected envelope")
+        plt.xlabel("Time [us]")  # [in microseconds]
+        plt.ylabel("Amplitude")
+        plt.legend(loc="lower center", bbox_to_anchor=[0.5, 1],
+                   ncol=2, fontsize="smaller")
 
     display_Bmode_from_RF(
         arrV, dynamic_range=dynamic_range, sample_offset=sample_offset)
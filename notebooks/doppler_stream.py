@@ -0,0 +1,169 @@
+"""
+Streaming spectral processing of long CW Doppler audio recordings (WAV).
+
+The recording is read through a memory map in blocks, high-pass filtered by a causal
+"wall filter" whose state is carried between blocks, and cut into STFT frames as samples
+arrive. The power spectrogram is written to an on-disk .npy array (plus a .json sidecar
+with the parameters), so any time window can later be read back without recomputation.
+"""
+import json
+import os
+import numpy as np
+from scipy.io.wavfile import read as read_wav
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+
+def read_wav_blocks(file_path, block_size=2**16, channel=0):
+    """
+    Memory-mapped WAV reader.
+    Output:
+        fs - sampling frequency [Hz]
+        n_samples - length of the recording
+        blocks - generator of float32 blocks of the selected channel
+    """
+    fs, data = read_wav(file_path, mmap=True)
+    if data.ndim == 2:
+        data = data[:, channel]     # choose one channel if stereo file
+
+    def blocks():
+        for i in range(0, len(data), block_size):
+            yield np.asarray(data[i:i+block_size], dtype=np.float32)
+
+    return fs, len(data), blocks()
+
+
+class WallFilter:
+    """
+    Causal high-pass IIR "wall filter" (Butterworth, second-order sections)
+    with state carried from one block to the next.
+    Input:
+        fs:             sampling frequency [Hz]
+        cutoff_freq:    cutoff frequency [Hz] (removes the probe/wall movement signal)
+        order:          filter order
+    """
+    def __init__(self, fs, cutoff_freq=15, order=4):
+        self.sos = butter(order, cutoff_freq, btype='high', fs=fs, output='sos')
+        self.zi = None
+
+    def process(self, block):
+        if self.zi is None:
+            # start from steady state for the first sample -> no step transient
+            self.zi = sosfilt_zi(self.sos) * block[0]
+        out, self.zi = sosfilt(self.sos, block, zi=self.zi)
+        return out.astype(np.float32)
+
+
+class StreamingSpectrogram:
+    """
+    Incremental power spectrogram (STFT) with configurable window and overlap.
+    Frames are emitted as soon as NFFT samples are available; only the overlap is buffered.
+    Power is scaled as matplotlib's `specgram(..., mode='psd')` for positive frequencies
+    of the (two-sided) spectrum used in the ex2 notebook, so the same dB thresholds apply.
+    Input:
+        fs:             sampling frequency [Hz]
+        NFFT:           samples per frame
+        noverlap:       overlapping samples between frames (default NFFT/2)
+        window:         window function of length NFFT (default Hanning)
+    """
+    def __init__(self, fs, NFFT=256, noverlap=None, window=None):
+        self.fs = fs
+        self.NFFT = NFFT
+        self.noverlap = NFFT // 2 if noverlap is None else noverlap
+        self.step = NFFT - self.noverlap
+        self.window = (np.hanning(NFFT) if window is None else np.asarray(window)).astype(np.float32)
+        self.scale = 1 / (fs * np.sum(self.window.astype(np.float64)**2))
+        self.freqs = np.fft.rfftfreq(NFFT, 1 / fs)
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+    def n_frames(self, n_samples):
+        """ Number of frames of a signal with n_samples samples. """
+        return max((n_samples - self.noverlap) // self.step, 0)
+
+    def bins(self, n_frames):
+        """ Frame centre times [s] (as returned by specgram). """
+        return (self.NFFT / 2 + np.arange(n_frames) * self.step) / self.fs
+
+    def process(self, block):
+        """ Append samples, return the power of the completed frames (frame x frequency). """
+        buf = np.concatenate([self.buffer, block])
+        n = self.n_frames(len(buf))
+        if n == 0:
+            # not a complete frame yet (short block): keep everything for the next call
+            self.buffer = buf
+            return np.zeros((0, len(self.freqs)), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.NFFT)[:n * self.step:self.step]
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1))**2 * self.scale
+        self.buffer = buf[n * self.step:]
+        return power.astype(np.float32)
+
+
+class DopplerSpectrogram:
+    """
+    On-disk power spectrogram of a Doppler recording (frames stored as a .npy memory map)
+    Input:
+        file_path:      path of the .npy array (parameters in file_path + '.json')
+    Public properties:
+        power           memory-mapped array (frame x frequency)
+        Pxx             frequency x frame view (as returned by specgram)
+        freqs           frequency of every row of Pxx [Hz]
+        bins            time of every column of Pxx [s]
+        fs, NFFT, noverlap, cutoff_freq, source
+    """
+    def __init__(self, file_path):
+        with open(file_path + '.json') as f:
+            self.params = json.load(f)
+        self.__dict__.update(self.params)
+        self.file_path = file_path
+        self.power = np.load(file_path, mmap_mode='r')
+        stft = StreamingSpectrogram(self.fs, self.NFFT, self.noverlap)
+        self.freqs = stft.freqs
+        self.bins = stft.bins(self.power.shape[0])
+
+    @property
+    def Pxx(self):
+        return self.power.T
+
+    @classmethod
+    def compute(cls, wav_path, file_path=None, NFFT=1024, noverlap=None, cutoff_freq=15,
+                block_size=2**16, channel=0, cache=None):
+        """
+        Stream the WAV file through the wall filter and the STFT into file_path.
+        ARGS:
+            cutoff_freq - wall filter cutoff [Hz] (None: no filtering)
+            block_size - samples read per step (memory use is independent of the file length)
+            cache - optional result_cache.ResultCache: the spectrogram is stored in the cache
+                    (keyed by the WAV content and the parameters) instead of file_path
+        """
+        if cache is not None:
+            entry = cache.get_or_create(
+                ('DopplerSpectrogram', wav_path, NFFT, noverlap, cutoff_freq, channel),
+                lambda tmp: cls.compute(wav_path, os.path.join(tmp, 'spectrogram.npy'), NFFT,
+                                        noverlap, cutoff_freq, block_size, channel))
+            return cls(os.path.join(entry, 'spectrogram.npy'))
+
+        fs, n_samples, blocks = read_wav_blocks(wav_path, block_size, channel)
+        stft = StreamingSpectrogram(fs, NFFT, noverlap)
+        wall = WallFilter(fs, cutoff_freq) if cutoff_freq else None
+        n_frames = stft.n_frames(n_samples)
+        power = np.lib.format.open_memmap(file_path, mode='w+', dtype=np.float32,
+                                          shape=(n_frames, len(stft.freqs)))
+        i = 0
+        for block in blocks:
+            if wall is not None:
+                block = wall.process(block)
+            frames = stft.process(block)
+            power[i:i+len(frames)] = frames
+            i += len(frames)
+        power.flush()
+        del power
+
+        params = {'source': os.path.abspath(wav_path), 'fs': int(fs), 'NFFT': NFFT,
+                  'noverlap': stft.noverlap, 'cutoff_freq': cutoff_freq, 'channel': channel}
+        with open(file_path + '.json', 'w') as f:
+            json.dump(params, f, indent=2)
+        return cls(file_path)
+
+    def window(self, from_sec, duration=5):
+        """ (Pxx, freqs, bins) of the frames centred within [from_sec, from_sec + duration). """
+        start, stop = np.searchsorted(self.bins, [from_sec, from_sec + duration])
+        return np.asarray(self.power[start:stop]).T, self.freqs, self.bins[start:stop]
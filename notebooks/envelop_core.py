@@ -0,0 +1,185 @@
+"""
+Envelop Detection - signal processing core (no plotting, no matplotlib import).
+
+Every step works on a single A-scan or on a block of scanlines along `axis`.
+The functions with a `display` flag are in envelop_detection (built on this module).
+
+Code based on Rick Lyons, Digital Envelope Detection: The Good, the Bad, and the Ugly
+(https://www.dsprelated.com/showarticle/938.php)
+"""
+import math
+from functools import lru_cache
+import numpy as np
+from scipy.signal import iirfilter, lfilter, hilbert
+from precision import work_dtype
+
+DELAY = 10      # delay [samples] of the real branch in the complex methods
+
+
+@lru_cache(maxsize=64)
+def iir_lowpass(order, cutoff_freq, fs, dtype=np.float64):
+    """
+    Butterworth low-pass coefficients (b, a) of type dtype, cached by (order, cutoff_freq, fs, dtype).
+    The cached arrays are shared between callers, so they are read-only.
+    """
+    b, a = iirfilter(order, Wn=cutoff_freq, fs=fs, btype="low", ftype="butter")
+    b, a = b.astype(dtype), a.astype(dtype)
+    b.setflags(write=False)
+    a.setflags(write=False)
+    return b, a
+
+
+def axis_shift(sig, n, axis=-1, dtype=None):
+    """
+    Delay by n samples along `axis` only (other axes untouched), wrapping around as
+    scipy.ndimage.shift(mode='wrap'): the first n samples come from sig[-n-1:-1].
+    Done by slicing into a single output array (of type dtype, default: as sig).
+    """
+    sig = np.asarray(sig)
+    src = np.moveaxis(sig, axis, -1)
+    out = np.empty(src.shape, dtype=dtype or sig.dtype)
+    if n > 0:
+        out[..., n:] = src[..., :-n]
+        out[..., :n] = src[..., -n-1:-1]
+    elif n < 0:
+        out[..., :n] = src[..., -n:]
+        out[..., n:] = src[..., 1:1-n]
+    else:
+        out[...] = src
+    return np.moveaxis(out, -1, axis)
+
+
+# -- processing steps --
+
+# In single precision (precision.set_precision('single')) every step returns float32 and the
+# filter coefficients are float32, so lfilter does not promote the data back to float64.
+# With overwrite=True, the combining steps reuse their (temporary) inputs as output buffers.
+
+def lp_filter(sig, fs, cutoff_freq, axis=-1):
+    """ 3.order IIR low-pass filter """
+    dtype = work_dtype()
+    if dtype is None:
+        b, a = iir_lowpass(3, cutoff_freq, fs)
+    else:
+        b, a = iir_lowpass(3, cutoff_freq, fs, dtype)
+        sig = np.asarray(sig, dtype=dtype)
+    return lfilter(b, a, sig, axis=axis)
+
+
+def _step_dtype(sig):
+    """ Output type of the real steps: float32 in single precision; in double precision float64
+    for integer samples (no int16 overflow in abs/square), else numpy's promotion """
+    dtype = work_dtype()
+    if dtype is None and not np.issubdtype(np.asarray(sig).dtype, np.inexact):
+        dtype = np.float64
+    return dtype
+
+
+def rectify_half(sig):
+    return np.maximum(sig, 0, dtype=_step_dtype(sig))
+
+
+def rectify_full(sig):
+    return np.abs(sig, dtype=_step_dtype(sig))
+
+
+def square(sig):
+    return np.square(sig, dtype=_step_dtype(sig))
+
+
+def delay(sig, axis=-1):
+    # integer samples: same type as the quadrature branch
+    return axis_shift(sig, DELAY, axis=axis, dtype=_step_dtype(sig))
+
+
+def quadrature(sig, axis=-1):
+    """ Hilbert transformer output (imaginary part of the analytic signal) """
+    dtype = work_dtype()
+    if dtype is not None:
+        sig = np.asarray(sig, dtype=dtype)      # float32 FFT -> complex64 analytic signal
+    return np.imag(hilbert(sig, axis=axis))
+
+
+def abs_sum(s1, s2, overwrite=False):
+    if not overwrite:
+        return np.abs(s1) + np.abs(s2)
+    s1 = np.abs(s1, out=s1)
+    return np.add(s1, np.abs(s2, out=s2), out=s1)
+
+
+def magnitude(s1, s2, overwrite=False):
+    if not overwrite:
+        return np.sqrt(s1**2 + s2**2)
+    s1 = np.square(s1, out=s1)
+    s1 = np.add(s1, np.square(s2, out=s2), out=s1)
+    return np.sqrt(s1, out=s1)
+
+
+def log_compress(env, dynamic_range=60, axis=None):
+    """
+    B-mode [dB] of an envelope frame, normalized to its max (over `axis`, default: all)
+    and clipped to -dynamic_range
+    """
+    # LP-filtered envelopes can ring slightly below zero
+    env = np.abs(np.asarray(env, dtype=np.float32))
+    # an all-zero frame gives -dynamic_range, not 0/0
+    peak = np.maximum(np.max(env, axis=axis, keepdims=axis is not None), np.finfo(np.float32).tiny)
+    bmode = 20*np.log10(env / peak + np.float32(1e-12))
+    return np.maximum(bmode, np.float32(-dynamic_range), out=bmode)
+
+
+# -- complete detectors --
+
+def half_wave(AM, fs, cutoff_freq, axis=-1):
+    return lp_filter(rectify_half(AM), fs, cutoff_freq, axis)
+
+
+def full_wave(AM, fs, cutoff_freq, axis=-1):
+    return lp_filter(rectify_full(AM), fs, cutoff_freq, axis)
+
+
+def real_square_law(AM, fs, cutoff_freq, axis=-1):
+    y = lp_filter(square(AM), fs, cutoff_freq, axis)
+    return np.sqrt(y, out=y)
+
+
+def complex_hilbert(AM, fs, cutoff_freq, axis=-1):
+    return lp_filter(abs_sum(delay(AM, axis), quadrature(AM, axis), overwrite=True), fs, cutoff_freq, axis)
+
+
+def complex_square_law(AM, fs, cutoff_freq, axis=-1):
+    return lp_filter(magnitude(delay(AM, axis), quadrature(AM, axis), overwrite=True), fs, cutoff_freq, axis)
+
+
+# -- detectors with a local oscillator (synthetic AM signal generated from its parameters) --
+
+def am_signal(Ac, fc, m, ym, Am, t):
+    """ AM signal with the carrier phase used by the oscillator methods """
+    n = 2
+    phi = math.pi/2 + n*math.pi
+    yc_temp = Ac*np.cos(2*math.pi*fc*t+phi)
+    return yc_temp*m*ym/Am, phi
+
+
+def oscillator_components(AM_temp, fc, t, theta=0.):
+    """ In-phase / quadrature products with a local oscillator at fc/5 """
+    f0 = fc/5
+    return (AM_temp*np.cos(2*math.pi*f0*t + theta),
+            AM_temp*np.sin(2*math.pi*f0*t + theta))
+
+
+def synchronous_real(Ac, fc, m, ym, Am, t, fs, cutoff_freq):
+    AM_temp, phi = am_signal(Ac, fc, m, ym, Am, t)
+    return lp_filter(AM_temp*np.cos(2*math.pi*fc*t+phi), fs, cutoff_freq)
+
+
+def complex_V1_osci(Ac, fc, m, ym, Am, t, fs, cutoff_freq):
+    AM_temp, _ = am_signal(Ac, fc, m, ym, Am, t)
+    s1, s2 = oscillator_components(AM_temp, fc, t)
+    return magnitude(lp_filter(s1, fs, cutoff_freq), lp_filter(s2, fs, cutoff_freq), overwrite=True)
+
+
+def complex_V2_osci(Ac, fc, m, ym, Am, t, fs, cutoff_freq):
+    AM_temp, _ = am_signal(Ac, fc, m, ym, Am, t)
+    s1, s2 = oscillator_components(AM_temp, fc, t, theta=math.pi/4)
+    return lp_filter(magnitude(s1, s2, overwrite=True), fs, cutoff_freq)
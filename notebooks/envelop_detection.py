@@ -1,215 +1,142 @@
 """
 Envelop Detection functions.
 
+The processing is done by envelop_core (no matplotlib); with display=1 the intermediate
+steps are plotted by envelop_plots, which is imported only at that moment.
+
 Code based on Rick Lyons, Digital Envelope Detection: The Good, the Bad, and the Ugly
 (https://www.dsprelated.com/showarticle/938.php)
 """
-import math
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fft import fft, fftshift
-from scipy.signal import iirfilter, lfilter, hilbert
-from scipy.ndimage import shift
+import envelop_core as core
 
 
-def LP_filtration(sig, t, fs, cutoff_freq, disp_option=0, raw_sig=[]):
-    # spectrum analysis (to help to determine the appropriate cutoff frequency)
+def _plots():
+    import envelop_plots
+    return envelop_plots
+
 
+def LP_filtration(sig, t, fs, cutoff_freq, disp_option=0, raw_sig=[], axis=-1):
+    # sig can be a single A-scan or a (n_scanlines, n_samples) block filtered along `axis`
+    # spectrum analysis (to help to determine the appropriate cutoff frequency)
     if disp_option:
-        L = len(t)
-        fft_sig = fftshift(fft(sig))
-        freqs = np.arange(-L/2, L/2)*fs/L
-        ps = np.abs(fft_sig)**2
-        fig, axs = plt.subplots(figsize=[6, 4])
-        axs.plot(freqs, ps)
-        axs.set_title('Spectrum analysis')
-        axs.set_ylabel('Power')
-        axs.set_xlabel('Frequency [Hz]')
+        _plots().plot_spectrum(sig, t, fs, axis)
 
     # 3.order IIR low-pass filter
-    b, a = iirfilter(3, Wn=cutoff_freq, fs=fs, btype="low", ftype="butter")
-    y_filtered = lfilter(b, a, sig)
+    y_filtered = core.lp_filter(sig, fs, cutoff_freq, axis)
 
     if len(raw_sig) and disp_option:
-        plt.figure(figsize=[6.4, 3.4])
-        plt.plot(t, raw_sig, label="Raw signal")
-        plt.plot(t, y_filtered, label="LP filter (detected envelope)")
-        plt.xlabel("Time [s]")
-        plt.ylabel("Amplitude")
-        plt.legend(loc="lower center", bbox_to_anchor=[0.5, 1],
-                   ncol=2, fontsize="smaller")
+        _plots().plot_envelope(t, raw_sig, y_filtered, "LP filter (detected envelope)")
 
     return y_filtered
 
 
-def asynchronous_half_wave(AM, t, fs, cutoff_freq, display=1):
-    sig = AM.copy()
-
+def asynchronous_half_wave(AM, t, fs, cutoff_freq, display=1, axis=-1):
     # 1. thresholding to get half-wave rectified sinusoid
-    sig[sig < 0] = 0
+    sig = core.rectify_half(AM)
     if display == 1:
-        fig, axs = plt.subplots(figsize=[6, 4])
-        axs.plot(t, sig)
-        axs.set_title('Half-wave rectified sinusoid')
-        axs.set_xlabel('Time [s]')
+        _plots().plot_signal(t, sig, 'Half-wave rectified sinusoid')
 
     # 2. determine the appropriate cutoff frequency for LP filter and
     # 3. third-order IIR low-pass filter
-    return LP_filtration(sig, t, fs, cutoff_freq, display, sig)
-
+    return LP_filtration(sig, t, fs, cutoff_freq, display, sig, axis=axis)
 
-def asynchronous_full_wave(AM, t, fs, cutoff_freq, display=1):
-    sig = AM.copy()
 
+def asynchronous_full_wave(AM, t, fs, cutoff_freq, display=1, axis=-1):
     # 1. absolute value to get full-wave rectified sinusoid
-    sig = np.abs(sig)
+    sig = core.rectify_full(AM)
     if display == 1:
-        fig, axs = plt.subplots(figsize=[6, 4])
-        axs.plot(t, sig)
-        axs.set_title('Full-wave rectified sinusoid')
-        axs.set_xlabel('Time [s]')
+        _plots().plot_signal(t, sig, 'Full-wave rectified sinusoid')
 
     # 2. determine the appropriate cutoff frequency for LP filter and
     # 3. third-order IIR low-pass filter
-    return LP_filtration(sig, t, fs, cutoff_freq, display, sig)
+    return LP_filtration(sig, t, fs, cutoff_freq, display, sig, axis=axis)
 
 
-def asynchronous_real_square_law(AM, t, fs, cutoff_freq, display=1):
-    sig = AM.copy()
-
+def asynchronous_real_square_law(AM, t, fs, cutoff_freq, display=1, axis=-1):
     # 1. RF squared
-    sig = sig**2
+    sig = core.square(AM)
     if display == 1:
-        fig, axs = plt.subplots(figsize=[6, 4])
-        axs.plot(t, sig)
-        axs.set_title('RF squared')
-        axs.set_xlabel('Time [s]')
+        _plots().plot_signal(t, sig, 'RF squared')
 
     # 2. determine the appropriate cutoff frequency for LP filter and
     # 3. third-order IIR low-pass filter
-    y_filtered = LP_filtration(sig, t, fs, cutoff_freq, display)
+    y_filtered = LP_filtration(sig, t, fs, cutoff_freq, display, axis=axis)
 
-    # 4. square root
-    output = np.sqrt(y_filtered)
+    # 4. square root (in place: y_filtered is a temporary)
+    output = np.sqrt(y_filtered, out=y_filtered)
 
     if display == 1:
-        plt.figure(figsize=[6.4, 3.4])
-        plt.plot(t, sig, label="Raw signal")
-        plt.plot(t, output, label="Detected envelope")
-        plt.xlabel("Time [s]")
-        plt.ylabel("Amplitude")
-        plt.legend(loc="lower center", bbox_to_anchor=[0.5, 1],
-                   ncol=2, fontsize="smaller")
+        _plots().plot_envelope(t, sig, output)
 
     return output
 
 
-def asynchronous_complex_hilbert(AM, t, fs, cutoff_freq, display=1):
-    sig = AM.copy()
-
+def asynchronous_complex_hilbert(AM, t, fs, cutoff_freq, display=1, axis=-1):
     # 1. delay + absolute value
-    s1 = shift(sig, 10, mode='wrap')
+    s1 = core.delay(AM, axis=axis)
     if display == 1:
-        fig, axs = plt.subplots(figsize=[6, 4])
-        axs.plot(t, sig, 'red', label='original signal')
-        axs.plot(t, s1, label='delayed signal')
-        axs.legend(loc="best")
-        axs.set_xlabel('Time [s]')
+        _plots().plot_delayed(t, AM, s1)
 
     # 2. FIR Hilbert transformer + absolute value
-    s1 = np.abs(s1)
-    s2 = np.imag(hilbert(sig))
-    s2 = np.abs(s2)
-
-    # 3. add 2 components + LP filter
-    return LP_filtration(s1+s2, t, fs, cutoff_freq, display, sig)
+    s2 = core.quadrature(AM, axis=axis)
 
+    # 3. add 2 components (in the s1 buffer) + LP filter
+    return LP_filtration(core.abs_sum(s1, s2, overwrite=True), t, fs, cutoff_freq, display, AM, axis=axis)
 
-def asynchronous_complex_square_law(AM, t, fs, cutoff_freq, display=1):
-    sig = AM.copy()
 
+def asynchronous_complex_square_law(AM, t, fs, cutoff_freq, display=1, axis=-1):
     # 1. delay
-    s1 = shift(sig, 10, mode='wrap')
+    s1 = core.delay(AM, axis=axis)
     if display == 1:
-        fig, axs = plt.subplots(figsize=[6, 4])
-        axs.plot(t, sig, 'red', label='original signal')
-        axs.plot(t, s1, label='delayed signal')
-        axs.legend(loc="best")
-        axs.set_xlabel('Time [s]')
+        _plots().plot_delayed(t, AM, s1)
 
     # 2. FIR Hilbert transformer + value to the power
-    s1 = s1**2
-    s2 = np.imag(hilbert(sig))
-    s2 = s2**2
+    s2 = core.quadrature(AM, axis=axis)
 
-    # 3. add 2 components + fet square root
-    sig_sqroot = np.sqrt(s1+s2)
+    # 3. add 2 components + fet square root (in the s1 buffer)
+    sig_sqroot = core.magnitude(s1, s2, overwrite=True)
 
     # 4. LP filter
-    return LP_filtration(sig_sqroot, t, fs, cutoff_freq, display, sig)
+    return LP_filtration(sig_sqroot, t, fs, cutoff_freq, display, AM, axis=axis)
 
 
 def synchronous_real(Ac, fc, m, ym, Am, t, fs, cutoff_freq, display=1):
-
-    n = 2
-    phi = math.pi/2 + n*math.pi
-    yc_temp = Ac*np.cos(2*math.pi*fc*t+phi)
-    AM_temp = yc_temp*m*ym/Am
+    AM_temp, phi = core.am_signal(Ac, fc, m, ym, Am, t)
 
     # 1. multiplication by a local oscillator signal
-    sig = AM_temp*np.cos(2*math.pi*fc*t+phi)
+    sig = AM_temp*np.cos(2*np.pi*fc*t+phi)
 
     # 2. LP filter
     return LP_filtration(sig, t, fs, cutoff_freq, display, AM_temp)
 
 
 def asynchronous_complex_V1_osci(Ac, fc, m, ym, Am, t, fs, cutoff_freq, display=1):
-
-    n = 2
-    phi = math.pi/2 + n*math.pi
-    yc_temp = Ac*np.cos(2*math.pi*fc*t+phi)
-    AM_temp = yc_temp*m*ym/Am
+    AM_temp, _ = core.am_signal(Ac, fc, m, ym, Am, t)
 
     # 1. extract 2 components
-    f0 = fc/5
-    s1 = AM_temp*np.cos(2*math.pi*f0*t)
-    s2 = AM_temp*np.sin(2*math.pi*f0*t)
+    s1, s2 = core.oscillator_components(AM_temp, fc, t)
 
     # 2. LP filter
     s1_filtered = LP_filtration(s1, t, fs, cutoff_freq, display)
     s2_filtered = LP_filtration(s2, t, fs, cutoff_freq, display)
 
     # 3. add squared component and extract envelope
-    sig = s1_filtered ** 2 + s2_filtered**2
-    output = np.sqrt(sig)
+    output = core.magnitude(s1_filtered, s2_filtered)
     if display == 1:
-        plt.figure(figsize=[6.4, 3.4])
-        plt.plot(t, AM_temp, label="Raw signal")
-        plt.plot(t, output, label="Detected envelope)")
-        plt.xlabel("Time [s]")
-        plt.ylabel("Amplitude")
-        plt.legend(loc="lower center", bbox_to_anchor=[0.5, 1],
-                   ncol=2, fontsize="smaller")
+        _plots().plot_envelope(t, AM_temp, output, "Detected envelope)")
 
     return output
 
 
 def asynchronous_complex_V2_osci(Ac, fc, m, ym, Am, t, fs, cutoff_freq, display=1):
-
-    n = 2
-    phi = math.pi/2 + n*math.pi
-    yc_temp = Ac*np.cos(2*math.pi*fc*t+phi)
-    AM_temp = yc_temp*m*ym/Am
+    AM_temp, _ = core.am_signal(Ac, fc, m, ym, Am, t)
 
     # 1. extract 2 components
-    f0 = fc/5
-    theta = math.pi/4
-    s1 = AM_temp*np.cos(2*math.pi*f0*t + theta)
-    s2 = AM_temp*np.sin(2*math.pi*f0*t + theta)
+    s1, s2 = core.oscillator_components(AM_temp, fc, t, theta=np.pi/4)
 
     # 2. add squared component
-    sig = s1**2 + s2**2
-    sig = np.sqrt(sig)
+    sig = core.magnitude(s1, s2)
 
     # 3. LP filter
     return LP_filtration(sig, t, fs, cutoff_freq, display, AM_temp)
@@ -0,0 +1,47 @@
+"""
+Envelop Detection - visualization of the intermediate steps.
+
+Imported lazily by envelop_detection (only when display=1), so that the processing
+functions can be used without loading matplotlib.
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.fft import fft, fftshift
+
+
+def plot_spectrum(sig, t, fs, axis=-1):
+    """ Spectrum analysis (to help to determine the appropriate cutoff frequency) """
+    L = len(t)
+    fft_sig = fftshift(fft(sig, axis=axis), axes=axis)
+    freqs = np.arange(-L/2, L/2)*fs/L
+    ps = np.abs(fft_sig)**2
+    fig, axs = plt.subplots(figsize=[6, 4])
+    axs.plot(freqs, ps)
+    axs.set_title('Spectrum analysis')
+    axs.set_ylabel('Power')
+    axs.set_xlabel('Frequency [Hz]')
+
+
+def plot_signal(t, sig, title):
+    fig, axs = plt.subplots(figsize=[6, 4])
+    axs.plot(t, sig)
+    axs.set_title(title)
+    axs.set_xlabel('Time [s]')
+
+
+def plot_delayed(t, sig, delayed):
+    fig, axs = plt.subplots(figsize=[6, 4])
+    axs.plot(t, sig, 'red', label='original signal')
+    axs.plot(t, delayed, label='delayed signal')
+    axs.legend(loc="best")
+    axs.set_xlabel('Time [s]')
+
+
+def plot_envelope(t, raw_sig, envelope, label="Detected envelope"):
+    plt.figure(figsize=[6.4, 3.4])
+    plt.plot(t, raw_sig, label="Raw signal")
+    plt.plot(t, envelope, label=label)
+    plt.xlabel("Time [s]")
+    plt.ylabel("Amplitude")
+    plt.legend(loc="lower center", bbox_to_anchor=[0.5, 1],
+               ncol=2, fontsize="smaller")
@@ -2,79 +2,164 @@
 Helper functions for envelop detection
 """
 import numpy as np
-from scipy.interpolate import interp1d
+from scipy.linalg import solve_banded
+
+
+def _chunk_extrema(s, rows, cols, d, pick_max):
+    """
+    Global extremum of every d-chunk of the candidate positions (rows, cols) of s, chunks
+    restarting on every row (vectorized counterpart of argmin/argmax over each chunk).
+    """
+    if d == 1 or len(cols) == 0:
+        return rows, cols
+    values = s[rows, cols]
+
+    # chunk number of every candidate: (first chunk of its row) + (rank within the row) // d
+    counts = np.bincount(rows, minlength=s.shape[0])
+    rank = np.arange(len(cols)) - (np.cumsum(counts) - counts)[rows]
+    chunks_per_row = -(-counts // d)
+    chunk_id = (np.cumsum(chunks_per_row) - chunks_per_row)[rows] + rank // d
+
+    starts = np.flatnonzero(np.diff(chunk_id, prepend=-1))
+    extreme = (np.maximum if pick_max else np.minimum).reduceat(values, starts)[chunk_id]
+    # first position reaching the chunk extremum (a NaN wins, as with argmin/argmax)
+    hit = np.flatnonzero((values == extreme) | (np.isnan(extreme) & np.isnan(values)))
+    _, first = np.unique(chunk_id[hit], return_index=True)
+    return rows[hit[first]], cols[hit[first]]
+
+
+def _split_rows(n_rows, rows, cols):
+    """ List with the (sorted) column indices of every row. """
+    return np.split(cols, np.cumsum(np.bincount(rows, minlength=n_rows))[:-1])
+
 
 def hl_envelopes_idx(s, dmin=1, dmax=1, split=False):
     """
     Input :
     s: 1d-array, data signal from which to extract high and low envelopes
+       (2d-array: batch of signals, one per row)
     dmin, dmax: int, optional, size of chunks, use this if the size of the input signal is too big
     split: bool, optional, if True, split the signal in half along its mean, might help to generate the envelope in some cases
     Output :
     lmin,lmax : high/low envelope idx of input signal s
+                (2d-array input: lists with the indices of every row)
     """
+    s = np.asarray(s)
+    s2d = np.atleast_2d(s)
 
-    # locals min
-    lmin = (np.diff(np.sign(np.diff(s))) > 0).nonzero()[0] + 1
-    # locals max
-    lmax = (np.diff(np.sign(np.diff(s))) < 0).nonzero()[0] + 1
+    # locals min / max
+    slope = np.diff(np.sign(np.diff(s2d, axis=1)), axis=1)
+    min_rows, min_cols = (slope > 0).nonzero()
+    max_rows, max_cols = (slope < 0).nonzero()
+    min_cols += 1
+    max_cols += 1
 
     if split:
         # s_mid is zero if s centered around x-axis or more generally mean of signal
-        s_mid = np.mean(s)
+        s_mid = np.mean(s2d, axis=1)
         # pre-sorting of locals min based on relative position with respect to s_mid
-        lmin = lmin[s[lmin] < s_mid]
+        keep = s2d[min_rows, min_cols] < s_mid[min_rows]
+        min_rows, min_cols = min_rows[keep], min_cols[keep]
         # pre-sorting of local max based on relative position with respect to s_mid
-        lmax = lmax[s[lmax] > s_mid]
+        keep = s2d[max_rows, max_cols] > s_mid[max_rows]
+        max_rows, max_cols = max_rows[keep], max_cols[keep]
 
     # global min of dmin-chunks of locals min
-    lmin = lmin[[i+np.argmin(s[lmin[i:i+dmin]])
-                 for i in range(0, len(lmin), dmin)]]
+    min_rows, min_cols = _chunk_extrema(s2d, min_rows, min_cols, dmin, pick_max=False)
     # global max of dmax-chunks of locals max
-    lmax = lmax[[i+np.argmax(s[lmax[i:i+dmax]])
-                 for i in range(0, len(lmax), dmax)]]
-    return lmin, lmax
+    max_rows, max_cols = _chunk_extrema(s2d, max_rows, max_cols, dmax, pick_max=True)
+
+    if s.ndim == 1:
+        return min_cols, max_cols
+    n_rows = s2d.shape[0]
+    return _split_rows(n_rows, min_rows, min_cols), _split_rows(n_rows, max_rows, max_cols)
+
 
 def get_envelope(x, y):
-    x_list, y_list = list(x), list(y)
-    assert len(x_list) == len(y_list)
-
-    # First data
-    ui, ux, uy = [0], [x_list[0]], [y_list[0]]
-    li, lx, ly = [0], [x_list[0]], [y_list[0]]
-
-    # Find upper peaks and lower peaks
-    for i in range(1, len(x_list)-1):
-        if y_list[i] >= y_list[i-1] and y_list[i] >= y_list[i+1]:
-            ui.append(i)
-            ux.append(x_list[i])
-            uy.append(y_list[i])
-        if y_list[i] <= y_list[i-1] and y_list[i] <= y_list[i+1]:
-            li.append(i)
-            lx.append(x_list[i])
-            ly.append(y_list[i])
-
-    # Last data
-    ui.append(len(x_list)-1)
-    ux.append(x_list[-1])
-    uy.append(y_list[-1])
-    li.append(len(y_list)-1)
-    lx.append(x_list[-1])
-    ly.append(y_list[-1])
-
-    if len(ux) == 2 or len(lx) == 2:
-        return [], []
-
-    else:
-        func_ub = interp1d(ux, uy, kind='cubic', bounds_error=False)
-        func_lb = interp1d(lx, ly, kind='cubic', bounds_error=False)
-
-        ub, lb = [], []
-        for i in x_list:
-            ub = func_ub(x_list)
-            lb = func_lb(x_list)
-
-        ub = np.array([y, ub]).max(axis=0)
-        lb = np.array([y, lb]).min(axis=0)
-
-        return ub, lb
+    """
+    Upper/lower envelopes of y(x): cubic interpolation through the local maxima/minima
+    (end points included), clipped so that lb <= y <= ub.
+    y can be a 2d-array (one signal per row sharing x), interpolated in one pass: rows with
+    fewer than 4 maxima or minima (end points included) are then NaN.
+    Returns [], [] for such a 1d signal.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    assert x.shape[-1] == y.shape[-1]
+    y2d = np.atleast_2d(y)
+    upper, lower = _peak_masks(y2d)
+    # a cubic (not-a-knot) spline needs 4 knots
+    valid = (upper.sum(axis=1) >= 4) & (lower.sum(axis=1) >= 4)
+    upper &= valid[:, np.newaxis]
+    lower &= valid[:, np.newaxis]
+    ub = np.maximum(y2d, _interp_envelope(x, y2d, upper))
+    lb = np.minimum(y2d, _interp_envelope(x, y2d, lower))
+    if y.ndim == 1:
+        return (ub[0], lb[0]) if valid[0] else ([], [])
+    return ub, lb
+
+
+def _peak_masks(y):
+    """ Upper/lower peak masks along the last axis (first and last sample always included). """
+    upper = np.ones(y.shape, dtype=bool)
+    lower = np.ones(y.shape, dtype=bool)
+    mid = y[..., 1:-1]
+    upper[..., 1:-1] = (mid >= y[..., :-2]) & (mid >= y[..., 2:])
+    lower[..., 1:-1] = (mid <= y[..., :-2]) & (mid <= y[..., 2:])
+    return upper, lower
+
+
+def _interp_envelope(x, y, knots):
+    """
+    Not-a-knot cubic spline through y[r, knots[r]] (as interp1d(kind='cubic')) evaluated on x,
+    for all rows r at once: the second derivatives of every row come from one tridiagonal
+    block-diagonal system. Rows with fewer than 4 knots are NaN.
+    """
+    n_rows, n = y.shape
+    counts = knots.sum(axis=1)
+    out = np.full((n_rows, n), np.nan)
+    valid = counts >= 4
+    if not valid.any():
+        return out
+    rows, cols = np.nonzero(knots & valid[:, np.newaxis])
+    xs = x[cols].astype(np.float64)
+    ys = y[rows, cols].astype(np.float64)
+    size = len(cols)
+    first = (np.cumsum(counts) - counts)[valid]         # index of the first knot of every row
+    first_of = np.zeros(n_rows, dtype=np.int64)
+    first_of[valid] = first
+    pos = np.arange(size) - first_of[rows]
+    last = pos == counts[rows] - 1
+
+    # second derivatives M: continuity of the first derivative at the inner knots and
+    # continuity of the third derivative at the second and last-but-one knots (not-a-knot);
+    # the not-a-knot rows are combined with their neighbour to keep the system tridiagonal
+    h = np.diff(xs, append=np.nan)
+    slope = np.diff(ys, append=np.nan) / h
+    k = np.arange(size)
+    i = k[(pos > 0) & ~last]
+    start, end = k[pos == 0], k[last]
+    sub, diag, sup, rhs = np.zeros(size), np.zeros(size), np.zeros(size), np.zeros(size)
+    sub[i], diag[i], sup[i] = h[i-1], 2*(h[i-1] + h[i]), h[i]
+    rhs[i] = 6*(slope[i] - slope[i-1])
+    h0, h1 = h[start], h[start+1]
+    diag[start] = h1 - h0**2/h1
+    sup[start] = -(h0 + h1)*(1 + 2*h0/h1)
+    rhs[start] = -h0/h1*rhs[start+1]
+    h_last, h_prev = h[end-1], h[end-2]
+    sub[end] = -(h_last + h_prev)*(1 + 2*h_last/h_prev)
+    diag[end] = h_prev - h_last**2/h_prev
+    rhs[end] = -h_last/h_prev*rhs[end-1]
+    ab = np.stack([np.roll(sup, 1), diag, np.roll(sub, -1)])
+    M = solve_banded((1, 1), ab, rhs, overwrite_ab=True, overwrite_b=True, check_finite=False)
+
+    # polynomial of every interval in b = x - x_j (Horner), evaluated for all samples at once;
+    # interval of a sample = number of knots up to it - 1
+    c3 = (np.diff(M, append=np.nan)) / (6*h)
+    c2 = M / 2
+    c1 = slope - h*(2*M + np.roll(M, -1))/6
+    j = np.cumsum(knots[valid], axis=1) - 1
+    j = np.clip(j, 0, counts[valid, np.newaxis] - 2) + first[:, np.newaxis]
+    b = x - xs[j]
+    out[valid] = ((c3[j]*b + c2[j])*b + c1[j])*b + ys[j]
+    return out
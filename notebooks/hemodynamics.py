@@ -0,0 +1,129 @@
+"""
+Hemodynamic indices from CW Doppler spectrograms (ex2).
+
+Maximum-velocity trace, systolic peaks (PSV) / end-diastolic minima (EDV) and the
+MV, PSV, EDV, RI, PI indices, for one recording or for a batch of recordings.
+"""
+import math
+import numpy as np
+from scipy.interpolate import interp1d
+from scipy.signal import butter, filtfilt, find_peaks
+from extern_functions import hl_envelopes_idx
+
+# CONST
+SPEED_OF_SOUND = 1540   # [m/s]
+THETA = 0               # angle correction [rad]
+F0 = 8e6                # ultrasound trasmit frequency [Hz]
+
+
+def convert_to_velo(f, speed_of_sound=SPEED_OF_SOUND, f0=F0, theta=THETA):
+    """ Doppler frequency [Hz] -> velocity [cm/s] """
+    return 100*speed_of_sound*f/(2*f0*math.cos(theta))
+
+
+def max_velocity_trace(Pxx_dB, freqs, threshold=39):
+    """
+    Highest frequency with power above threshold in every time bin (freqs[0] if none).
+    ARGS:
+        Pxx_dB - (frequency x time) spectrogram in dB, or a (recording x frequency x time) batch
+        freqs - frequency of every row of Pxx_dB (increasing)
+        threshold - power threshold [dB]
+    """
+    above = np.asarray(Pxx_dB) > threshold
+    n_freqs = above.shape[-2]
+    # last row above threshold = first hit of the reversed mask
+    last = n_freqs - 1 - np.argmax(above[..., ::-1, :], axis=-2)
+    last[~above.any(axis=-2)] = 0
+    return np.asarray(freqs)[last]
+
+
+def cardiac_points(bins, trace, fs=None, lowpass_freq=15, max_heart_rate=100):
+    """
+    Systolic peaks and end-diastolic minima of a maximum-velocity trace.
+    ARGS:
+        bins - time of every trace sample [s] (regularly spaced)
+        trace - max-velocity (frequency) trace, see max_velocity_trace
+        fs - rate [Hz] of the interpolated envelope (default: the rate of the trace, so the
+             grid falls on its samples; the ex2 notebook used the audio rate)
+        lowpass_freq - cutoff [Hz] of the envelope filter
+        max_heart_rate - sets the minimal distance between peaks [bpm]
+    Output:
+        dict with the envelope samples (env_time, env_val), the interpolated (time, envelope)
+        and filtered envelope, and the indices of the peaks (PSV) and minima (EDV) in `time`
+    """
+    bins = np.asarray(bins)
+    trace = np.asarray(trace)
+    if fs is None:
+        fs = 1 / np.median(np.diff(bins)) if len(bins) > 1 else 0.
+    if not fs > 2*lowpass_freq:
+        raise ValueError(f'envelope rate {fs} Hz too low for a {lowpass_freq} Hz low-pass filter')
+
+    # detect ENVELOP from the traced values
+    _, lmax = hl_envelopes_idx(trace)
+    if len(lmax) < 2:
+        raise ValueError(f'trace of {len(trace)} samples has {len(lmax)} local maxima, '
+                         'at least 2 are needed for the envelope')
+    env_time = bins[lmax]
+    env_val = trace[lmax]
+
+    # ENVELOP's interpolation and filtration
+    time = np.arange(env_time[0], env_time[-1], 1/fs)
+    envelope = interp1d(env_time, env_val)(time)
+    b, a = butter(3, 2*lowpass_freq/fs, btype='low', analog=False)
+    filtered = filtfilt(b, a, envelope)
+
+    # minimal distance in samples between searched peaks
+    dist = round(60/max_heart_rate*fs)
+    peaks, _ = find_peaks(envelope, distance=dist)
+    minima, _ = find_peaks(-filtered, distance=dist)
+
+    # keep minima lying less than 0.5 s before the following peak
+    following = np.searchsorted(peaks, minima, side='right')
+    has_peak = following < len(peaks)
+    keep = np.zeros(len(minima), dtype=bool)
+    keep[has_peak] = minima[has_peak] > peaks[following[has_peak]] - 0.5*fs
+    minima = minima[keep]
+
+    return {'env_time': env_time, 'env_val': env_val, 'time': time, 'envelope': envelope,
+            'filtered': filtered, 'peaks': peaks, 'minima': minima}
+
+
+def hemodynamic_metrics(points, **velo_params):
+    """
+    MV, PSV, EDV [cm/s] and RI, PI from cardiac_points output
+    (velo_params are passed to convert_to_velo).
+    """
+    env_val = points['env_val'].astype(float)
+    env_val[env_val == 0] = np.nan
+    MV = np.nanmean(convert_to_velo(env_val, **velo_params))
+    PSV = np.mean(convert_to_velo(points['envelope'][points['peaks']], **velo_params))
+    EDV = np.mean(convert_to_velo(points['filtered'][points['minima']], **velo_params))
+    return {'MV': MV, 'PSV': PSV, 'EDV': EDV, 'RI': (PSV-EDV)/PSV, 'PI': (PSV-EDV)/MV}
+
+
+def analyze_recordings(spectrograms, freqs, bins, threshold=39, fs=None, **velo_params):
+    """
+    Traces, cardiac points and metrics for many recordings in one call.
+    ARGS:
+        spectrograms - list of (frequency x time) dB spectrograms (or a 3d array) sharing freqs
+        freqs - frequency of the spectrogram rows
+        bins - time bins, shared (1d) or one vector per recording
+        fs - envelope rate passed to cardiac_points (default: the rate of the bins)
+    Output:
+        list of dicts: cardiac_points output + 'trace' + 'metrics'
+    """
+    shapes = {np.shape(s) for s in spectrograms}
+    if len(shapes) == 1:
+        # equal sizes -> one vectorized pass for all traces
+        traces = max_velocity_trace(np.stack(spectrograms), freqs, threshold)
+    else:
+        traces = [max_velocity_trace(s, freqs, threshold) for s in spectrograms]
+    shared_bins = np.ndim(bins[0]) == 0
+
+    results = []
+    for n, trace in enumerate(traces):
+        points = cardiac_points(bins if shared_bins else bins[n], trace, fs=fs)
+        points['trace'] = trace
+        points['metrics'] = hemodynamic_metrics(points, **velo_params)
+        results.append(points)
+    return results
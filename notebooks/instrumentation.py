@@ -0,0 +1,261 @@
+"""
+Opt-in per-call instrumentation of the processing chain.
+
+Nothing is wrapped until `enable()` is called: the key functions of the processing modules
+(IIR filter, Hilbert transform, detectors, HDF5 frame reads, CNR masks/scores, envelope
+extraction, plotting) are then replaced by timing wrappers, and `disable()` puts the
+originals back. Disabled, the instrumentation costs nothing.
+
+Every call records its wall time (and self time without instrumented callees), the
+size of the array arguments and result and, with memory=True, the peak of the memory
+allocated during the call (tracemalloc, slower; the peak is process-wide, so measured calls
+from different threads run one at a time). Results are available as a text report
+and as a Chrome trace-event file (chrome://tracing, https://ui.perfetto.dev).
+
+Example:
+    import instrumentation
+    with instrumentation.profile() as prof:
+        display_video_env_detect(arr_new, asynchronous_full_wave)
+    print(prof.report())
+    prof.write_trace('trace.json')
+"""
+import functools
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+# module -> instrumented functions / methods
+TARGETS = {
+    'envelop_core': ['lp_filter', 'quadrature', 'delay', 'rectify_half', 'rectify_full', 'square',
+                     'abs_sum', 'magnitude'],
+    'envelop_detection': ['LP_filtration', 'asynchronous_half_wave', 'asynchronous_full_wave',
+                          'asynchronous_real_square_law', 'asynchronous_complex_hilbert',
+                          'asynchronous_complex_square_law', 'synchronous_real',
+                          'asynchronous_complex_V1_osci', 'asynchronous_complex_V2_osci'],
+    'envelop_plots': ['plot_spectrum', 'plot_signal', 'plot_delayed', 'plot_envelope'],
+    'us_classes': ['US_FrameReader.__getitem__', 'US_RecoImage.__init__', 'US_Phantom.__init__',
+                   'US_ContrastEngine._build_regions', 'US_ContrastEngine.bmode',
+                   'US_ContrastEngine.score', 'US_Contrast.evaluate', 'US_Contrast.display',
+                   'save_reco_image', 'py_imagesc'],
+    'extern_functions': ['hl_envelopes_idx', 'get_envelope', '_peak_masks', '_interp_envelope'],
+    'display_scans': ['display_Ascan', 'display_Bmode_from_RF', 'detect_envelope_scanlines',
+                      'display_video_env_detect'],
+}
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _nbytes(obj):
+    """ Total size of the arrays in obj (array, or tuple/list of arrays) """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (tuple, list)):
+        return sum(o.nbytes for o in obj if isinstance(o, np.ndarray))
+    return 0
+
+
+def _shapes(args):
+    return [list(a.shape) for a in args if isinstance(a, np.ndarray)]
+
+
+class Profiler:
+    """
+    Recorder of the instrumented calls
+    Input:
+        memory:         also record the peak allocation of every call (tracemalloc); the
+                        outermost instrumented calls of different threads are then serialized,
+                        so an instrumented call must not wait for one running in another thread
+    Public properties:
+        events          list of dicts (name, start [s], duration [s], self [s], thread,
+                        shapes, in_bytes, out_bytes, alloc_bytes)
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.t0 = time.perf_counter()
+        self.started_tracemalloc = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # held by the thread whose call tree is measured (re-entered by its nested calls)
+        self._memory_lock = threading.RLock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.memory:
+                return self._record(name, func, args, kwargs)
+            # tracemalloc.reset_peak is global: another thread would reset the running peak
+            with self._memory_lock:
+                return self._record(name, func, args, kwargs)
+        return wrapper
+
+    def _record(self, name, func, args, kwargs):
+        stack = self._stack()
+        # frame: [child time, allocation at start, running peak]
+        frame = [0., 0, 0]
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+            tracemalloc.reset_peak()
+            frame[1] = frame[2] = current
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            alloc = 0
+            if self.memory:
+                peak = max(frame[2], tracemalloc.get_traced_memory()[1])
+                alloc = peak - frame[1]
+                if stack:
+                    stack[-1][2] = max(stack[-1][2], peak)
+            if stack:
+                stack[-1][0] += duration
+        event = {'name': name, 'start': start - self.t0, 'duration': duration,
+                 'self': duration - frame[0], 'thread': threading.get_ident(),
+                 'shapes': _shapes(args), 'in_bytes': sum(_nbytes(a) for a in args),
+                 'out_bytes': _nbytes(result), 'alloc_bytes': alloc}
+        with self._lock:
+            self.events.append(event)
+        return result
+
+    def stats(self):
+        """ Per function: calls, total/self/mean/max time [s], bytes in/out, peak allocation """
+        out = {}
+        for e in self.events:
+            s = out.setdefault(e['name'], {'calls': 0, 'total': 0., 'self': 0., 'max': 0.,
+                                           'in_bytes': 0, 'out_bytes': 0, 'alloc_bytes': 0})
+            s['calls'] += 1
+            s['total'] += e['duration']
+            s['self'] += e['self']
+            s['max'] = max(s['max'], e['duration'])
+            s['in_bytes'] += e['in_bytes']
+            s['out_bytes'] += e['out_bytes']
+            s['alloc_bytes'] = max(s['alloc_bytes'], e['alloc_bytes'])
+        for s in out.values():
+            s['mean'] = s['total'] / s['calls']
+        return out
+
+    def report(self, sort='self'):
+        """ Text table of `stats`, sorted by `sort` (self, total, calls ...) """
+        stats = sorted(self.stats().items(), key=lambda item: -item[1][sort])
+        lines = [f"{'function':<50}{'calls':>6}{'total [ms]':>12}{'self [ms]':>11}{'max [ms]':>10}"
+                 f"{'in [MiB]':>10}{'out [MiB]':>10}" + (f"{'peak alloc [MiB]':>18}" if self.memory else '')]
+        for name, s in stats:
+            line = (f"{name:<50}{s['calls']:>6}{1e3*s['total']:>12.2f}{1e3*s['self']:>11.2f}"
+                    f"{1e3*s['max']:>10.2f}{s['in_bytes']/2**20:>10.1f}{s['out_bytes']/2**20:>10.1f}")
+            if self.memory:
+                line += f"{s['alloc_bytes']/2**20:>18.1f}"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def trace_events(self):
+        """ Chrome trace-event format (complete events, microseconds) """
+        pid = os.getpid()
+        return [{'name': e['name'].split('.', 1)[1], 'cat': e['name'].split('.', 1)[0],
+                 'ph': 'X', 'pid': pid, 'tid': e['thread'], 'ts': 1e6 * e['start'], 'dur': 1e6 * e['duration'],
+                 'args': {'function': e['name'], 'shapes': e['shapes'], 'in_bytes': e['in_bytes'],
+                          'out_bytes': e['out_bytes'], 'alloc_bytes': e['alloc_bytes']}}
+                for e in self.events]
+
+    def write_trace(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+
+_active = None          # (profiler, list of (owner, attribute, original)) while enabled
+
+
+def _aliases(module_names):
+    """ Modules that may hold references to the targets (`from x import *`, notebooks) """
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None) or ''
+        if name == '__main__' or name in module_names or os.path.dirname(os.path.abspath(path)) == _DIR:
+            yield module
+
+
+def enable(memory=False, targets=None):
+    """ Start recording: wrap the target functions, return the Profiler """
+    global _active
+    if _active is not None:
+        disable()
+    targets = TARGETS if targets is None else targets
+    profiler = Profiler(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profiler.started_tracemalloc = True
+    patched = []
+    replaced = {}       # id(original) -> wrapper
+    for module_name, names in targets.items():
+        module = importlib.import_module(module_name)
+        for qualname in names:
+            owner = module
+            *path, attr = qualname.split('.')
+            for part in path:
+                owner = getattr(owner, part)
+            original = owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)
+            wrapper = profiler.wrap(f'{module_name}.{qualname}', original)
+            patched.append((owner, attr, original))
+            setattr(owner, attr, wrapper)
+            if not path:
+                replaced[id(original)] = (original, wrapper)
+
+    # re-bind names imported elsewhere (display_scans' `from envelop_detection import *` ...)
+    for module in _aliases(targets):
+        for attr, value in list(vars(module).items()):
+            if id(value) in replaced and replaced[id(value)][0] is value:
+                patched.append((module, attr, value))
+                setattr(module, attr, replaced[id(value)][1])
+    _active = (profiler, patched)
+    return profiler
+
+
+def disable():
+    """ Restore the original functions, return the Profiler of the finished recording """
+    global _active
+    if _active is None:
+        return None
+    profiler, patched = _active
+    for owner, attr, original in reversed(patched):
+        setattr(owner, attr, original)
+    if profiler.started_tracemalloc:
+        tracemalloc.stop()
+    _active = None
+    return profiler
+
+
+def is_enabled():
+    return _active is not None
+
+
+class profile:
+    """
+    Context manager recording the instrumented calls of its block
+        with profile(memory=True, trace='trace.json') as prof: ...
+    """
+    def __init__(self, memory=False, trace=None, targets=None):
+        self.memory = memory
+        self.trace = trace
+        self.targets = targets
+
+    def __enter__(self):
+        self.profiler = enable(self.memory, self.targets)
+        return self.profiler
+
+    def __exit__(self, *exc):
+        disable()
+        if self.trace:
+            self.profiler.write_trace(self.trace)
@@ -0,0 +1,72 @@
+"""
+Baseband IQ demodulation and decimation of RF scanlines.
+
+RF is mixed down by the transducer center frequency, low-pass filtered by a polyphase FIR
+and decimated, giving complex64 IQ at fs / decimation. |IQ| is the envelope, so the
+result feeds the B-mode and CNR code directly (no envelope detection at the RF rate).
+"""
+import math
+from functools import lru_cache
+import numpy as np
+from scipy.signal import firwin, oaconvolve, resample_poly
+from envelop_core import log_compress
+
+
+@lru_cache(maxsize=None)
+def fir_lowpass(numtaps, cutoff_freq, fs):
+    """ Windowed-sinc FIR low-pass (unit DC gain, float32), cached by (numtaps, cutoff_freq, fs). """
+    return firwin(numtaps, cutoff_freq, fs=fs).astype(np.float32)
+
+
+def iq_demodulate(rf, fs, fc, decimation=4, cutoff_freq=None, numtaps=None, sample_offset=0, axis=-1):
+    """
+    Complex baseband (IQ) signal of RF data.
+    ARGS:
+        rf - RF A-scan or block of scanlines (samples along `axis`)
+        fs - RF sampling frequency [Hz]
+        fc - transducer center frequency [Hz] (mixing frequency)
+        decimation - integer decimation factor (output rate fs / decimation)
+        cutoff_freq - low-pass cutoff [Hz] (default: 80% of the output Nyquist frequency,
+                      at most fc so the 2*fc image of the mixing is removed)
+        numtaps - FIR length (default: odd, at least 16 * decimation and 8 * fs / cutoff_freq)
+        sample_offset - index of the first RF sample (keeps the mixing phase consistent
+                        between blocks cut from the same acquisition)
+    Output:
+        iq - complex64 IQ (same shape as rf, samples axis divided by decimation)
+        fs_iq - IQ sampling frequency [Hz]
+    """
+    fs_iq = fs / decimation
+    if cutoff_freq is None:
+        # below the output Nyquist frequency and the 2*fc mixing image
+        cutoff_freq = min(0.8 * fs_iq / 2, fc)
+    if numtaps is None:
+        # odd length, with a transition band narrow enough for the cutoff
+        numtaps = max(16 * decimation, int(8 * fs / cutoff_freq)) | 1
+
+    rf = np.moveaxis(np.asarray(rf, dtype=np.float32), axis, -1)
+    n = rf.shape[-1]
+
+    # 1. mix down by the center frequency (x2 keeps the envelope amplitude of the RF)
+    phase = (2 * math.pi * fc / fs) * (np.arange(n) + sample_offset)
+    mixed = rf * (2 * np.exp(-1j * phase)).astype(np.complex64)
+
+    # 2. polyphase low-pass filter + decimation (one pass, only kept samples computed)
+    window = fir_lowpass(numtaps, cutoff_freq, fs)
+    if decimation == 1:
+        iq = oaconvolve(mixed, window.reshape((1,) * (mixed.ndim - 1) + (-1,)), mode='same', axes=-1)
+    else:
+        iq = resample_poly(mixed, 1, decimation, axis=-1, window=window)
+    return np.moveaxis(iq.astype(np.complex64, copy=False), -1, axis), fs_iq
+
+
+def iq_envelope(iq):
+    """ Envelope (magnitude) of IQ data, float32 """
+    return np.abs(iq).astype(np.float32, copy=False)
+
+
+def iq_to_bmode(iq, dynamic_range=60, axis=None):
+    """
+    Log-compressed B-mode [dB] of IQ data, normalized to the max (over `axis`, default: all)
+    and clipped to -dynamic_range (see envelop_core.log_compress)
+    """
+    return log_compress(iq_envelope(iq), dynamic_range, axis)
@@ -0,0 +1,263 @@
+"""
+Level-of-detail (LOD) rendering of long A-scans and large B-mode images.
+
+Traces are drawn from min/max decimation pyramids and images from mean/max pyramids
+(max-abs for bipolar RF, where block means would cancel the signal),
+so matplotlib only ever receives about as many points/pixels as the axes can show.
+Pyramid levels are computed by `reduceat` on the input (views and memory maps are read,
+never copied); on every zoom/pan the level matching the axes' pixel size is selected
+and cropped to the visible range.
+
+Example:
+    fig, ax = plt.subplots()
+    lod_plot(ax, rf_line)                   # instead of ax.plot(rf_line)
+    im = lod_imshow(ax, bmode.T, cmap='gray')   # instead of ax.imshow(bmode.T, cmap='gray')
+"""
+import math
+import numpy as np
+
+
+def _reduce(a, factor, axis, mode):
+    """
+    Reduce blocks of `factor` samples along `axis` ('min', 'max', 'mean' or 'max-abs': signed
+    sample of largest magnitude); last block may be shorter
+    """
+    n = a.shape[axis]
+    idx = np.arange(0, n, factor)
+    if mode == 'min':
+        return np.minimum.reduceat(a, idx, axis=axis)
+    if mode == 'max':
+        return np.maximum.reduceat(a, idx, axis=axis)
+    if mode == 'mean':
+        dtype = np.result_type(a.dtype, np.float32)
+        counts = np.diff(np.append(idx, n)).astype(dtype)
+        shape = [1] * a.ndim
+        shape[axis] = len(idx)
+        return np.add.reduceat(a, idx, axis=axis, dtype=dtype) / counts.reshape(shape)
+    if mode == 'max-abs':
+        hi = np.maximum.reduceat(a, idx, axis=axis)
+        lo = np.minimum.reduceat(a, idx, axis=axis)
+        # compared as floats: no overflow negating the most negative integer
+        return np.where(hi.astype(np.float64) >= -lo.astype(np.float64), hi, lo)
+    raise ValueError(f"unknown reduction mode '{mode}'")
+
+
+def _level_for(n_visible, n_pixels, factor, n_levels):
+    """ Coarsest level that still has at least `n_pixels` samples over `n_visible` input samples """
+    if n_pixels <= 0 or n_visible <= n_pixels:
+        return 0
+    return min(int(math.log(n_visible / n_pixels, factor)), n_levels - 1)
+
+
+class TracePyramid:
+    """
+    Min/max decimation pyramid of a 1-D trace
+    Input:
+        y:          1-D array (not copied; level 0 is the input itself)
+        factor:     decimation factor between levels
+        min_size:   levels are built until they are shorter than this
+    Public properties:
+        levels      list of (mins, maxs); level k has one pair per factor**k input samples
+    """
+    def __init__(self, y, factor=4, min_size=512):
+        self.y = y
+        self.factor = factor
+        self.levels = [(y, y)]
+        lo, hi = y, y
+        while len(lo) > min_size:
+            lo, hi = _reduce(lo, factor, 0, 'min'), _reduce(hi, factor, 0, 'max')
+            self.levels.append((lo, hi))
+
+    def __len__(self):
+        return len(self.y)
+
+    def level_for(self, n_visible, n_pixels):
+        # min and max per bucket: two points per pixel
+        return _level_for(n_visible, 2 * n_pixels, self.factor, len(self.levels))
+
+    def window(self, start, stop, n_pixels):
+        """
+        Points to draw input samples [start, stop) on n_pixels pixels
+        Output:
+            idx - sample index of every point
+            y - values (level 0: samples; coarser levels: alternating min/max of every bucket)
+        """
+        start, stop = max(int(start), 0), min(int(math.ceil(stop)), len(self.y))
+        if stop <= start:
+            return np.zeros(0), np.zeros(0)
+        k = self.level_for(stop - start, n_pixels)
+        if k == 0:
+            return np.arange(start, stop), np.asarray(self.y[start:stop])
+        f = self.factor**k
+        lo, hi = self.levels[k]
+        b0, b1 = start // f, -(-stop // f)
+        idx = np.repeat(np.arange(b0, b1) * f + (f - 1) / 2, 2)
+        y = np.empty(2 * (b1 - b0), dtype=np.result_type(lo.dtype, hi.dtype))
+        y[0::2], y[1::2] = lo[b0:b1], hi[b0:b1]
+        return idx, y
+
+
+class ImagePyramid:
+    """
+    Mean (or max) pyramid of a 2-D image, reduced independently along rows and columns
+    (a "rip-map": very elongated images such as RF B-modes only lose resolution where needed)
+    Input:
+        data:       2-D array (not copied; level (0, 0) is the input itself)
+        factor:     reduction factor between levels
+        mode:       'mean', 'max' or 'max-abs' (bipolar data such as raw RF)
+    Levels are built on first use and kept.
+    """
+    def __init__(self, data, factor=2, mode='mean'):
+        self.data = data
+        self.factor = factor
+        self.mode = mode
+        self.shape = data.shape
+        self.n_levels = [max(int(math.ceil(math.log(max(n, 1), factor))), 0) + 1 for n in self.shape]
+        self._levels = {(0, 0): data}
+
+    def level(self, ky, kx):
+        """ Image reduced by factor**ky along rows and factor**kx along columns """
+        if (ky, kx) not in self._levels:
+            if ky >= kx:
+                img = _reduce(self.level(ky - 1, kx), self.factor, 0, self.mode)
+            else:
+                img = _reduce(self.level(ky, kx - 1), self.factor, 1, self.mode)
+            self._levels[(ky, kx)] = img
+        return self._levels[(ky, kx)]
+
+    def window(self, rows, cols, n_pixels):
+        """
+        Part of the level fitting the visible input rows/cols [start, stop) on (ny, nx) pixels
+        Output:
+            img - image to draw
+            (r0, r1, c0, c1) - input rows/cols covered by img
+        """
+        k = [_level_for(stop - start, n_pix, self.factor, n_lev)
+             for (start, stop), n_pix, n_lev in zip((rows, cols), n_pixels, self.n_levels)]
+        fy, fx = self.factor**k[0], self.factor**k[1]
+        # one level pixel of margin so that small pans do not show the crop edge
+        b = [max(rows[0] // fy - 1, 0), -(-rows[1] // fy) + 1, max(cols[0] // fx - 1, 0), -(-cols[1] // fx) + 1]
+        img = self.level(*k)[b[0]:b[1], b[2]:b[3]]
+        return img, (b[0] * fy, min(b[0] * fy + img.shape[0] * fy, self.shape[0]),
+                     b[2] * fx, min(b[2] * fx + img.shape[1] * fx, self.shape[1]))
+
+
+def _axes_pixels(ax):
+    # with a fixed aspect ratio the axes box follows the limits: resolve it before measuring
+    ax.apply_aspect()
+    bbox = ax.get_window_extent()
+    return max(int(bbox.height), 1), max(int(bbox.width), 1)
+
+
+class LODTrace:
+    """
+    Line artist redrawn from a TracePyramid whenever the x-limits or the figure size change
+    Input:
+        ax:         matplotlib Axes
+        y:          1-D trace
+        x0, dx:     x coordinate of the first sample and sample spacing
+        scale:      factor applied to the drawn values (e.g. 1/max for normalization)
+        factor:     pyramid decimation factor
+        kwargs:     passed to `ax.plot`
+    """
+    def __init__(self, ax, y, x0=0., dx=1., scale=1., factor=4, **kwargs):
+        self.ax = ax
+        self.pyramid = y if isinstance(y, TracePyramid) else TracePyramid(y, factor)
+        self.x0, self.dx, self.scale = x0, dx, scale
+        x, v = self._points(0, len(self.pyramid))
+        self.line, = ax.plot(x, v, **kwargs)
+        # plain closures are held strongly by matplotlib's callback registry
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+        ax.figure.canvas.mpl_connect('resize_event', lambda event: self.update())
+
+    def _points(self, start, stop):
+        idx, v = self.pyramid.window(start, stop, _axes_pixels(self.ax)[1])
+        return self.x0 + self.dx * idx, v * self.scale if self.scale != 1 else v
+
+    def update(self):
+        lim = np.sort((np.asarray(self.ax.get_xlim()) - self.x0) / self.dx)
+        self.line.set_data(*self._points(math.floor(lim[0]), math.ceil(lim[1]) + 1))
+        self.ax.figure.canvas.draw_idle()
+
+
+class LODImage:
+    """
+    Image artist redrawn from an ImagePyramid whenever the axes limits or the figure size change
+    Input:
+        ax:         matplotlib Axes
+        data:       2-D image (row x column, as for `imshow`)
+        extent:     (left, right, bottom, top) as for `imshow` (default: pixel centers at indices)
+        origin:     'upper' or 'lower' as for `imshow`
+        mode:       pyramid reduction, 'mean', 'max' or 'max-abs' (raw RF: 'mean' would
+                    average the bipolar signal away)
+        kwargs:     passed to `ax.imshow`
+    Public properties:
+        image       the matplotlib AxesImage (set_cmap, set_clim, colorbar ... work as usual)
+    """
+    def __init__(self, ax, data, extent=None, origin='upper', mode='mean', factor=2, **kwargs):
+        self.ax = ax
+        self.pyramid = data if isinstance(data, ImagePyramid) else ImagePyramid(data, factor, mode)
+        h, w = self.pyramid.shape
+        if extent is None:
+            extent = (-0.5, w - 0.5, h - 0.5, -0.5) if origin == 'upper' else (-0.5, w - 0.5, -0.5, h - 0.5)
+        self.extent = extent
+        self.origin = origin
+        self._updating = False
+        img, ext = self._window((0, h), (0, w))
+        self.image = ax.imshow(img, extent=ext, origin=origin, **kwargs)
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+        ax.callbacks.connect('ylim_changed', lambda ax: self.update())
+        ax.figure.canvas.mpl_connect('resize_event', lambda event: self.update())
+
+    def _rows_axis(self):
+        """ y coordinates of the first and last row boundary """
+        left, right, bottom, top = self.extent
+        return (top, bottom) if self.origin == 'upper' else (bottom, top)
+
+    def _window(self, rows, cols):
+        h, w = self.pyramid.shape
+        img, (r0, r1, c0, c1) = self.pyramid.window(rows, cols, _axes_pixels(self.ax))
+        x_first, x_last = self.extent[:2]
+        y_first, y_last = self._rows_axis()
+        x = lambda c: x_first + c * (x_last - x_first) / w
+        y = lambda r: y_first + r * (y_last - y_first) / h
+        if self.origin == 'upper':
+            return img, (x(c0), x(c1), y(r1), y(r0))
+        return img, (x(c0), x(c1), y(r0), y(r1))
+
+    def _visible(self, lim, first, last, n):
+        i = np.sort((np.asarray(lim) - first) * n / (last - first))
+        return max(int(math.floor(i[0])), 0), min(int(math.ceil(i[1])), n)
+
+    def update(self):
+        if self._updating:
+            return
+        h, w = self.pyramid.shape
+        rows = self._visible(self.ax.get_ylim(), *self._rows_axis(), h)
+        cols = self._visible(self.ax.get_xlim(), *self.extent[:2], w)
+        if rows[1] <= rows[0] or cols[1] <= cols[0]:
+            return
+        img, ext = self._window(rows, cols)
+        self._updating = True
+        try:
+            # keep the view: set_extent would autoscale to the cropped image
+            auto = self.ax.get_autoscalex_on(), self.ax.get_autoscaley_on()
+            self.ax.set_autoscalex_on(False)
+            self.ax.set_autoscaley_on(False)
+            self.image.set_data(img)
+            self.image.set_extent(ext)
+            self.ax.set_autoscalex_on(auto[0])
+            self.ax.set_autoscaley_on(auto[1])
+        finally:
+            self._updating = False
+        self.ax.figure.canvas.draw_idle()
+
+
+def lod_plot(ax, y, x0=0., dx=1., scale=1., **kwargs):
+    """ LOD replacement of `ax.plot(x0 + dx*arange(len(y)), scale*y)`; returns the Line2D """
+    return LODTrace(ax, y, x0, dx, scale, **kwargs).line
+
+
+def lod_imshow(ax, data, extent=None, origin='upper', mode='mean', **kwargs):
+    """ LOD replacement of `ax.imshow(data, ...)`; returns the AxesImage """
+    return LODImage(ax, data, extent, origin, mode, **kwargs).image
@@ -0,0 +1,208 @@
+"""
+Synthetic speckle/cyst phantoms in the PICMUS format read by US_Phantom and US_RecoImage.
+
+Random point scatterers (normal amplitudes, `density` per resolution cell, none inside the
+anechoic occlusions) are binned on the image grid with their two-way phase and convolved
+with a separable Gaussian baseband PSF; the frames are the envelope (magnitude) of the
+result. Every plane-wave setting gets its own frame:
+compounding more plane waves narrows the lateral PSF and lowers the incoherent clutter
+(a simple model, enough for CNR trends). The PSF convolution runs in chunks of lines on a
+thread pool and frames are written one at a time, so grid size and frame count scale
+to far larger data than the bundled files.
+
+Usage:
+    python phantom_generator.py out_dir --nx 2048 --nz 4096 --plane-waves 1 11 37 75
+    -> out_dir/phantom.hdf5 (US_Phantom) and out_dir/image.hdf5 (US_RecoImage)
+"""
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import h5py
+from scipy.signal import fftconvolve
+
+from us_classes import save_reco_image
+
+# layout of the bundled contrast-speckle phantom: 3 x 3 cysts of 8 mm
+OCCLUSION_X = (0., 0., 0., -0.012, -0.012, -0.012, 0.012, 0.012, 0.012)
+OCCLUSION_Z = (0.018, 0.03, 0.042, 0.018, 0.03, 0.042, 0.018, 0.03, 0.042)
+OCCLUSION_D = (0.008,) * 9
+
+
+def gaussian_psf(fwhm, pitch, support=3.):
+    """ Normalized Gaussian kernel of full width at half maximum `fwhm` sampled at `pitch` [m] """
+    sigma = fwhm / (2 * math.sqrt(2 * math.log(2)))
+    half = max(int(math.ceil(support * sigma / pitch)), 1)
+    x = np.arange(-half, half + 1) * pitch
+    psf = np.exp(-0.5 * (x / sigma)**2)
+    return (psf / np.sqrt(np.sum(psf**2))).astype(np.float32)
+
+
+def convolve_lines(field, kernel, axis, chunk_size=64, n_workers=None, out=None):
+    """
+    Convolution of every line of a 2-D field with `kernel` along `axis` ('same' size),
+    lines processed in chunks on a thread pool (FFT convolution releases the GIL)
+    """
+    other = 1 - axis
+    if out is None:
+        out = np.empty(field.shape, dtype=np.complex64)
+    shape = [1, 1]
+    shape[axis] = len(kernel)
+    kernel = kernel.reshape(shape)
+
+    def work(start):
+        index = [slice(None), slice(None)]
+        index[other] = slice(start, start + chunk_size)
+        out[tuple(index)] = fftconvolve(field[tuple(index)], kernel, mode='same', axes=axis)
+
+    with ThreadPoolExecutor(n_workers) as pool:
+        list(pool.map(work, range(0, field.shape[other], chunk_size)))
+    return out
+
+
+class SpeckleCystPhantom:
+    """
+    Random scatterer phantom with anechoic circular occlusions
+    Input:
+        x_limits, z_limits:         extent of the scatterer field [m]
+        occlusion_x, occlusion_z:   occlusion centers [m]
+        occlusion_d:                occlusion diameters [m]
+        axial_resolution:           axial PSF FWHM [m]
+        lateral_resolution:         lateral PSF FWHM of the best (fully compounded) image [m]
+        density:                    scatterers per resolution cell
+        seed:                       random seed
+    Public properties:
+        positions                   (3, n) scatterer coordinates (x, y=0, z) [m]
+        amplitudes                  (n,) scatterer amplitudes
+    """
+    def __init__(self, x_limits=(-0.02405, 0.02405), z_limits=(0.005, 0.055),
+                 occlusion_x=OCCLUSION_X, occlusion_z=OCCLUSION_Z, occlusion_d=OCCLUSION_D,
+                 axial_resolution=4.4355e-4, lateral_resolution=6.2407e-4, density=20., seed=0):
+        self.x_limits = x_limits
+        self.z_limits = z_limits
+        self.occlusion_x = np.asarray(occlusion_x, dtype=np.float32)
+        self.occlusion_z = np.asarray(occlusion_z, dtype=np.float32)
+        self.occlusion_d = np.asarray(occlusion_d, dtype=np.float32)
+        self.axial_resolution = axial_resolution
+        self.lateral_resolution = lateral_resolution
+        self.density = density
+
+        rng = np.random.default_rng(seed)
+        area = (x_limits[1] - x_limits[0]) * (z_limits[1] - z_limits[0])
+        n = rng.poisson(density * area / (axial_resolution * lateral_resolution))
+        x = rng.uniform(*x_limits, n).astype(np.float32)
+        z = rng.uniform(*z_limits, n).astype(np.float32)
+        keep = ~self.inside(x, z)
+        self.nb_scatterers = n
+        self.positions = np.stack([x[keep], np.zeros(np.count_nonzero(keep), np.float32), z[keep]])
+        self.amplitudes = rng.standard_normal(np.count_nonzero(keep)).astype(np.float32)
+
+    def inside(self, x, z):
+        """ True for the points inside any occlusion """
+        mask = np.zeros(np.broadcast(x, z).shape, dtype=bool)
+        for cx, cz, d in zip(self.occlusion_x, self.occlusion_z, self.occlusion_d):
+            mask |= (x - cx)**2 + (z - cz)**2 <= (d / 2)**2
+        return mask
+
+    def save(self, file_path):
+        """ Write the phantom in the layout read by US_Phantom """
+        f32 = lambda v: np.asarray(v, dtype=np.float32).reshape(-1)
+        with h5py.File(file_path, 'w') as f:
+            d = f.create_group('US').create_group('US_DATASET0000')
+            d['nb_scatterers'] = f32(self.nb_scatterers)
+            d['phantom_occlusionCenterX'] = self.occlusion_x
+            d['phantom_occlusionCenterZ'] = self.occlusion_z
+            d['phantom_occlusionDiameter'] = self.occlusion_d
+            d['phantom_axialResolution'] = f32(self.axial_resolution)
+            d['phantom_lateralResolution'] = f32(self.lateral_resolution)
+            d['phantom_bckDensity'] = f32(self.density)
+            d['phantom_xLimits'] = f32(self.x_limits)
+            d['phantom_zLimits'] = f32(self.z_limits)
+            d['scatterers_amplitude'] = self.amplitudes
+            d['scatterers_positions'] = self.positions
+        return file_path
+
+    def reflectivity(self, x_axis, z_axis, fc=5.208e6, sos=1540.):
+        """ Scatterers binned on the (x, z) grid with their two-way phase at fc (complex64) """
+        x_axis, z_axis = np.asarray(x_axis), np.asarray(z_axis)
+        dx, dz = x_axis[1] - x_axis[0], z_axis[1] - z_axis[0]
+        ix = np.rint((self.positions[0] - x_axis[0]) / dx).astype(np.int64)
+        iz = np.rint((self.positions[2] - z_axis[0]) / dz).astype(np.int64)
+        ok = (ix >= 0) & (ix < len(x_axis)) & (iz >= 0) & (iz < len(z_axis))
+        flat = ix[ok] * len(z_axis) + iz[ok]
+        phase = (4 * np.pi * fc / sos) * self.positions[2, ok].astype(np.float64)
+        values = self.amplitudes[ok] * np.exp(-1j * phase)
+        size = len(x_axis) * len(z_axis)
+        field = (np.bincount(flat, values.real, size) + 1j * np.bincount(flat, values.imag, size))
+        return field.astype(np.complex64).reshape(len(x_axis), len(z_axis))
+
+    def frames(self, x_axis, z_axis, number_plane_waves=(1, 11, 37, 75), clutter_db=-20.,
+               fc=5.208e6, sos=1540., chunk_size=64, n_workers=None, seed=0):
+        """
+        Generator of envelope (x, z) frames (float32), one per plane-wave setting: the magnitude
+        of the complex PSF-convolved field, stored with a zero imaginary part by save_image as in
+        the PICMUS reconstructed images. Every frame is a new array (callers may keep them).
+        The lateral PSF FWHM is lateral_resolution * (1 + 1/sqrt(n)) and the clutter level
+        clutter_db - 10*log10(n) relative to the speckle, for n compounded plane waves.
+        """
+        x_axis, z_axis = np.asarray(x_axis), np.asarray(z_axis)
+        dx, dz = x_axis[1] - x_axis[0], z_axis[1] - z_axis[0]
+        rng = np.random.default_rng(seed)
+        # the axial pass does not depend on the setting: computed once
+        axial = convolve_lines(self.reflectivity(x_axis, z_axis, fc, sos),
+                               gaussian_psf(self.axial_resolution, dz), 1, chunk_size, n_workers)
+        for n in number_plane_waves:
+            psf_x = gaussian_psf(self.lateral_resolution * (1 + 1 / math.sqrt(n)), dx)
+            frame = convolve_lines(axial, psf_x, 0, chunk_size, n_workers)
+            speckle_rms = math.sqrt(float(np.mean(np.abs(frame)**2))) or 1.
+            clutter = speckle_rms * 10**((clutter_db - 10 * math.log10(n)) / 20) / math.sqrt(2)
+            noise = rng.standard_normal(frame.shape, dtype=np.float32)
+            noise = noise + 1j * rng.standard_normal(frame.shape, dtype=np.float32)
+            frame += (clutter * noise).astype(np.complex64)
+            yield np.abs(frame)
+
+    def save_image(self, file_path, nx=387, nz=609, number_plane_waves=(1, 11, 37, 75), compression=None,
+                   **kwargs):
+        """ Write the frames of a (nx, nz) grid over the phantom extent in the US_RecoImage layout """
+        x_axis = np.linspace(*self.x_limits, nx, dtype=np.float32)
+        z_axis = np.linspace(*self.z_limits, nz, dtype=np.float32)
+        save_reco_image(file_path, x_axis, z_axis, self.frames(x_axis, z_axis, number_plane_waves, **kwargs),
+                        number_plane_waves, compression=compression)
+        return file_path
+
+
+def generate(output_dir, nx=387, nz=609, number_plane_waves=(1, 11, 37, 75), density=20., seed=0,
+             n_workers=None, compression=None):
+    """ phantom.hdf5 + image.hdf5 in output_dir; returns their paths """
+    os.makedirs(output_dir, exist_ok=True)
+    pht = SpeckleCystPhantom(density=density, seed=seed)
+    phantom_path = pht.save(os.path.join(output_dir, 'phantom.hdf5'))
+    image_path = pht.save_image(os.path.join(output_dir, 'image.hdf5'), nx, nz, number_plane_waves,
+                                compression, n_workers=n_workers, seed=seed)
+    return phantom_path, image_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Synthetic speckle/cyst phantom in the PICMUS format.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--nx', type=int, default=387, help='lateral grid size')
+    parser.add_argument('--nz', type=int, default=609, help='axial grid size')
+    parser.add_argument('--plane-waves', type=int, nargs='+', default=[1, 11, 37, 75],
+                        help='number of plane waves of every frame')
+    parser.add_argument('--density', type=float, default=20., help='scatterers per resolution cell')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--compression', default=None, choices=['gzip', 'lzf'])
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    phantom_path, image_path = generate(args.output_dir, args.nx, args.nz, args.plane_waves, args.density,
+                                        args.seed, args.workers, args.compression)
+    print(f'{phantom_path}, {image_path} ({os.path.getsize(image_path)/2**20:.1f} MiB) '
+          f'in {time.perf_counter() - t0:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Floating-point precision of the processing chain.
+
+    'double'    float64/complex128 (default, as numpy promotes: results match the notebooks)
+    'single'    float32/complex64 from the loaded samples to the B-mode: half the memory
+                traffic of double precision (filter coefficients are cast to float32 too)
+
+Example:
+    import precision
+    precision.set_precision('single')       # or: with precision.using('single'): ...
+"""
+import contextlib
+import numpy as np
+
+_DTYPES = {'double': (np.float64, np.complex128), 'single': (np.float32, np.complex64)}
+_current = 'double'
+
+
+def set_precision(name):
+    global _current
+    if name not in _DTYPES:
+        raise ValueError(f"precision must be one of {list(_DTYPES)}, not '{name}'")
+    _current = name
+
+
+def get_precision():
+    return _current
+
+
+@contextlib.contextmanager
+def using(name):
+    """ Temporarily switch the precision """
+    previous = _current
+    set_precision(name)
+    try:
+        yield
+    finally:
+        set_precision(previous)
+
+
+def float_type():
+    return _DTYPES[_current][0]
+
+
+def complex_type():
+    return _DTYPES[_current][1]
+
+
+def work_dtype():
+    """
+    Real type the processing steps produce: float32 in single precision, None in double
+    precision (numpy promotion: float64 for integer or float samples)
+    """
+    return np.float32 if _current == 'single' else None
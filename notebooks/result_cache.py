@@ -0,0 +1,241 @@
+"""
+Content-addressed disk cache for heavy processing results (envelopes, B-modes, CNR scores,
+spectrograms).
+
+Entries are keyed by a hash of the inputs: file contents (fingerprints), array contents,
+function code and parameters, and the precision mode (precision.get_precision()).
+A function is keyed by its code and by the source files of the project modules it depends
+on (its own module and, transitively, those of the functions and modules it refers to), so
+editing e.g. envelop_core invalidates the cached envelopes. Changes outside these files
+(installed packages, data read by the function) are not tracked: bump `version` for them.
+Results are stored as .npy files and returned memory-mapped; the cache is trimmed to
+`max_bytes` by evicting the least recently used entries.
+
+Example:
+    cache = ResultCache('../.cache')
+    env = cache.call(detect_envelope_scanlines, data, asynchronous_full_wave, cutoff_freq=10e6)
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import sysconfig
+import tempfile
+import types
+import numpy as np
+
+import precision
+
+_file_fingerprints = {}     # (path, size, mtime_ns) -> content hash, per process
+
+
+def file_fingerprint(file_path, block_size=2**22):
+    """ Hash of the file content (memoized while the file size and mtime do not change). """
+    file_path = os.path.abspath(file_path)
+    st = os.stat(file_path)
+    key = (file_path, st.st_size, st.st_mtime_ns)
+    if key not in _file_fingerprints:
+        h = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+        _file_fingerprints[key] = h.hexdigest()
+    return _file_fingerprints[key]
+
+
+# installed packages and the standard library: not part of the project sources
+_LIBRARY_DIRS = tuple({os.path.realpath(sysconfig.get_paths()[name]) + os.sep
+                       for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+
+
+def _project_source(module):
+    """ Source file of a project module, None for built-in, compiled or installed modules. """
+    path = getattr(module, '__file__', None)
+    if not path or not path.endswith('.py'):
+        return None
+    path = os.path.realpath(path)
+    return None if path.startswith(_LIBRARY_DIRS) else path
+
+
+def _hash_code(code, h):
+    """ Bytecode and constants, nested code objects (lambdas, comprehensions) included. """
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, h)
+        else:
+            h.update(repr(const).encode())
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _dependency_sources(func, sources, seen):
+    """ Add the project source files `func` depends on to `sources` (walks global references). """
+    func = getattr(func, '__func__', func)
+    if not isinstance(func, types.FunctionType) or func in seen:
+        return
+    seen.add(func)
+    path = _project_source(sys.modules.get(func.__globals__.get('__name__')))
+    if path is not None:
+        sources.add(path)
+    for name in _code_names(func.__code__):
+        obj = func.__globals__.get(name)
+        if isinstance(obj, types.ModuleType):
+            path = _project_source(obj)
+            if path is not None:
+                sources.add(path)
+        else:
+            _dependency_sources(obj, sources, seen)
+
+
+def fingerprint(obj):
+    """
+    Stable description of a key part:
+        existing file path  -> hash of the file content
+        numpy array         -> hash of dtype, shape and data
+        function            -> qualified name, hash of its code and of the project source
+                               files it depends on
+        list/tuple/dict     -> fingerprints of the elements
+        anything else       -> repr
+    """
+    if isinstance(obj, (str, os.PathLike)) and os.path.isfile(obj):
+        return 'file:' + file_fingerprint(obj)
+    if isinstance(obj, np.ndarray):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f'{obj.dtype.str}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).view(np.uint8).reshape(-1))
+        return 'array:' + h.hexdigest()
+    if callable(obj) and hasattr(obj, '__code__'):
+        h = hashlib.blake2b(digest_size=8)
+        _hash_code(obj.__code__, h)
+        sources = set()
+        _dependency_sources(obj, sources, set())
+        for path in sorted(sources):
+            h.update(file_fingerprint(path).encode())
+        return f'func:{obj.__module__}.{obj.__qualname__}:{h.hexdigest()}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ','.join(fingerprint(o) for o in obj) + ']'
+    if isinstance(obj, dict):
+        return '{' + ','.join(f'{k!r}:{fingerprint(obj[k])}' for k in sorted(obj)) + '}'
+    return repr(obj)
+
+
+def _save_result(dir_path, result):
+    if isinstance(result, dict):
+        kind, names, arrays = 'dict', list(result), list(result.values())
+    elif isinstance(result, tuple):
+        kind, names, arrays = 'tuple', [str(i) for i in range(len(result))], list(result)
+    else:
+        kind, names, arrays = 'array', ['result'], [result]
+    for name, arr in zip(names, arrays):
+        np.save(os.path.join(dir_path, f'{name}.npy'), np.asarray(arr))
+    with open(os.path.join(dir_path, 'result.json'), 'w') as f:
+        json.dump({'kind': kind, 'names': names}, f)
+
+
+def _load_result(dir_path, mmap_mode='r'):
+    with open(os.path.join(dir_path, 'result.json')) as f:
+        meta = json.load(f)
+    arrays = [np.load(os.path.join(dir_path, f'{name}.npy'), mmap_mode=mmap_mode) for name in meta['names']]
+    if meta['kind'] == 'dict':
+        return dict(zip(meta['names'], arrays))
+    if meta['kind'] == 'tuple':
+        return tuple(arrays)
+    return arrays[0]
+
+
+class ResultCache:
+    """
+    Disk cache of processing results, one directory per entry
+    Input:
+        cache_dir:      root directory of the cache (created if missing)
+        max_bytes:      size limit; least recently used entries are evicted above it
+        version:        salt mixed into every key (change it to invalidate the cache, e.g. after
+                        updating a package the cached functions use)
+    """
+    def __init__(self, cache_dir, max_bytes=2**30, version='1'):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.version = version
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, *parts):
+        # the same call gives float64 or float32 results depending on the precision mode
+        text = fingerprint((self.version, precision.get_precision()) + parts)
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """ Entry directory of `key` (marked as recently used) or None. """
+        path = self.entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def get_or_create(self, parts, producer):
+        """
+        Entry directory for the key parts; on a miss `producer(dir_path)` writes the entry
+        files into a temporary directory that is then moved in place atomically.
+        """
+        key = self.key(*parts)
+        path = self.lookup(key)
+        if path is not None:
+            return path
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            producer(tmp)
+            os.replace(tmp, self.entry_path(key))
+        except OSError:
+            # entry created concurrently by another process
+            if not os.path.isdir(self.entry_path(key)):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=self.entry_path(key))
+        return self.lookup(key)
+
+    def memoize(self, parts, compute, mmap_mode='r'):
+        """ Cached `compute()` result (array, tuple or dict of arrays), keyed by parts. """
+        path = self.get_or_create(parts, lambda tmp: _save_result(tmp, compute()))
+        return _load_result(path, mmap_mode)
+
+    def call(self, func, *args, **kwargs):
+        """ Cached func(*args, **kwargs), keyed by the function code and all arguments. """
+        return self.memoize((func, args, kwargs), lambda: func(*args, **kwargs))
+
+    def entries(self):
+        """ (path, size [bytes], last use) of all entries. """
+        out = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            out.append((path, size, os.stat(path).st_mtime))
+        return out
+
+    def evict(self, keep=None):
+        """ Remove least recently used entries (except `keep`) until the cache fits in max_bytes. """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,176 @@
+"""
+Batch B-mode processing of pulse-echo RF blocks (ex1 tx*rx*-v1-block.npy files).
+
+Usage:
+    python rf_batch.py ../data/ex1-pulse-echo -o bmode_out -j 8 --detector asynchronous_full_wave
+
+For every *-block.npy file of the directory (or chunked store with --pattern '*.h5', see
+rf_store.py): RX channel sum, envelope detection with the selected asynchronous_* detector
+and log compression. The B-mode is written as a compressed
+.npz (uint8 over the dynamic range by default) next to a summary.json with the timings.
+Stores are filtered at their own sampling frequency (SF attribute); the .npz records the
+fs and sample_offset of its input.
+Files are distributed over a process pool (or threads with --threads); inside each file the
+scanlines are read from the memory map one chunk ahead of the detection, so disk reads
+overlap with computation.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+
+import envelop_detection
+from envelop_core import log_compress
+from display_scans import SF, detect_envelope_scanlines
+from rf_store import open_rf
+
+
+def quantize(bmode, dynamic_range, dtype):
+    """ B-mode [dB] in the output type: uint8 maps [-dynamic_range, 0] dB to [0, 255] """
+    if np.dtype(dtype) == np.uint8:
+        return np.round((bmode + dynamic_range) * (255 / dynamic_range)).astype(np.uint8)
+    return bmode.astype(dtype)
+
+
+def dequantize(values, dynamic_range):
+    """ B-mode [dB] of a stored output (inverse of quantize) """
+    if values.dtype == np.uint8:
+        return values.astype(np.float32) * (dynamic_range / 255) - dynamic_range
+    return values.astype(np.float32)
+
+
+def rf_metadata(rf):
+    """ (fs, sample_offset) of an opened block: the store attributes, the ex1 values for .npy blocks """
+    return float(getattr(rf, 'SF', SF)), int(getattr(rf, 'sample_offset', 0))
+
+
+def envelope_file(rf, selected_func, cutoff_freq=0.1*SF, chunk_size=32):
+    """
+    Envelope (scanline x RF sample) of the channel-summed block, `chunk_size` scanlines at a
+    time; the next chunk is read from disk while the current one is detected.
+    ARGS:
+        rf - path of an RF block/store, or an opened US_RFDataset/US_RFStore
+    Output:
+        env - float32 envelope
+        read_time, detect_time - accumulated time [s] spent waiting for data / detecting
+    """
+    if isinstance(rf, (str, os.PathLike)):
+        with open_rf(rf) as opened:
+            return envelope_file(opened, selected_func, cutoff_freq, chunk_size)
+    fs, _ = rf_metadata(rf)
+    env = np.empty((rf.n_scanlines, rf.n_samples), dtype=np.float32)
+    chunks = [slice(i, i + chunk_size) for i in range(0, rf.n_scanlines, chunk_size)]
+    read_time = detect_time = 0.
+    with ThreadPoolExecutor(1) as reader:
+        pending = reader.submit(rf.rx_sum, chunks[0])
+        for k, chunk in enumerate(chunks):
+            t = time.perf_counter()
+            summed = pending.result()
+            if k + 1 < len(chunks):
+                pending = reader.submit(rf.rx_sum, chunks[k + 1])
+            t1 = time.perf_counter()
+            env[chunk] = detect_envelope_scanlines(summed, selected_func, cutoff_freq, fs)
+            read_time += t1 - t
+            detect_time += time.perf_counter() - t1
+    return env, read_time, detect_time
+
+
+def process_file(task):
+    """ Worker: one RF block -> compressed B-mode file, with timings [s] """
+    result = {'input': task['input'], 'output': task['output']}
+    t0 = time.perf_counter()
+    try:
+        selected_func = getattr(envelop_detection, task['detector'])
+        with open_rf(task['input']) as rf:
+            fs, sample_offset = rf_metadata(rf)
+            env, read_time, detect_time = envelope_file(rf, selected_func, task['cutoff_freq'], task['chunk_size'])
+        t1 = time.perf_counter()
+        bmode = log_compress(env, task['dynamic_range'])
+        t2 = time.perf_counter()
+        np.savez_compressed(task['output'], bmode=quantize(bmode, task['dynamic_range'], task['dtype']),
+                            dynamic_range=task['dynamic_range'], fs=fs, sample_offset=sample_offset,
+                            cutoff_freq=task['cutoff_freq'], detector=task['detector'],
+                            source=os.path.basename(task['input']))
+        t3 = time.perf_counter()
+    except Exception as err:
+        result.update(status='error', error=f'{type(err).__name__}: {err}',
+                      total_time=time.perf_counter() - t0)
+        return result
+
+    result.update(status='ok', shape=list(env.shape), samples=int(env.size),
+                  read_time=read_time, detect_time=detect_time, compress_time=t2 - t1,
+                  write_time=t3 - t2, total_time=t3 - t0,
+                  output_bytes=os.path.getsize(task['output']))
+    return result
+
+
+def make_tasks(input_dir, output_dir, detector='asynchronous_full_wave', cutoff_freq=0.1*SF,
+               dynamic_range=60, dtype='uint8', chunk_size=32, pattern='*-block.npy'):
+    """ One task per RF block of input_dir, largest files first (better load balance) """
+    files = sorted(glob.glob(os.path.join(input_dir, pattern)), key=os.path.getsize, reverse=True)
+    return [{'input': path,
+             'output': os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '-bmode.npz'),
+             'detector': detector, 'cutoff_freq': cutoff_freq, 'dynamic_range': dynamic_range,
+             'dtype': dtype, 'chunk_size': chunk_size} for path in files]
+
+
+def run_batch(tasks, jobs=None, threads=False):
+    """ Process all tasks on a process (or thread) pool, results in task order """
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    with executor(max_workers=jobs) as pool:
+        return list(pool.map(process_file, tasks))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch B-mode processing of pulse-echo RF blocks.')
+    parser.add_argument('input_dir', help='directory with *-block.npy files')
+    parser.add_argument('-o', '--output-dir', default='bmode_out')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of workers (default: number of cores)')
+    parser.add_argument('--threads', action='store_true', help='thread pool instead of processes')
+    parser.add_argument('--detector', default='asynchronous_full_wave',
+                        help='asynchronous_* function of envelop_detection')
+    parser.add_argument('--cutoff', type=float, default=0.1*SF, help='LP filter cutoff [Hz]')
+    parser.add_argument('--dynamic-range', type=float, default=60, help='[dB]')
+    parser.add_argument('--dtype', default='uint8', choices=['uint8', 'float16', 'float32'],
+                        help='stored B-mode type')
+    parser.add_argument('--chunk-size', type=int, default=32, help='scanlines read per step')
+    parser.add_argument('--pattern', default='*-block.npy', help='input file name pattern')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = make_tasks(args.input_dir, args.output_dir, args.detector, args.cutoff,
+                       args.dynamic_range, args.dtype, args.chunk_size, args.pattern)
+    if not tasks:
+        print(f'no {args.pattern} files in {args.input_dir}')
+        return 1
+    t0 = time.perf_counter()
+    results = run_batch(tasks, args.jobs, args.threads)
+    wall_time = time.perf_counter() - t0
+
+    summary = {'wall_time': wall_time, 'jobs': args.jobs, 'threads': args.threads,
+               'detector': args.detector, 'cutoff_freq': args.cutoff,
+               'dynamic_range': args.dynamic_range, 'dtype': args.dtype, 'results': results}
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    n_failed = 0
+    for res in results:
+        name = os.path.basename(res['input'])
+        if res['status'] == 'ok':
+            print(f"{name}: {res['shape']} read {res['read_time']:.3f} s, detect {res['detect_time']:.3f} s, "
+                  f"write {res['write_time']:.3f} s [{res['total_time']:.3f} s, {res['output_bytes']/2**10:.0f} KiB]")
+        else:
+            n_failed += 1
+            print(f"{name}: FAILED ({res['error']})")
+    n_samples = sum(res.get('samples', 0) for res in results)
+    print(f'{len(results)} files in {wall_time:.2f} s ({n_samples/wall_time/1e6:.1f} MS/s) -> {args.output_dir}')
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
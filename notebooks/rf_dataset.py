@@ -0,0 +1,88 @@
+"""
+Memory-mapped access to the pulse-echo RF blocks (tx*rx*-v1-block.npy).
+
+The raw block is never loaded as a whole: slicing returns views on the memory map and
+the RX channel summation is computed chunk by chunk directly into a float32 output.
+"""
+import numpy as np
+
+
+def _keep_axis(key, n):
+    """ Integer key -> slice of one element (keeps the axis), other keys unchanged """
+    if isinstance(key, (int, np.integer)):
+        key = range(n)[key]
+        return slice(key, key + 1)
+    return key
+
+
+class US_RFDataset:
+    """
+    Pulse-echo RF block opened with `np.load(..., mmap_mode='r')`
+    Input:
+        file_path:          full path of the *-block.npy file
+        mmap_mode:          memory-map mode passed to np.load ('r' by default)
+    Public properties:
+        raw                 memory-mapped array as stored (1, scanline, RF sample, RX channel)
+        rf                  view without the singleton dimension (scanline, RF sample, RX channel)
+        n_scanlines         number of scanlines (TX apertures)
+        n_samples           number of RF samples per scanline
+        n_rx                number of RX channels
+    Can be used as a context manager, like rf_store.US_RFStore (`close` drops the memory map;
+    views already taken stay valid).
+    """
+    def __init__(self, file_path, mmap_mode='r'):
+        self.file_path = file_path
+        self.raw = np.load(file_path, mmap_mode=mmap_mode)
+        # drop the leading singleton dimension only -> the RX axis is kept even for 1 channel
+        self.rf = self.raw[0]
+        self.n_scanlines, self.n_samples, self.n_rx = self.rf.shape
+
+    def close(self):
+        self.raw = self.rf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def shape(self):
+        return self.rf.shape
+
+    @property
+    def dtype(self):
+        return self.rf.dtype
+
+    def __getitem__(self, key):
+        return self.rf[key]
+
+    def select(self, scanlines=slice(None), samples=slice(None), channels=slice(None)):
+        """ View (no copy) of the selected scanlines, sample range and RX channels. """
+        return self.rf[scanlines, samples, channels]
+
+    def rx_sum(self, scanlines=slice(None), samples=slice(None), channels=slice(None),
+               chunk_size=16, dtype=np.float32, out=None):
+        """
+        Sum over RX channels (scanline x RF sample), computed `chunk_size` scanlines at a time;
+        integer scanlines/samples drop their axis as in numpy indexing.
+        ARGS:
+            scanlines, samples, channels - selection as in `select`
+            chunk_size - number of scanlines read from disk per step
+            dtype - output/accumulation type (float32 is exact for int16 sums up to 256 channels)
+            out - optional preallocated output array
+        """
+        idx = np.arange(self.n_scanlines)[scanlines]
+        samples_idx = np.arange(self.n_samples)[samples]
+        lines = np.atleast_1d(idx)
+        samples, channels = _keep_axis(samples, self.n_samples), _keep_axis(channels, self.n_rx)
+        if out is None:
+            out = np.empty((len(lines), np.size(samples_idx)), dtype=dtype)
+        else:
+            out = out.reshape(len(lines), -1)
+        for i in range(0, len(lines), chunk_size):
+            rows = lines[i:i+chunk_size]
+            if np.all(np.diff(rows) == 1):
+                rows = slice(rows[0], rows[-1] + 1)     # consecutive scanlines: view on the memory map
+            np.sum(self.rf[rows][:, samples, channels], axis=2, dtype=out.dtype, out=out[i:i+chunk_size])
+        return out.reshape(np.shape(idx) + np.shape(samples_idx))
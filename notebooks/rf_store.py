@@ -0,0 +1,214 @@
+"""
+Chunked, compressed HDF5 store for pulse-echo RF blocks (and re-chunking of image files).
+
+Layout of a store file:
+    /rf         int16 (frame, scanline, RF sample, RX channel), native sample type,
+                one chunk per `chunk_scanlines` scanlines of one frame,
+                optional lossless compression (gzip/lzf + byte shuffle)
+    attributes  SF, SOS, sample_offset, n_tx, n_rx, axes, source
+
+Usage:
+    python rf_store.py convert ../data/ex1-pulse-echo/*-block.npy -o ../data/ex1-store --compression gzip
+    python rf_store.py convert-image image.hdf5 -o image_gzip.hdf5 --compression lzf
+    python rf_store.py info ../data/ex1-store/tx4rx4-v1-block.h5
+
+`US_RFStore` reads a store with the interface of rf_dataset.US_RFDataset: only the chunks
+of the requested scanlines/samples/channels are read and decompressed.
+"""
+import argparse
+import os
+import re
+import numpy as np
+import h5py
+
+from display_scans import SF, SOS
+from rf_dataset import US_RFDataset, _keep_axis
+from us_classes import US_RecoImage, save_reco_image
+
+AXES = 'frame,scanline,sample,rx'
+
+
+def _index_runs(idx):
+    """ Split increasing indices into slices of consecutive values (h5py reads slices fastest) """
+    breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+    return [slice(run[0], run[-1] + 1) for run in np.split(idx, breaks) if len(run)]
+
+
+def convert_block(npy_path, store_path, sf=SF, sos=SOS, sample_offset=0, chunk_scanlines=1,
+                  compression='gzip', compression_opts=None):
+    """
+    Convert a (frame, scanline, RF sample, RX channel) .npy block into a chunked HDF5 store
+    (samples keep their integer type; compression is lossless)
+    """
+    block = np.load(npy_path, mmap_mode='r')
+    if block.ndim == 3:
+        block = block[np.newaxis]
+    n_frames, n_scanlines, n_samples, n_rx = block.shape
+    layout = re.search(r'tx(\d+)rx(\d+)', os.path.basename(npy_path))
+    with h5py.File(store_path, 'w') as f:
+        dset = f.create_dataset('rf', block.shape, dtype=block.dtype,
+                                chunks=(1, min(chunk_scanlines, n_scanlines), n_samples, n_rx),
+                                compression=compression, compression_opts=compression_opts,
+                                shuffle=compression is not None)
+        for i in range(n_frames):
+            for s in range(0, n_scanlines, chunk_scanlines):
+                dset[i, s:s+chunk_scanlines] = block[i, s:s+chunk_scanlines]
+        dset.attrs.update({'SF': sf, 'SOS': sos, 'sample_offset': sample_offset, 'axes': AXES,
+                           'n_tx': int(layout.group(1)) if layout else n_rx, 'n_rx': n_rx,
+                           'source': os.path.basename(npy_path)})
+    return store_path
+
+
+def convert_reco_image(src_path, dst_path, compression='gzip', compression_opts=None, chunk_lines=None,
+                       dtype=None):
+    """
+    Rewrite a PICMUS image file frame by frame with compression (US_RecoImage reads it unchanged).
+    Samples keep the type of the source unless `dtype` (real type, e.g. np.float32) narrows them.
+    """
+    with h5py.File(src_path, 'r') as f:
+        source_dtype = f['US/US_DATASET0000/data/real'].dtype
+    dtype = np.dtype(source_dtype if dtype is None else dtype)
+    with US_RecoImage(src_path, lazy=True, dtype=np.result_type(dtype, np.complex64)) as image:
+        frames = (image.data[i] for i in range(len(image.data)))
+        save_reco_image(dst_path, image.x_axis, image.z_axis, frames, image.number_plane_waves,
+                        image.transmit_f_number, image.receive_f_number,
+                        image.transmit_apodization_window, image.receive_apodization_window,
+                        compression, compression_opts, chunk_lines, dtype)
+    return dst_path
+
+
+class US_RFStore:
+    """
+    Pulse-echo RF block read from a chunked HDF5 store, one frame at a time
+    Input:
+        file_path:          full path of the store
+        frame:              frame (acquisition) exposed by rf/select/rx_sum
+    Public properties:
+        n_frames, n_scanlines, n_samples, n_rx, SF, SOS, sample_offset, n_tx
+        rf                  whole frame as an array (scanline, RF sample, RX channel)
+    Use as a context manager (or call `close`) to release the HDF5 file.
+    """
+    def __init__(self, file_path, frame=0):
+        self.file_path = file_path
+        self.file = h5py.File(file_path, 'r')
+        self.dataset = self.file['rf']
+        self.frame = frame
+        self.n_frames, self.n_scanlines, self.n_samples, self.n_rx = self.dataset.shape
+        self.attrs = dict(self.dataset.attrs)
+        self.SF = float(self.attrs['SF'])
+        self.SOS = float(self.attrs['SOS'])
+        self.sample_offset = int(self.attrs['sample_offset'])
+        self.n_tx = int(self.attrs['n_tx'])
+
+    @property
+    def shape(self):
+        return self.dataset.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def rf(self):
+        return self.select()
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        return self.dataset[(self.frame,) + key]
+
+    def select(self, scanlines=slice(None), samples=slice(None), channels=slice(None)):
+        """ Array of the selected scanlines, sample range and RX channels (only their chunks are read) """
+        if isinstance(scanlines, slice):
+            return self.dataset[self.frame, scanlines, samples, channels]
+        # integer or fancy key: read runs of consecutive scanlines (an integer drops the axis)
+        idx = np.arange(self.n_scanlines)[scanlines]
+        runs = _index_runs(np.atleast_1d(idx))
+        block = np.concatenate([self.dataset[self.frame, run, samples, channels] for run in runs])
+        return block[0] if np.ndim(idx) == 0 else block
+
+    def rx_sum(self, scanlines=slice(None), samples=slice(None), channels=slice(None),
+               chunk_size=16, dtype=np.float32, out=None):
+        """
+        Sum over RX channels (scanline x RF sample), read `chunk_size` scanlines at a time;
+        integer scanlines/samples drop their axis as in numpy indexing
+        """
+        idx = np.arange(self.n_scanlines)[scanlines]
+        samples_idx = np.arange(self.n_samples)[samples]
+        channels = _keep_axis(channels, self.n_rx)
+        lines = np.atleast_1d(idx)
+        if out is None:
+            out = np.empty((len(lines), len(np.atleast_1d(samples_idx))), dtype=dtype)
+        else:
+            out = out.reshape(len(lines), -1)
+        for i in range(0, len(lines), chunk_size):
+            block = self.select(lines[i:i+chunk_size], _keep_axis(samples, self.n_samples), channels)
+            np.sum(block, axis=2, dtype=out.dtype, out=out[i:i+chunk_size])
+        return out.reshape(np.shape(idx) + np.shape(samples_idx))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_rf(file_path):
+    """ US_RFStore for .h5/.hdf5 stores, US_RFDataset for .npy blocks """
+    if file_path.lower().endswith(('.h5', '.hdf5')):
+        return US_RFStore(file_path)
+    return US_RFDataset(file_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Chunked, compressed HDF5 store for RF blocks.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    conv = sub.add_parser('convert', help='convert *-block.npy files to stores')
+    conv.add_argument('files', nargs='+')
+    conv.add_argument('-o', '--output-dir', default='.')
+    conv.add_argument('--chunk-scanlines', type=int, default=1)
+    conv.add_argument('--sample-offset', type=int, default=0)
+    conv.add_argument('--sf', type=float, default=SF, help='sampling frequency [Hz]')
+    conv.add_argument('--sos', type=float, default=SOS, help='speed of sound [m/s]')
+    img = sub.add_parser('convert-image', help='rewrite a PICMUS image file with compression')
+    img.add_argument('file')
+    img.add_argument('-o', '--output', required=True)
+    img.add_argument('--chunk-lines', type=int, default=None)
+    img.add_argument('--dtype', default=None, choices=['float32', 'float64'],
+                     help='stored sample type (default: as the source)')
+    for p in (conv, img):
+        p.add_argument('--compression', default='gzip', choices=['gzip', 'lzf', 'none'])
+        p.add_argument('--level', type=int, default=None, help='gzip level (0-9)')
+    info = sub.add_parser('info', help='print the layout and metadata of a store')
+    info.add_argument('file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        with h5py.File(args.file, 'r') as f:
+            dset = f['rf']
+            print(f'{args.file}: {dset.dtype} {dset.shape}, chunks {dset.chunks}, '
+                  f'compression {dset.compression} {dset.compression_opts or ""}')
+            for key, value in dset.attrs.items():
+                print(f'    {key} = {value}')
+        return
+
+    compression = None if args.compression == 'none' else args.compression
+    if args.command == 'convert-image':
+        convert_reco_image(args.file, args.output, compression, args.level, args.chunk_lines, args.dtype)
+        print(f'{args.file} ({os.path.getsize(args.file)/2**20:.1f} MiB) -> {args.output} '
+              f'({os.path.getsize(args.output)/2**20:.1f} MiB)')
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for path in args.files:
+        store = os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + '.h5')
+        convert_block(path, store, args.sf, args.sos, args.sample_offset, args.chunk_scanlines,
+                      compression, args.level)
+        print(f'{path} ({os.path.getsize(path)/2**20:.1f} MiB) -> {store} '
+              f'({os.path.getsize(store)/2**20:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
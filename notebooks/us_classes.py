@@ -5,9 +5,10 @@ Code inspired from PICMUS (https://www.creatis.insa-lyon.fr/Challenge/IEEE_IUS_2
 """
 import h5py
 import numpy as np
-import matplotlib.pyplot as plt
 import math
-import time
+from functools import cached_property, lru_cache
+
+import precision
 
 
 def extents(f):
@@ -16,9 +17,10 @@ def extents(f):
 
 
 def py_imagesc(ax, x, y, data):
-    """ Wrapper for PyPlot's `imshow` to imitate Matlab-style IMAGESC. """
-    im = ax.imshow(data, aspect='auto', interpolation='none',
-                   extent=extents(x) + extents(y), origin='lower')
+    """ Wrapper for PyPlot's `imshow` to imitate Matlab-style IMAGESC (level-of-detail for large images). """
+    from lod_rendering import lod_imshow
+    im = lod_imshow(ax, data, aspect='auto', interpolation='none',
+                    extent=extents(x) + extents(y), origin='lower')
     return im
 
 
@@ -29,43 +31,166 @@ def py_ind2sub(array_shape, ind):
     return (rows, cols)
 
 
+class US_FrameReader:
+    """
+    Array-like access to the reconstructed frames, read from HDF5 only when indexed
+    Input:
+        real_part:          h5py dataset with the real part (frame, x, z)
+        imag_part:          h5py dataset with the imaginary part (frame, x, z)
+        dtype:              complex output type (e.g. np.complex64)
+        magnitude:          if True, return only the magnitude (matching real type)
+    """
+    def __init__(self, real_part, imag_part, dtype=np.complex128, magnitude=False):
+        self.real_part = real_part
+        self.imag_part = imag_part
+        self.complex_dtype = np.dtype(dtype)
+        self.real_dtype = np.finfo(self.complex_dtype).dtype
+        self.magnitude = magnitude
+        self.dtype = self.real_dtype if magnitude else self.complex_dtype
+        self.shape = real_part.shape
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        # h5py converts to the requested type while reading (only the touched chunks)
+        re = self.real_part.astype(self.real_dtype)[key]
+        im = self.imag_part.astype(self.real_dtype)[key]
+        if np.ndim(re) == 0:
+            # scalar key: h5py returns numpy scalars (no buffer to write into)
+            return np.hypot(re, im) if self.magnitude else self.complex_dtype.type(complex(re, im))
+        if self.magnitude:
+            return np.hypot(re, im, out=re)
+        out = np.empty(np.shape(re), dtype=self.complex_dtype)
+        out.real = re
+        out.imag = im
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[()], dtype=dtype)
+
+
 class US_RecoImage:
     """
     Class containing the DAS (delay-and-sum) beamformed data (source: PICMUS)
     Input:
         file_path:                  full path of recontructed image  
+        lazy:                       if True, frames are read from the file only when indexed
+        dtype:                      complex type of the data (np.complex128 or np.complex64;
+                                    default: complex type of the current `precision`)
+        magnitude:                  if True, keep only the magnitude of the data
     Public properties:
         x_axis                      vector defining the x coordinates (from scan)
         z_axis                      vector defining the z coordinates (from scan)
+        x_matrix, z_matrix          coordinate grids (built on first access)
         number_plane_waves          vector containing number of plane waves used in each reconstructed frame
         data                        matrix containing the envelope of the reconstructed signal 
+                                    (US_FrameReader in lazy mode, indexed the same way)
         transmit_f_number           scalar of the F-number used on transmit
         transmit_apodization_window string describing the transmit apodization window
         receive_f_number            scalar of the F-number used on receive
         receive_apodization_window  string describing the receive apodization window 
+    Use as a context manager (or call `close`) to release the HDF5 file.
     """
-    def __init__(self, file_path):
-        data = h5py.File(file_path, "r")
+    def __init__(self, file_path, lazy=False, dtype=None, magnitude=False):
+        self.file_path = file_path
+        if dtype is None:
+            dtype = precision.complex_type()
+        self.file = h5py.File(file_path, "r")
+        dataset = self.file['US']['US_DATASET0000']
 
         # read scan
-        self.x_axis = data['US']['US_DATASET0000']['scan']['x_axis'][:]
-        self.z_axis = data['US']['US_DATASET0000']['scan']['z_axis'][:]
-        self.x_matrix, self.z_matrix = np.meshgrid(self.x_axis, self.z_axis)
+        self.x_axis = dataset['scan']['x_axis'][:]
+        self.z_axis = dataset['scan']['z_axis'][:]
 
         #  F-numbers
-        self.transmit_f_number = data['US']['US_DATASET0000']['transmit_f_number']
-        self.receive_f_number = data['US']['US_DATASET0000']['receive_f_number']
+        self.transmit_f_number = dataset['transmit_f_number'][()]
+        self.receive_f_number = dataset['receive_f_number'][()]
 
         # Apodization window
-        self.transmit_apodization_window = data['US']['US_DATASET0000']['transmit_apodization_window']
-        self.receive_apodization_window = data['US']['US_DATASET0000']['receive_apodization_window']
+        self.transmit_apodization_window = dataset['transmit_apodization_window'][()]
+        self.receive_apodization_window = dataset['receive_apodization_window'][()]
 
         # read data
-        self.real_part = data['US']['US_DATASET0000']['data']['real']
-        self.imag_part = data['US']['US_DATASET0000']['data']['imag']
-        self.number_plane_waves = data['US']['US_DATASET0000']['number_plane_waves']
-        # adding [:] returns a numpy array
-        self.data = self.real_part[:] + 1j*self.imag_part[:]
+        self.real_part = dataset['data']['real']
+        self.imag_part = dataset['data']['imag']
+        self.number_plane_waves = dataset['number_plane_waves'][:]
+        self.data = US_FrameReader(self.real_part, self.imag_part, dtype, magnitude)
+        self.dtype = self.data.dtype
+        self.lazy = lazy
+        if not lazy:
+            # [()] returns a numpy array with all frames
+            self.data = self.data[()]
+
+    @cached_property
+    def x_matrix(self):
+        return np.meshgrid(self.x_axis, self.z_axis)[0]
+
+    @cached_property
+    def z_matrix(self):
+        return np.meshgrid(self.x_axis, self.z_axis)[1]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _float_type(a):
+    """ Real floating type keeping the precision of a (at least float32) """
+    return np.promote_types(np.real(np.asarray(a)).dtype, np.float32) if np.size(a) else np.dtype(np.float32)
+
+
+def save_reco_image(file_path, x_axis, z_axis, data, number_plane_waves,
+                    transmit_f_number=0., receive_f_number=0.,
+                    transmit_apodization_window='none', receive_apodization_window='none',
+                    compression=None, compression_opts=None, chunk_lines=None, dtype=None):
+    """
+    Write reconstructed frames in the HDF5 layout read by US_RecoImage (source: PICMUS)
+    Input:
+        file_path:          full path of the output file
+        x_axis, z_axis:     image coordinates [m]
+        data:               (frame, x, z) array, real or complex, or an iterable yielding
+                            (x, z) frames (written one by one, one HDF5 chunk per frame)
+        number_plane_waves: number of plane waves used for each frame
+        compression:        optional lossless HDF5 filter ('gzip' or 'lzf'; level in compression_opts)
+        chunk_lines:        x-lines per chunk (default: whole frames)
+        dtype:              stored real type (default: that of the data, at least float32;
+                            e.g. np.float32 to narrow double-precision data)
+    """
+    number_plane_waves = np.asarray(number_plane_waves, dtype=np.float32).reshape(-1)
+    shape = (len(number_plane_waves), len(x_axis), len(z_axis))
+    frames = iter(data)
+    first = next(frames, None)
+    if dtype is None:
+        dtype = _float_type(first) if first is not None else np.float32
+    with h5py.File(file_path, "w") as f:
+        dataset = f.create_group('US').create_group('US_DATASET0000')
+        dataset['scan/x_axis'] = np.asarray(x_axis, dtype=_float_type(x_axis))
+        dataset['scan/z_axis'] = np.asarray(z_axis, dtype=_float_type(z_axis))
+        dataset['number_plane_waves'] = number_plane_waves
+        dataset['transmit_f_number'] = np.float32(transmit_f_number)
+        dataset['receive_f_number'] = np.float32(receive_f_number)
+        dataset['transmit_apodization_window'] = transmit_apodization_window
+        dataset['receive_apodization_window'] = receive_apodization_window
+
+        chunks = (1, min(chunk_lines or shape[1], shape[1]), shape[2])
+        options = dict(dtype=dtype, chunks=chunks, compression=compression,
+                       compression_opts=compression_opts, shuffle=compression is not None)
+        real_part = dataset.create_dataset('data/real', shape, **options)
+        imag_part = dataset.create_dataset('data/imag', shape, **options)
+        if first is None:
+            return
+        real_part[0] = np.real(first)
+        imag_part[0] = np.imag(first)
+        for f, frame in enumerate(frames, 1):
+            real_part[f] = np.real(frame)
+            imag_part[f] = np.imag(frame)
 
 
 class US_Phantom:
@@ -75,13 +200,123 @@ class US_Phantom:
         file_path:  full path of phantom data
     """
     def __init__(self, file_path):
-        data = h5py.File(file_path, "r")
+        self.file_path = file_path
+        with h5py.File(file_path, "r") as data:
+            self.occlusionCenterX = data['US']['US_DATASET0000']['phantom_occlusionCenterX'][:]
+            self.occlusionCenterZ = data['US']['US_DATASET0000']['phantom_occlusionCenterZ'][:]
+            self.occlusionDiameter = data['US']['US_DATASET0000']['phantom_occlusionDiameter'][:]
+            self.axialResolution = data['US']['US_DATASET0000']['phantom_axialResolution'][:]
+            self.lateralResolution = data['US']['US_DATASET0000']['phantom_lateralResolution'][:]
+
 
-        self.occlusionCenterX = data['US']['US_DATASET0000']['phantom_occlusionCenterX'][:]
-        self.occlusionCenterZ = data['US']['US_DATASET0000']['phantom_occlusionCenterZ'][:]
-        self.occlusionDiameter = data['US']['US_DATASET0000']['phantom_occlusionDiameter'][:]
-        self.axialResolution = data['US']['US_DATASET0000']['phantom_axialResolution'][:]
-        self.lateralResolution = data['US']['US_DATASET0000']['phantom_lateralResolution'][:]
+def _array_key(a):
+    """ Hashable (dtype, shape, bytes) form of an array """
+    a = np.asarray(a)
+    return a.dtype.str, a.shape, a.tobytes()
+
+
+def _from_key(key):
+    dtype, shape, data = key
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+@lru_cache(maxsize=16)
+def _contrast_regions(x_axis, z_axis, padding, center_x, center_z, diameter, lateral_resolution):
+    """ CNR regions of a phantom/grid pair (array arguments as _array_key), see US_ContrastEngine """
+    x, z, center_x, center_z, diameter, lateral_resolution = map(
+        _from_key, (x_axis, z_axis, center_x, center_z, diameter, lateral_resolution))
+    lateral_resolution = lateral_resolution.reshape(-1)[0]
+    regions = []
+    for k in range(len(diameter)):
+        r = diameter[k] / 2
+        rin = r - padding * lateral_resolution
+        rout1 = r + padding * lateral_resolution
+        rout2 = 1.2*math.sqrt(rin**2+rout1**2)
+        xc = center_x[k]
+        zc = center_z[k]
+
+        # bounding box of the outer ring (superset of every mask below)
+        ix = np.flatnonzero((x-xc)**2 <= rout2**2)
+        iz = np.flatnonzero((z-zc)**2 <= rout2**2)
+        dist2 = (x[ix][np.newaxis, :]-xc)**2 + (z[iz][:, np.newaxis]-zc)**2
+        maskOcclusion = dist2 <= r**2
+        maskInside = dist2 <= rin**2
+        maskOutside = np.logical_and(dist2 >= rout1**2, dist2 <= rout2**2)
+
+        # flat indices into a stored (x, z) frame, in the (z, x) order of the B-mode image
+        iz_in, ix_in = np.nonzero(maskInside)
+        iz_out, ix_out = np.nonzero(maskOutside)
+        regions.append({'iz': iz, 'ix': ix,
+                        'occlusion': maskOcclusion, 'inside': maskInside, 'outside': maskOutside,
+                        'inside_idx': ix[ix_in]*len(z) + iz[iz_in],
+                        'outside_idx': ix[ix_out]*len(z) + iz[iz_out]})
+    return regions
+
+
+class US_ContrastEngine:
+    """
+    Headless CNR (contrast to noise ratio) computation, without plotting (source: PICMUS)
+    Region masks depend only on the phantom and the image grid: they are computed once per
+    phantom/grid pair (bounded LRU cache shared by the engines), cropped to the bounding box
+    of each occlusion and kept as index sets.
+    Input:
+        pht:                US_Phantom object
+        x_axis:             vector defining the x coordinates of the image
+        z_axis:             vector defining the z coordinates of the image
+        padding:            margin around the occlusion boundary (in lateral resolutions)
+    Public properties:
+        regions:            per occlusion: (iz, ix) crop indices, occlusion/inside/outside masks
+                            of the crop and flat indices of inside/outside pixels in a (x, z) frame
+    """
+    def __init__(self, pht, x_axis, z_axis, padding=1):
+        self.pht = pht
+        self.x_axis = np.asarray(x_axis)
+        self.z_axis = np.asarray(z_axis)
+        self.padding = padding
+        self.regions = self._build_regions()
+
+    def _build_regions(self):
+        # bounded LRU cache keyed on the geometry: engines of the same phantom/grid share the regions
+        pht = self.pht
+        return _contrast_regions(_array_key(self.x_axis), _array_key(self.z_axis), self.padding,
+                                 _array_key(pht.occlusionCenterX), _array_key(pht.occlusionCenterZ),
+                                 _array_key(pht.occlusionDiameter), _array_key(pht.lateralResolution))
+
+    def region_mask(self, k, name):
+        """ Full-size (z, x) boolean mask of region `name` ('occlusion', 'inside', 'outside'). """
+        region = self.regions[k]
+        mask = np.zeros((len(self.z_axis), len(self.x_axis)), dtype=bool)
+        mask[np.ix_(region['iz'], region['ix'])] = region[name]
+        return mask
+
+    def bmode(self, frames):
+        """ Log-compressed B-mode (frame, z, x) of stored (frame, x, z) envelopes, in one pass. """
+        env = np.asarray(frames)
+        peak = np.max(env.reshape(env.shape[0], -1), axis=1)
+        return np.transpose(20*np.log10(env/peak[:, np.newaxis, np.newaxis]), (0, 2, 1))
+
+    def score(self, data, chunk_size=16):
+        """
+        CNR [dB] for every frame and occlusion, rounded to 0.1 dB (frame x occlusion).
+        ARGS:
+            data - (frame, x, z) envelopes: numpy array or lazy US_FrameReader
+            chunk_size - number of frames read and processed together
+        """
+        nb_frames = len(data)
+        score = np.zeros((nb_frames, len(self.regions)))
+        for f in range(0, nb_frames, chunk_size):
+            env = np.asarray(data[f:f+chunk_size])
+            env = env.reshape(env.shape[0], -1)
+            peak = np.max(env, axis=1)[:, np.newaxis]
+            for k, region in enumerate(self.regions):
+                # B-mode values only for the pixels used in the statistics
+                inside = 20*np.log10(env[:, region['inside_idx']]/peak)
+                outside = 20*np.log10(env[:, region['outside_idx']]/peak)
+                value = 20 * np.log10(np.abs(np.mean(inside, axis=1)-np.mean(outside, axis=1)) /
+                                      np.sqrt((np.var(inside, axis=1)+np.var(outside, axis=1))/2))
+                # statistics in the data precision, rounding in double (0.1 dB steps)
+                score[f:f+chunk_size, k] = np.round(value.astype(np.float64)*10) / 10
+        return score
 
 
 class US_Contrast:
@@ -107,84 +342,68 @@ class US_Contrast:
         self.score = 0
         self.dynamic_range = 60
 
-    def evaluate(self):
-        """ Main method call to generate phantom and evaluate contrast """
+    def evaluate(self, cache=None):
+        """
+        Main method call to generate phantom and evaluate contrast
+        (cache: optional result_cache.ResultCache, scores keyed by the phantom/image file contents)
+        """
         # Define parameters / variables
         nb_frames = len(self.image.number_plane_waves[:])
         frame_list = range(nb_frames)
-        self.score = np.zeros((nb_frames, len(self.pht.occlusionDiameter)))
-
-        # Setting axis limits (mm)
-        x_lim = (np.min(self.image.x_matrix)*1e3,
-                 np.max(self.image.x_matrix)*1e3)
-        z_lim = (np.min(self.image.z_matrix)*1e3,
-                 np.max(self.image.z_matrix)*1e3)
-        x = self.image.x_matrix[:]
-        z = self.image.z_matrix[:]
+        engine = US_ContrastEngine(self.pht, self.image.x_axis, self.image.z_axis, self.padding)
+        if cache is not None:
+            self.score = np.array(cache.memoize(
+                ('US_Contrast.evaluate', US_ContrastEngine.score, self.pht.file_path, self.image.file_path,
+                 self.padding, str(self.image.dtype)),
+                lambda: engine.score(self.image.data)))[:nb_frames]
+        else:
+            self.score = engine.score(self.image.data)[:nb_frames]
 
         # # Ploting image reconstruction
         if (self.flagDisplay == 1):
-            fig, ax = plt.subplots(2, 2, figsize=[20, 18])
+            self.display(engine, frame_list)
 
-        # Loop over frames
         for f in frame_list:
-            # Compute dB values
-            env = np.transpose(self.image.data[f, :, :])
-            bmode = 20*np.log10(env/np.max(env))
-
-            # # Ploting image reconstruction
-            if (self.flagDisplay == 1):
-                (ix1, ix2) = py_ind2sub(ax.shape, f)
-                im = py_imagesc(ax[ix1, ix2], self.image.x_axis*1e3,
-                                self.image.z_axis*1e3, abs(bmode))
-                im.set_cmap('gray_r')
-                im.set_clim(vmin=0, vmax=self.dynamic_range)
-                ccb = fig.colorbar(im, ax=ax[ix1, ix2])
-                step = 10
-                ccb.set_ticks(np.arange(0, self.dynamic_range+step, step),
-                              labels=np.flip(np.arange(-self.dynamic_range, step, step)), fontsize=16)
-                ax[ix1, ix2].set_xlabel('x [mm]', fontsize=16)
-                ax[ix1, ix2].set_xlim(x_lim)
-                ax[ix1, ix2].set_ylabel('z [mm]', fontsize=16)
-                ax[ix1, ix2].set_ylim(z_lim)
-                ax[ix1, ix2].set_title(
-                    f'Beamforming for {round(self.image.number_plane_waves[:][f])} plane waves', fontsize=20)
-                ax[ix1, ix2].invert_yaxis()
-                time.sleep(0.1)
-
-            # Main loop
-            for k in range(len(self.pht.occlusionDiameter)):
-                r = self.pht.occlusionDiameter[k] / 2
-                rin = r - self.padding * self.pht.lateralResolution
-                rout1 = r + self.padding * self.pht.lateralResolution
-                rout2 = 1.2*math.sqrt(rin**2+rout1**2)
-                xc = self.pht.occlusionCenterX[k]
-                zc = self.pht.occlusionCenterZ[k]
-                maskOcclusion = (((x-xc)**2 + (z-zc)**2) <= r**2)
-                maskInside = (((x-xc)**2 + (z-zc)**2) <= rin**2)
-                maskOutside = np.logical_and(
-                    (((x-xc)**2 + (z-zc)**2) >= rout1**2), (((x-xc)**2 + (z-zc)**2) <= rout2**2))
-
-                # Ploting image reconstruction
-                if (self.flagDisplay == 1):
-                    ax[ix1, ix2].contour(self.image.x_axis*1e3, self.image.z_axis*1e3,
-                                         maskOcclusion, levels=2, colors='yellow', linewidths=2.5)
-                    ax[ix1, ix2].contour(self.image.x_axis*1e3, self.image.z_axis*1e3,
-                                         maskInside, levels=2, colors='red', linewidths=2.5)
-                    ax[ix1, ix2].contour(self.image.x_axis*1e3, self.image.z_axis*1e3,
-                                         maskOutside, levels=2, colors='green', linewidths=2.5)
-                    time.sleep(0.1)
-
-                # gray level inside the anechoic cystic region
-                inside = bmode[maskInside]
-                outside = bmode[maskOutside]    # gray level outside
-
-                # CNR value
-                value = 20 * math.log10(abs(np.mean(inside)-np.mean(outside)) /
-                                        math.sqrt((np.var(inside)+np.var(outside))/2))
-                self.score[f, k] = np.round(value*10) / 10
-
             score_per_image = np.mean(self.score[f, :])
             print(
                 f'\n DAS Beamforming for {round(self.image.number_plane_waves[:][f])} plane waves:')
             print(f'Mean image contrast score (dB): {score_per_image} \n')
+
+    def display(self, engine, frame_list):
+        """ Plot B-mode images of the frames with occlusion (yellow), inside (red) and outside (green) regions """
+        import matplotlib.pyplot as plt
+
+        # Setting axis limits (mm)
+        x_lim = (np.min(self.image.x_axis)*1e3,
+                 np.max(self.image.x_axis)*1e3)
+        z_lim = (np.min(self.image.z_axis)*1e3,
+                 np.max(self.image.z_axis)*1e3)
+
+        fig, ax = plt.subplots(2, 2, figsize=[20, 18])
+
+        # Loop over frames
+        for f in frame_list:
+            # Compute dB values
+            bmode = engine.bmode(self.image.data[f:f+1])[0]
+
+            (ix1, ix2) = py_ind2sub(ax.shape, f)
+            im = py_imagesc(ax[ix1, ix2], self.image.x_axis*1e3,
+                            self.image.z_axis*1e3, abs(bmode))
+            im.set_cmap('gray_r')
+            im.set_clim(vmin=0, vmax=self.dynamic_range)
+            ccb = fig.colorbar(im, ax=ax[ix1, ix2])
+            step = 10
+            ccb.set_ticks(np.arange(0, self.dynamic_range+step, step),
+                          labels=np.flip(np.arange(-self.dynamic_range, step, step)), fontsize=16)
+            ax[ix1, ix2].set_xlabel('x [mm]', fontsize=16)
+            ax[ix1, ix2].set_xlim(x_lim)
+            ax[ix1, ix2].set_ylabel('z [mm]', fontsize=16)
+            ax[ix1, ix2].set_ylim(z_lim)
+            ax[ix1, ix2].set_title(
+                f'Beamforming for {round(self.image.number_plane_waves[:][f])} plane waves', fontsize=20)
+            ax[ix1, ix2].invert_yaxis()
+
+            for k in range(len(engine.regions)):
+                for name, color in (('occlusion', 'yellow'), ('inside', 'red'), ('outside', 'green')):
+                    ax[ix1, ix2].contour(self.image.x_axis*1e3, self.image.z_axis*1e3,
+                                         engine.region_mask(k, name), levels=2, colors=color, linewidths=2.5)
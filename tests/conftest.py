@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+NOTEBOOKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'notebooks')
+DATA = os.path.join(os.path.dirname(NOTEBOOKS), 'data')
+sys.path.insert(0, NOTEBOOKS)
+
+
+@pytest.fixture
+def rf_block():
+    """ Channel-summed (scanline x RF sample) float64 block of the bundled tx4rx4 data, 8 scanlines """
+    import numpy as np
+    block = np.load(os.path.join(DATA, 'ex1-pulse-echo', 'tx4rx4-v1-block.npy'), mmap_mode='r')
+    return np.asarray(block[0, 40:48].sum(axis=-1), dtype=np.float64)
+
+
+@pytest.fixture
+def rf_int16():
+    """ Raw int16 RF of one channel, 4 scanlines (large enough for abs/square to overflow int16) """
+    import numpy as np
+    block = np.load(os.path.join(DATA, 'ex1-pulse-echo', 'tx4rx4-v1-block.npy'), mmap_mode='r')
+    return np.asarray(block[0, 40:44, :, 0])
+
+
+@pytest.fixture
+def reco_file(tmp_path):
+    """ Small complex image (3 frames, 20 x 30) in the US_RecoImage layout """
+    import numpy as np
+    from us_classes import save_reco_image
+    rng = np.random.default_rng(0)
+    data = (rng.standard_normal((3, 20, 30)) + 1j * rng.standard_normal((3, 20, 30))).astype(np.complex64)
+    path = str(tmp_path / 'image.hdf5')
+    save_reco_image(path, np.linspace(-0.01, 0.01, 20), np.linspace(0.01, 0.04, 30), data, [1, 11, 37])
+    return path
+
+
+@pytest.fixture
+def phantom_path():
+    return os.path.join(DATA, 'ex3-imaging', 'simulation', 'contrast_speckle_simu_phantom.hdf5')
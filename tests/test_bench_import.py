@@ -0,0 +1,14 @@
+import json
+
+import bench_import
+
+
+def test_runs_from_any_directory_and_reports_the_eager_baseline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    output = tmp_path / 'imports.json'
+    bench_import.main(['envelop_core', '-n', '1', '--json', str(output)])
+    [res] = json.loads(output.read_text())
+    assert res['module'] == 'envelop_core'
+    assert res['matplotlib'] is False
+    assert res['time'] > 0 and res['eager_time'] > 0
+    assert res['speedup'] == res['eager_time'] / res['time']
@@ -0,0 +1,76 @@
+import queue
+
+import numpy as np
+import pytest
+
+from cine_pipeline import AcquisitionSimulator, CineLoop, CinePipeline, Frame, Stage, _STOP
+
+
+class ListSource:
+    """ Source emitting small synthetic frames as fast as they are accepted """
+    def __init__(self, n_frames):
+        self.n_frames = n_frames
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self, out_queue):
+        for i in range(self.n_frames):
+            if self.stopped:
+                break
+            out_queue.put(Frame(i, 'synthetic', np.full((4, 8), i, dtype=np.float32)))
+        out_queue.put(_STOP)
+
+
+def test_pipeline_runs_all_frames():
+    sink = CineLoop(length=100)
+    report = CinePipeline(ListSource(10), [Stage('double', lambda d: 2 * d)], sink).run()
+    assert report['frames_processed'] == 10
+    assert [index for index, _ in sink.frames] == list(range(10))
+    np.testing.assert_array_equal(sink.frames[3][1], 6)
+
+
+
+def test_rerun_reports_only_its_own_frames():
+    pipeline = CinePipeline(ListSource(10), [Stage('double', lambda d: 2 * d)], CineLoop(length=100))
+    pipeline.run()
+    pipeline.source = ListSource(4)
+    report = pipeline.run()
+    assert report['frames_processed'] == len(pipeline.timings) == 4
+    assert [t[0] for t in pipeline.timings] == list(range(4))
+
+
+def test_replayed_acquisition_counts_per_run(tmp_path):
+    path = tmp_path / 'tx1rx1-v1-block.npy'
+    np.save(path, np.zeros((1, 2, 16, 1), dtype=np.int16))
+    source = AcquisitionSimulator([str(path)], frame_rate=None, n_frames=3, drop=False)
+    for _ in range(2):
+        report = CinePipeline(source, [], CineLoop(length=10)).run()
+        assert report['frames_acquired'] == report['frames_processed'] == 3
+        assert report['frames_dropped'] == 0
+
+
+def test_raising_stage_is_reraised_without_hanging():
+    def fail_on_third(data):
+        if data[0, 0] == 2:
+            raise RuntimeError('stage failure')
+        return data
+
+    stages = [Stage('ok', lambda d: d), Stage('bad', fail_on_third), Stage('after', lambda d: d)]
+    source = ListSource(50)
+    pipeline = CinePipeline(source, stages, queue_size=1)
+    with pytest.raises(RuntimeError, match='stage failure'):
+        pipeline.run()
+    assert source.stopped
+
+
+def test_stage_forwards_stop_after_exception():
+    in_queue, out_queue = queue.Queue(), queue.Queue()
+    errors = []
+    for item in (Frame(0, 'a', 1.), Frame(1, 'b', 2.), _STOP):
+        in_queue.put(item)
+    stage = Stage('bad', lambda d: 1 / 0)
+    stage.run(in_queue, out_queue, on_error=lambda s, err: errors.append(err))
+    assert out_queue.get_nowait() is _STOP
+    assert len(errors) == 1 and isinstance(errors[0], ZeroDivisionError)
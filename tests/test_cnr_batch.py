@@ -0,0 +1,62 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pytest
+
+import cnr_batch
+from phantom_generator import generate
+from us_classes import US_ContrastEngine, US_Phantom, US_RecoImage
+
+
+@pytest.fixture
+def pairs(tmp_path, phantom_path, reco_file):
+    """ Manifest entries: generated phantom + image, bundled phantom + small image, missing image """
+    generate(str(tmp_path / 'gen'), nx=80, nz=120, number_plane_waves=(1, 75), density=3.)
+    return [{'name': 'generated', 'phantom': os.path.join('gen', 'phantom.hdf5'), 'image': os.path.join('gen', 'image.hdf5')},
+            {'phantom': phantom_path, 'image': reco_file},
+            {'name': 'missing', 'phantom': phantom_path, 'image': 'missing.hdf5'}]
+
+
+def expected_score(phantom, image):
+    with US_RecoImage(image) as img:
+        return US_ContrastEngine(US_Phantom(phantom), img.x_axis, img.z_axis).score(img.data)
+
+
+@pytest.mark.parametrize('manifest_ext', ['json', 'csv'])
+def test_manifest_to_csv_and_json_reports(tmp_path, pairs, manifest_ext):
+    manifest = tmp_path / f'manifest.{manifest_ext}'
+    if manifest_ext == 'json':
+        manifest.write_text(json.dumps(pairs))
+    else:
+        with open(manifest, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['name', 'phantom', 'image'])
+            writer.writeheader()
+            writer.writerows(pairs)
+
+    entries = cnr_batch.read_manifest(str(manifest))
+    assert [e['name'] for e in entries] == ['generated', 'image', 'missing']
+    assert all(os.path.isabs(e['image']) for e in entries)
+
+    csv_report, json_report = str(tmp_path / 'report.csv'), str(tmp_path / 'report.json')
+    assert cnr_batch.main([str(manifest), '-o', csv_report, '-j', '2']) == 1      # one pair failed
+    assert cnr_batch.main([str(manifest), '-o', json_report, '-j', '2']) == 1
+
+    with open(json_report) as f:
+        report = json.load(f)
+    results = report['results']
+    assert report['wall_time'] > 0
+    assert [r['status'] for r in results] == ['ok', 'ok', 'error']
+    assert results[2]['error'].startswith('FileNotFoundError')
+    for res, entry in zip(results[:2], entries):
+        np.testing.assert_allclose(res['score'], expected_score(entry['phantom'], entry['image']))
+    assert results[0]['number_plane_waves'] == [1, 75]
+    assert results[0]['mean_score'][1] > results[0]['mean_score'][0]
+
+    with open(csv_report, newline='') as f:
+        rows = list(csv.DictReader(f))
+    generated = [r for r in rows if r['name'] == 'generated']
+    assert len(generated) == 2 * 9             # frames x occlusions
+    assert float(generated[0]['cnr_db']) == pytest.approx(results[0]['score'][0][0])
+    assert [r['status'] for r in rows if r['name'] == 'missing'] == ['error']
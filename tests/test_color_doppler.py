@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from color_doppler import ColorFlowProcessor, clutter_filter, synthetic_ensemble
+
+
+def test_velocity_inside_the_vessel():
+    ensemble, true_velocity = synthetic_ensemble(nx=64, nz=128, peak_velocity=30.)
+    with ColorFlowProcessor(tile_size=16) as cfp:
+        velocity, power = cfp.process(ensemble)
+    vessel = ~np.isnan(true_velocity)
+    assert np.nanmean(np.abs(velocity[vessel] - true_velocity[vessel])) < 0.5
+    assert np.mean(~np.isnan(velocity[vessel])) > 0.8
+    assert np.mean(~np.isnan(velocity[~vessel])) < 0.1
+    assert power.max() == 0
+
+
+def test_aliasing_above_the_nyquist_velocity():
+    cfp = ColorFlowProcessor()
+    nyquist = cfp.nyquist_velocity
+    ensemble, true_velocity = synthetic_ensemble(nx=32, nz=128, peak_velocity=1.5 * nyquist, noise_db=-60.)
+    velocity, _ = cfp.process(ensemble)
+    assert np.nanmax(np.abs(velocity)) <= nyquist * (1 + 1e-6)
+    below = true_velocity < 0.9 * nyquist
+    above = true_velocity > 1.1 * nyquist
+    # estimates wrap around by 2 * nyquist
+    assert np.nanmean(np.abs(velocity[below] - true_velocity[below])) < 0.5
+    assert np.nanmean(np.abs(velocity[above] - (true_velocity[above] - 2 * nyquist))) < 0.5
+
+
+def test_clutter_filter_removes_mean_and_drift():
+    n = 10
+    t = np.linspace(-1, 1, n)[:, np.newaxis, np.newaxis]
+    rng = np.random.default_rng(0)
+    mean = rng.standard_normal((1, 4, 5)) + 1j * rng.standard_normal((1, 4, 5))
+    drift = rng.standard_normal((1, 4, 5)) * t
+    np.testing.assert_allclose(clutter_filter(np.broadcast_to(mean, (n, 4, 5)), order=0), 0, atol=1e-5)
+    assert np.abs(clutter_filter(mean + drift, order=0)).max() > 0.1
+    np.testing.assert_allclose(clutter_filter(mean + drift, order=1), 0, atol=1e-5)
+    with pytest.raises(ValueError):
+        clutter_filter(mean + drift, order=n - 1)
+
+
+def test_pool_is_reused_and_tiles_match():
+    ensemble, _ = synthetic_ensemble(nx=40, nz=32)
+    single = ColorFlowProcessor(tile_size=40).process(ensemble)
+    with ColorFlowProcessor(tile_size=8, n_workers=3) as cfp:
+        tiled = cfp.process(ensemble)
+        pool = cfp._pool()
+        cfp.process(ensemble)
+        assert cfp._pool() is pool
+    assert cfp._own_executor is None
+    for a, b in zip(single, tiled):
+        np.testing.assert_array_equal(a, b)
+
+    with ThreadPoolExecutor(2) as shared:
+        with ColorFlowProcessor(tile_size=8, executor=shared) as cfp:
+            np.testing.assert_array_equal(cfp.process(ensemble)[1], single[1])
+        assert shared.submit(lambda: 1).result() == 1    # a given executor is not shut down
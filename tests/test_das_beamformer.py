@@ -0,0 +1,75 @@
+import warnings
+
+import numpy as np
+
+from das_beamformer import DAS_Beamformer, beamform_scanlines, rx_apodization
+
+FS = 65e6
+SOS = 5920
+
+
+def test_single_channel_scanlines_reproduce_rf():
+    rng = np.random.default_rng(0)
+    rf = rng.standard_normal((3, 256, 1)).astype(np.float32)
+    for offset in (0, 100):
+        out = beamform_scanlines(rf, pitch=3e-4, fs=FS, sos=SOS, sample_offset=offset)
+        # every sample, including the last one, is the sample itself
+        np.testing.assert_allclose(out, rf[..., 0], rtol=1e-4, atol=1e-4)
+
+
+def test_apodization_at_zero_depth_without_warnings():
+    element_x = np.linspace(-0.01, 0.01, 16)
+    x = np.array([element_x[3], 0.001, 0.0])
+    z = np.array([0.0, 0.0, 0.02])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        apod = rx_apodization(x, z, element_x, f_number=1.75)
+        das = DAS_Beamformer(element_x, FS, SOS, np.linspace(-0.01, 0.01, 8), np.linspace(0, 0.02, 16))
+    assert apod[0, 3] == 1 and apod[0].sum() == 1      # pixel right above an element
+    assert apod[1].sum() == 1                            # nearest element kept
+    assert apod[2].sum() > 1
+    assert np.all(np.isfinite(das.apodization))
+
+
+def test_beamform_tiles_match_single_tile():
+    rng = np.random.default_rng(1)
+    element_x = np.linspace(-0.005, 0.005, 8)
+    x, z = np.linspace(-0.004, 0.004, 12), np.linspace(0.002, 0.02, 40)
+    rf = rng.standard_normal((400, 8)).astype(np.float32)
+    one = DAS_Beamformer(element_x, FS, SOS, x, z, tile_size=10**6).beamform(rf)
+    tiled = DAS_Beamformer(element_x, FS, SOS, x, z, tile_size=37, n_workers=3).beamform(rf)
+    np.testing.assert_array_equal(one, tiled)
+
+
+def test_single_sample_event():
+    element_x = np.linspace(-0.005, 0.005, 4)
+    das = DAS_Beamformer(element_x, FS, SOS, [0.], [0.])
+    # z = 0 under the centre: delays are fractions of a sample, only delay 0 is valid
+    das.rx_delay[:] = 0
+    image = das.beamform(np.ones((1, 4), dtype=np.float32))
+    assert image.shape == (1, 1) and np.isfinite(image).all()
+    assert image[0, 0] == das.apodization.sum()
+
+
+def test_compound_reuses_one_pool(monkeypatch):
+    import das_beamformer
+    created = []
+
+    class CountingPool(das_beamformer.ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            created.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(das_beamformer, 'ThreadPoolExecutor', CountingPool)
+    rng = np.random.default_rng(2)
+    element_x = np.linspace(-0.005, 0.005, 8)
+    x, z = np.linspace(-0.004, 0.004, 12), np.linspace(0.002, 0.02, 40)
+    angles = np.deg2rad([-5., 0., 5.])
+    rf = rng.standard_normal((3, 400, 8)).astype(np.float32)
+    with DAS_Beamformer(element_x, FS, SOS, x, z, tx_angles=angles, tile_size=37, n_workers=2) as das:
+        tiled = das.reconstruct(rf, [[0, 1, 2], [1]])
+        das.compound(rf)
+    assert len(created) == 1 and das._own_executor is None
+    reference = DAS_Beamformer(element_x, FS, SOS, x, z, tx_angles=angles, tile_size=10**6).reconstruct(rf, [[0, 1, 2], [1]])
+    np.testing.assert_allclose(tiled, reference, rtol=1e-5, atol=1e-4)
+    assert len(created) == 1
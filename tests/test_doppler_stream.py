@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from scipy.io.wavfile import write as write_wav
+
+from doppler_stream import DopplerSpectrogram, StreamingSpectrogram
+
+FS = 8000
+
+
+def batch_power(stft, signal):
+    n = stft.n_frames(len(signal))
+    frames = np.stack([signal[i*stft.step:i*stft.step + stft.NFFT] for i in range(n)])
+    return np.abs(np.fft.rfft(frames * stft.window, axis=1))**2 * stft.scale
+
+
+@pytest.fixture
+def signal():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal(5000).astype(np.float32)
+
+
+@pytest.mark.parametrize('block_size', [100, 255, 256, 1000, 5000])
+def test_blockwise_matches_batch(signal, block_size):
+    stft = StreamingSpectrogram(FS, NFFT=256)
+    parts = [stft.process(signal[i:i+block_size]) for i in range(0, len(signal), block_size)]
+    power = np.concatenate(parts)
+    assert all(p.shape[1] == len(stft.freqs) for p in parts)
+    np.testing.assert_allclose(power, batch_power(StreamingSpectrogram(FS, NFFT=256), signal), rtol=1e-4, atol=1e-12)
+
+
+def test_block_shorter_than_nfft_returns_empty(signal):
+    stft = StreamingSpectrogram(FS, NFFT=256)
+    out = stft.process(signal[:10])
+    assert out.shape == (0, len(stft.freqs)) and out.dtype == np.float32
+    assert len(stft.buffer) == 10
+
+
+def test_compute_with_short_final_block(tmp_path):
+    rng = np.random.default_rng(1)
+    wav = str(tmp_path / 'doppler.wav')
+    write_wav(wav, FS, (1000 * rng.standard_normal(2 * 4096 + 10)).astype(np.int16))
+    spec = DopplerSpectrogram.compute(wav, str(tmp_path / 'spec.npy'), NFFT=1024, block_size=4096)
+    stft = StreamingSpectrogram(FS, 1024)
+    assert spec.power.shape == (stft.n_frames(2 * 4096 + 10), len(stft.freqs))
+
+
+def test_compute_with_block_smaller_than_nfft(tmp_path):
+    rng = np.random.default_rng(2)
+    wav = str(tmp_path / 'doppler.wav')
+    write_wav(wav, FS, (1000 * rng.standard_normal(20000)).astype(np.int16))
+    small = DopplerSpectrogram.compute(wav, str(tmp_path / 'small.npy'), NFFT=1024, block_size=300)
+    large = DopplerSpectrogram.compute(wav, str(tmp_path / 'large.npy'), NFFT=1024, block_size=2**16)
+    np.testing.assert_allclose(small.power, large.power, rtol=1e-4, atol=1e-12)
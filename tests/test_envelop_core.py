@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import cine_pipeline
+import envelop_core
+
+
+def test_log_compress():
+    env = np.array([[1., 0.1, -0.01, 0.]])
+    bmode = envelop_core.log_compress(env, dynamic_range=30)
+    assert bmode.dtype == np.float32
+    np.testing.assert_allclose(bmode, [[0, -20, -30, -30]], atol=1e-4)
+    assert cine_pipeline.log_compress is envelop_core.log_compress
+
+
+def test_rf_batch_does_not_import_the_pipeline():
+    code = 'import sys, rf_batch; print("cine_pipeline" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(envelop_core.__file__), capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
+
+
+def test_iir_lowpass_cache_is_bounded_and_read_only():
+    b, a = envelop_core.iir_lowpass(3, 0.1 * 65e6, 65e6)
+    with pytest.raises(ValueError):
+        b[0] = 0
+    with pytest.raises(ValueError):
+        a *= 2
+    assert envelop_core.iir_lowpass(3, 0.1 * 65e6, 65e6)[0] is b
+    assert envelop_core.iir_lowpass.cache_info().maxsize == 64
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import envelop_detection as ed
+from envelop_streaming import StreamingEnvelopeDetector
+
+SF = 65e6
+CUTOFF = 0.1 * SF
+
+# (detector, tolerance after the first 32 samples, tolerance everywhere), relative to the envelope max
+TOLERANCES = [
+    (ed.asynchronous_half_wave, 1e-12, 1e-12),
+    (ed.asynchronous_full_wave, 1e-12, 1e-12),
+    (ed.asynchronous_real_square_law, 1e-12, 1e-12),
+    (ed.asynchronous_complex_hilbert, 1e-3, 5e-3),
+    (ed.asynchronous_complex_square_law, 1e-3, 5e-3),
+]
+
+SPLITS = {
+    'one_chunk': [4096],
+    'equal_chunks': [512] * 8,
+    'small_chunks': [64] * 64,
+    'uneven_chunks': [1, 1, 698, 2300, 1096],
+}
+
+
+def stream(detector, rf, sizes, **kwargs):
+    chunks = np.split(rf, np.cumsum(sizes)[:-1], axis=-1)
+    return np.concatenate(list(StreamingEnvelopeDetector(detector, SF, CUTOFF, **kwargs).run(chunks)), axis=-1)
+
+
+@pytest.mark.parametrize('split', SPLITS)
+@pytest.mark.parametrize('detector, tol_interior, tol_all', TOLERANCES, ids=lambda v: getattr(v, '__name__', ''))
+def test_streaming_matches_batch(rf_block, detector, tol_interior, tol_all, split):
+    t = np.arange(rf_block.shape[1]) / SF
+    with np.errstate(invalid='ignore'):
+        batch = detector(rf_block, t, SF, CUTOFF, display=0)
+        out = stream(detector, rf_block, SPLITS[split])
+    assert out.shape == batch.shape
+    scale = np.nanmax(np.abs(batch), axis=-1, keepdims=True)
+    err = np.abs(np.nan_to_num(out) - np.nan_to_num(batch)) / scale
+    assert np.max(err[:, 32:]) <= tol_interior
+    assert np.max(err) <= tol_all
+
+
+def test_streaming_axis(rf_block):
+    t = np.arange(rf_block.shape[1]) / SF
+    batch = ed.asynchronous_full_wave(rf_block.T, t, SF, CUTOFF, display=0, axis=0)
+    chunks = np.array_split(rf_block.T, 5, axis=0)
+    detector = StreamingEnvelopeDetector(ed.asynchronous_full_wave, SF, CUTOFF, axis=0)
+    np.testing.assert_allclose(np.concatenate(list(detector.run(chunks)), axis=0), batch, rtol=1e-12)
+
+
+@pytest.mark.parametrize('detector', [ed.asynchronous_full_wave, ed.asynchronous_complex_square_law],
+                         ids=lambda v: v.__name__)
+def test_streaming_single_precision(rf_block, detector):
+    import precision
+    t = np.arange(rf_block.shape[1]) / SF
+    with precision.using('single'):
+        batch = detector(rf_block, t, SF, CUTOFF, display=0)
+        out = stream(detector, rf_block, SPLITS['uneven_chunks'])
+    assert out.dtype == batch.dtype == np.float32
+    scale = np.max(np.abs(batch), axis=-1, keepdims=True)
+    tol = 1e-5 if detector is ed.asynchronous_full_wave else 1e-3
+    assert np.max(np.abs(out - batch)[:, 32:] / scale) <= tol
@@ -0,0 +1,137 @@
+"""
+The optimized code paths against straightforward per-line / eager / list-based references
+(written after the original implementations).
+"""
+import os
+
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+from scipy.ndimage import shift
+from scipy.signal import hilbert, iirfilter, lfilter
+
+import envelop_detection as ed
+from display_scans import SF, detect_envelope_scanlines
+from extern_functions import get_envelope, hl_envelopes_idx
+from rf_dataset import US_RFDataset
+
+CUTOFF = 0.1 * SF
+
+
+# -- batch vs per-line envelope detection --
+
+def _lp(sig):
+    b, a = iirfilter(3, Wn=CUTOFF, fs=SF, btype="low", ftype="butter")
+    return lfilter(b, a, sig)
+
+
+REFERENCES = {
+    'asynchronous_half_wave': lambda s: _lp(np.where(s < 0, 0, s)),
+    'asynchronous_full_wave': lambda s: _lp(np.abs(s)),
+    'asynchronous_real_square_law': lambda s: np.sqrt(_lp(s**2)),
+    'asynchronous_complex_hilbert':
+        lambda s: _lp(np.abs(shift(s, 10, mode='wrap')) + np.abs(np.imag(hilbert(s)))),
+    'asynchronous_complex_square_law':
+        lambda s: _lp(np.sqrt(shift(s, 10, mode='wrap')**2 + np.imag(hilbert(s))**2)),
+}
+
+
+@pytest.mark.parametrize('name', sorted(REFERENCES))
+@pytest.mark.filterwarnings("ignore:invalid value encountered in sqrt")
+def test_batch_detectors_match_per_line(rf_block, name):
+    func = getattr(ed, name)
+    t = np.arange(rf_block.shape[1]) / SF
+    # square law: the sqrt of LP ringing below zero is NaN, as in the original
+    with np.errstate(invalid='ignore'):
+        reference = np.stack([REFERENCES[name](line) for line in rf_block])
+    tol = 1e-9 * np.nanmax(np.abs(reference))
+
+    per_line = np.stack([func(line, t, SF, CUTOFF, display=0) for line in rf_block])
+    np.testing.assert_allclose(per_line, reference, rtol=0, atol=tol)
+    np.testing.assert_allclose(detect_envelope_scanlines(rf_block, func, CUTOFF), reference, rtol=0, atol=tol)
+    np.testing.assert_allclose(func(rf_block.T, t, SF, CUTOFF, display=0, axis=0), reference.T, rtol=0, atol=tol)
+
+
+def test_lp_filtration_batch(rf_block):
+    t = np.arange(rf_block.shape[1]) / SF
+    reference = np.stack([_lp(line) for line in rf_block])
+    np.testing.assert_allclose(ed.LP_filtration(rf_block, t, SF, CUTOFF), reference, rtol=0, atol=1e-9)
+
+
+# -- lazy (memory-mapped) vs eager RF loading --
+
+def test_rf_dataset_matches_eager_load():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'ex1-pulse-echo', 'tx4rx4-v1-block.npy')
+    eager = np.squeeze(np.load(path))
+    ds = US_RFDataset(path)
+    assert isinstance(ds.raw, np.memmap)
+    np.testing.assert_array_equal(ds.select(slice(3, 9), slice(100, 900), [0, 2]), eager[3:9, 100:900][..., [0, 2]])
+
+    reference = np.sum(eager, axis=2).astype(np.float32)
+    for chunk_size in (1, 7, 1000):
+        np.testing.assert_array_equal(ds.rx_sum(chunk_size=chunk_size), reference)
+    np.testing.assert_array_equal(ds.rx_sum(slice(5, 20), slice(0, 2048), chunk_size=4), reference[5:20, :2048])
+
+
+# -- vectorized vs list-based extern_functions --
+
+def _hl_envelopes_idx_reference(s, dmin=1, dmax=1, split=False):
+    lmin = (np.diff(np.sign(np.diff(s))) > 0).nonzero()[0] + 1
+    lmax = (np.diff(np.sign(np.diff(s))) < 0).nonzero()[0] + 1
+    if split:
+        s_mid = np.mean(s)
+        lmin = lmin[s[lmin] < s_mid]
+        lmax = lmax[s[lmax] > s_mid]
+    lmin = lmin[[i+np.argmin(s[lmin[i:i+dmin]]) for i in range(0, len(lmin), dmin)]]
+    lmax = lmax[[i+np.argmax(s[lmax[i:i+dmax]]) for i in range(0, len(lmax), dmax)]]
+    return lmin, lmax
+
+
+def _get_envelope_reference(x, y):
+    x_list, y_list = list(x), list(y)
+    ui, li = [0], [0]
+    for i in range(1, len(x_list)-1):
+        if y_list[i] >= y_list[i-1] and y_list[i] >= y_list[i+1]:
+            ui.append(i)
+        if y_list[i] <= y_list[i-1] and y_list[i] <= y_list[i+1]:
+            li.append(i)
+    ui.append(len(x_list)-1)
+    li.append(len(x_list)-1)
+    if len(ui) == 2 or len(li) == 2:
+        return [], []
+    ub = interp1d(x[ui], y[ui], kind='cubic', bounds_error=False)(x)
+    lb = interp1d(x[li], y[li], kind='cubic', bounds_error=False)(x)
+    return np.array([y, ub]).max(axis=0), np.array([y, lb]).min(axis=0)
+
+
+def _signals():
+    rng = np.random.default_rng(3)
+    t = np.linspace(0, 1, 400)
+    smooth = np.sin(2*np.pi*7*t) * (1 + 0.5*np.sin(2*np.pi*t)) + 0.1*rng.standard_normal(400)
+    # plateaus (ties) from quantization
+    return t, np.stack([smooth, np.round(4*smooth) / 4, rng.standard_normal(400)])
+
+
+@pytest.mark.parametrize('dmin, dmax, split', [(1, 1, False), (3, 5, False), (4, 2, True)])
+def test_hl_envelopes_idx_matches_reference(dmin, dmax, split):
+    _, signals = _signals()
+    batch_min, batch_max = hl_envelopes_idx(signals, dmin, dmax, split)
+    for s, bmin, bmax in zip(signals, batch_min, batch_max):
+        ref_min, ref_max = _hl_envelopes_idx_reference(s, dmin, dmax, split)
+        lmin, lmax = hl_envelopes_idx(s, dmin, dmax, split)
+        for got in ((lmin, lmax), (bmin, bmax)):
+            np.testing.assert_array_equal(got[0], ref_min)
+            np.testing.assert_array_equal(got[1], ref_max)
+
+
+def test_get_envelope_matches_reference():
+    t, signals = _signals()
+    batch_ub, batch_lb = get_envelope(t, signals)
+    for s, bub, blb in zip(signals, batch_ub, batch_lb):
+        ref_ub, ref_lb = _get_envelope_reference(t, s)
+        ub, lb = get_envelope(t, s)
+        np.testing.assert_allclose(ub, ref_ub, rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(lb, ref_lb, rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(bub, ref_ub, rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(blb, ref_lb, rtol=1e-12, atol=1e-12)
+    assert get_envelope(t[:3], np.array([0., 1., 2.])) == ([], [])
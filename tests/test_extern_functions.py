@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+
+import extern_functions
+from extern_functions import get_envelope
+
+
+def reference_envelope(x, y):
+    """ Per-signal interp1d(kind='cubic') through the peaks, as the original get_envelope """
+    upper, lower = extern_functions._peak_masks(y)
+    ub = interp1d(x[upper], y[upper], kind='cubic')(x)
+    lb = interp1d(x[lower], y[lower], kind='cubic')(x)
+    return np.maximum(y, ub), np.minimum(y, lb)
+
+
+def test_batch_interpolates_in_one_pass(monkeypatch):
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 1, 300))        # irregular sampling
+    signals = np.sin(30 * x) * rng.uniform(0.5, 2, (6, 1)) + 0.2 * rng.standard_normal((6, 300))
+    expected = [reference_envelope(x, y) for y in signals]
+    # no per-row interpolant
+    monkeypatch.setattr(extern_functions, 'interp1d', None, raising=False)
+    ub, lb = get_envelope(x, signals)
+    for n, (ref_ub, ref_lb) in enumerate(expected):
+        np.testing.assert_allclose(ub[n], ref_ub, rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(lb[n], ref_lb, rtol=1e-12, atol=1e-12)
+        assert np.all(lb[n] <= signals[n]) and np.all(signals[n] <= ub[n])
+
+
+def test_rows_without_enough_peaks_are_nan():
+    x = np.linspace(0, 1, 50)
+    signals = np.stack([np.sin(20 * x), x, np.sin(np.pi * x), np.cos(40 * x)])
+    ub, lb = get_envelope(x, signals)
+    assert np.isnan(ub[1]).all() and np.isnan(lb[1]).all()       # monotonic: end points only
+    assert np.isnan(ub[2]).all()                                   # 3 maxima (end points + 1)
+    for n in (0, 3):
+        ref_ub, ref_lb = reference_envelope(x, signals[n])
+        np.testing.assert_allclose(ub[n], ref_ub, atol=1e-12)
+        np.testing.assert_allclose(lb[n], ref_lb, atol=1e-12)
+    assert get_envelope(x, signals[2]) == ([], [])
+    assert get_envelope(x, np.sin(20 * x))[0].shape == (50,)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.int16])
+def test_input_types(dtype):
+    x = np.arange(200)
+    y = (100 * np.sin(x / 7.) + 10 * np.cos(x / 2.)).astype(dtype)
+    ub, lb = get_envelope(x, y)
+    ref_ub, ref_lb = reference_envelope(x, y.astype(np.float64))
+    np.testing.assert_allclose(ub, ref_ub, rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(lb, ref_lb, rtol=1e-6, atol=1e-6)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+from scipy.signal import butter, filtfilt, find_peaks
+
+from extern_functions import hl_envelopes_idx
+from hemodynamics import cardiac_points, convert_to_velo, hemodynamic_metrics, max_velocity_trace
+
+AUDIO_FS = 44100
+
+
+def synthetic_trace(duration=8., rate=256, heart_rate=72, seed=0):
+    """
+    Max-frequency trace: systolic pulses on a diastolic floor, jittered, on a 10 Hz grid
+    (rate: power of two, so the time bins are exact and any envelope grid has the same length)
+    """
+    rng = np.random.default_rng(seed)
+    bins = (np.arange(int(duration * rate)) + 0.5) / rate
+    phase = (bins * heart_rate / 60) % 1
+    trace = 900 + 2100 * np.exp(-0.5 * ((phase - 0.2) / 0.06)**2) - 300 * phase
+    trace += 60 * rng.standard_normal(len(bins))
+    return bins, np.round(trace / 10) * 10
+
+
+def notebook_cardiac_points(bins, vec_th, fs):
+    """ The ex2 notebook cells (envelope detection, PSV/EDV), with the envelope rate fs """
+    _, lmax = hl_envelopes_idx(vec_th.copy())
+    env_time1 = bins[lmax]
+    env_val1 = vec_th[lmax]
+    f1 = interp1d(env_time1, env_val1)
+    env_time_inter = np.arange(env_time1[0], env_time1[-1], 1/fs)
+    env_val_inter = f1(env_time_inter)
+    b, a = butter(3, 2*15/fs, btype='low', analog=False)
+    output = filtfilt(b, a, env_val_inter.copy())
+    dist = round(0.6*fs)
+    peaks, _ = find_peaks(env_val_inter, distance=dist)
+    minimas, _ = find_peaks(-output, distance=dist)
+    tmp = []
+    for m in minimas:
+        [tmp.append(m) for p in peaks if (m < p) and (m > p-0.5*fs)]
+    return env_val1, env_val_inter, output, peaks, np.array(tmp, dtype=int)
+
+
+def notebook_metrics(env_val1, env_val_inter, output, peaks, minimas):
+    data = env_val1.copy()
+    data[data == 0] = np.nan
+    MV = np.nanmean(convert_to_velo(data))
+    PSV = np.mean(convert_to_velo(env_val_inter[peaks]))
+    EDV = np.mean(convert_to_velo(output[minimas]))
+    return {'MV': MV, 'PSV': PSV, 'EDV': EDV, 'RI': (PSV-EDV)/PSV, 'PI': (PSV-EDV)/MV}
+
+
+@pytest.mark.parametrize('fs', [None, 2000., AUDIO_FS])
+def test_cardiac_points_match_notebook(fs):
+    bins, trace = synthetic_trace()
+    points = cardiac_points(bins, trace, fs=fs)
+    ref = notebook_cardiac_points(bins, trace, fs or 256)
+    np.testing.assert_array_equal(points['env_val'], ref[0])
+    np.testing.assert_allclose(points['envelope'], ref[1])
+    np.testing.assert_allclose(points['filtered'], ref[2])
+    np.testing.assert_array_equal(points['peaks'], ref[3])
+    np.testing.assert_array_equal(points['minima'], ref[4])
+    assert len(points['peaks']) >= 8 and len(points['minima']) >= 7
+    metrics, expected = hemodynamic_metrics(points), notebook_metrics(*ref)
+    for name in expected:
+        assert metrics[name] == pytest.approx(expected[name])
+
+
+def test_default_rate_keeps_the_trace_peaks():
+    bins, trace = synthetic_trace()
+    points = cardiac_points(bins, trace)
+    # the envelope grid falls on the trace samples: PSV samples are traced values
+    psv = points['envelope'][points['peaks']]
+    assert np.all(np.isin(np.round(psv, 6), trace))
+
+
+def test_short_traces_raise():
+    bins, trace = synthetic_trace()
+    with pytest.raises(ValueError, match='local maxima'):
+        cardiac_points(bins[:20], np.linspace(0, 1, 20))
+    with pytest.raises(ValueError, match='low-pass'):
+        cardiac_points(bins[:1], trace[:1])
+
+
+def test_max_velocity_trace_matches_notebook():
+    rng = np.random.default_rng(1)
+    ardB = rng.uniform(0, 60, (50, 30))
+    ardB[:, 3] = 0                          # no value above the threshold
+    freqs = np.linspace(0, 5000, 50)
+    vec_th = np.zeros(30)
+    for i in range(30):
+        try:
+            maxiIx = np.where(ardB[:, i] > 39)[0][-1]
+        except IndexError:
+            maxiIx = 0
+        vec_th[i] = freqs[maxiIx]
+    np.testing.assert_array_equal(max_velocity_trace(ardB, freqs), vec_th)
+    np.testing.assert_array_equal(max_velocity_trace(np.stack([ardB, ardB]), freqs), [vec_th, vec_th])
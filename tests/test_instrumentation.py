@@ -0,0 +1,56 @@
+import numpy as np
+
+import envelop_detection
+import instrumentation
+from envelop_streaming import StreamingEnvelopeDetector
+
+SF = 65e6
+
+
+def test_profile_restores_functions():
+    original = envelop_detection.asynchronous_full_wave
+    with instrumentation.profile():
+        assert envelop_detection.asynchronous_full_wave is not original
+    assert envelop_detection.asynchronous_full_wave is original
+    assert not instrumentation.is_enabled()
+
+
+def test_streaming_detector_accepts_profiled_detectors(rf_block):
+    t = np.arange(rf_block.shape[1]) / SF
+    reference = StreamingEnvelopeDetector(envelop_detection.asynchronous_full_wave, SF, 0.1*SF)
+    expected = np.concatenate(list(reference.run(np.array_split(rf_block, 4, axis=-1))), axis=-1)
+    with instrumentation.profile() as prof:
+        detector = StreamingEnvelopeDetector(envelop_detection.asynchronous_full_wave, SF, 0.1*SF)
+        out = np.concatenate(list(detector.run(np.array_split(rf_block, 4, axis=-1))), axis=-1)
+        batch = envelop_detection.asynchronous_full_wave(rf_block, t, SF, 0.1*SF, display=0)
+    np.testing.assert_array_equal(out, expected)
+    np.testing.assert_allclose(out, batch, rtol=1e-12, atol=1e-9)
+    assert prof.stats()['envelop_detection.asynchronous_full_wave']['calls'] == 1
+
+
+def test_memory_peaks_are_not_reset_by_other_threads():
+    import threading
+    import tracemalloc
+    profiler = instrumentation.Profiler(memory=True)
+    freed = threading.Event()
+    other_done = threading.Event()
+
+    def allocate_then_wait():
+        np.ones(2**20).sum()            # 8 MB, freed before returning
+        freed.set()
+        # give another thread's call the chance to reset the peak
+        other_done.wait(0.5)
+
+    big = profiler.wrap('big', allocate_then_wait)
+    small = profiler.wrap('small', lambda: other_done.set())
+    tracemalloc.start()
+    try:
+        worker = threading.Thread(target=big)
+        worker.start()
+        freed.wait()
+        small()
+        worker.join()
+    finally:
+        tracemalloc.stop()
+    alloc = {e['name']: e['alloc_bytes'] for e in profiler.events}
+    assert alloc['big'] >= 8 * 2**20
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from scipy.signal import hilbert
+
+from iq_demodulation import iq_demodulate, iq_envelope, iq_to_bmode
+
+FS, FC = 65e6, 5e6
+
+
+def pulse_echoes(n=4096, seed=0):
+    """ RF of 12 Gaussian echoes at FC (and their exact envelope) """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / FS
+    env = np.zeros(n)
+    for center in rng.uniform(5e-6, 58e-6, 12):
+        env += rng.uniform(0.2, 1) * np.exp(-0.5 * ((t - center) / 0.4e-6)**2)
+    return env * np.cos(2 * np.pi * FC * t + 0.3), env
+
+
+@pytest.mark.parametrize('decimation', [1, 2, 4, 8])
+def test_iq_envelope_matches_hilbert_envelope(decimation):
+    rf, _ = pulse_echoes()
+    iq, fs_iq = iq_demodulate(rf, FS, FC, decimation)
+    assert iq.dtype == np.complex64 and fs_iq == FS / decimation
+    reference = np.abs(hilbert(rf))[::decimation]
+    # within 0.25% of the envelope max, edges included
+    np.testing.assert_allclose(iq_envelope(iq), reference, rtol=0, atol=2.5e-3 * reference.max())
+
+
+def test_block_matches_single_lines():
+    rf = np.stack([pulse_echoes(seed=s)[0] for s in range(3)])
+    iq, _ = iq_demodulate(rf.T, FS, FC, 4, axis=0)
+    for line, expected in zip(iq.T, rf):
+        np.testing.assert_array_equal(line, iq_demodulate(expected, FS, FC, 4)[0])
+
+
+def test_bmode_is_clipped():
+    rf, _ = pulse_echoes()
+    rf[:1000] = 0
+    iq, _ = iq_demodulate(rf, FS, FC, 4)
+    iq[:10] = 0
+    bmode = iq_to_bmode(iq, dynamic_range=50)
+    assert bmode.dtype == np.float32
+    assert bmode.max() == pytest.approx(0) and bmode.min() == -50
+    np.testing.assert_array_equal(iq_to_bmode(np.zeros((2, 8), np.complex64)), -60)
+    per_line = iq_to_bmode(np.stack([iq, iq / 10]), axis=1)
+    np.testing.assert_allclose(per_line[0], per_line[1], atol=1e-4)
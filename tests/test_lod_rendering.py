@@ -0,0 +1,47 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from lod_rendering import ImagePyramid, TracePyramid, _reduce, lod_imshow
+
+
+def test_reduce_modes():
+    a = np.array([3, -7, 2, 5, -1, 0, 4], dtype=np.int16)
+    np.testing.assert_array_equal(_reduce(a, 3, 0, 'min'), [-7, -1, 4])
+    np.testing.assert_array_equal(_reduce(a, 3, 0, 'max'), [3, 5, 4])
+    np.testing.assert_allclose(_reduce(a, 3, 0, 'mean'), [-2 / 3, 4 / 3, 4])
+    np.testing.assert_array_equal(_reduce(a, 3, 0, 'max-abs'), [-7, 5, 4])
+    assert _reduce(np.array([-32768, 100], dtype=np.int16), 2, 0, 'max-abs')[0] == -32768
+    with pytest.raises(ValueError):
+        _reduce(a, 2, 0, 'median')
+
+
+def test_max_abs_keeps_bipolar_rf_amplitude():
+    t = np.arange(4096)
+    rf = (1000 * np.sin(2 * np.pi * 0.08 * t)).astype(np.int16)[np.newaxis].repeat(16, axis=0)
+    pyramid = ImagePyramid(rf.T, mode='max-abs')
+    coarse = pyramid.level(5, 0)
+    assert np.abs(coarse).min() > 900
+    # the mean pyramid averages the carrier away
+    assert np.abs(ImagePyramid(rf.T, mode='mean').level(5, 0)).max() < 200
+    # max-abs of max-abs equals the direct reduction
+    np.testing.assert_array_equal(coarse, _reduce(rf.T, 32, 0, 'max-abs'))
+
+
+def test_trace_window_bounds():
+    y = np.random.default_rng(0).standard_normal(100000)
+    pyramid = TracePyramid(y)
+    idx, values = pyramid.window(1000, 90000, 500)
+    # min/max pairs of the coarsest level with at least 2 points per pixel
+    assert 2 * 500 <= len(values) <= 2 * 500 * pyramid.factor + 4
+    assert values.max() >= y[1000:90000].max() and values.min() <= y[1000:90000].min()
+
+
+def test_small_image_identical_to_imshow():
+    data = np.random.default_rng(0).standard_normal((20, 30))
+    fig, ax = plt.subplots()
+    im = lod_imshow(ax, data)
+    np.testing.assert_array_equal(im.get_array(), data)
+    plt.close(fig)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from scipy.signal import butter, hilbert, lfilter
+
+import envelop_detection as ed
+import precision
+
+SF = 65e6
+CUTOFF = 0.1 * SF
+DETECTORS = [ed.asynchronous_half_wave, ed.asynchronous_full_wave, ed.asynchronous_real_square_law,
+             ed.asynchronous_complex_hilbert, ed.asynchronous_complex_square_law]
+
+
+def run(detector, x):
+    t = np.arange(x.shape[-1]) / SF
+    with np.errstate(invalid='ignore'):
+        return detector(x, t, SF, CUTOFF, display=0)
+
+
+def reference_complex_square_law(x):
+    """ Independent float64 implementation: delayed real branch, FFT Hilbert branch, LP filter """
+    x = x.astype(np.float64)
+    delayed = np.concatenate([x[..., -11:-1], x[..., :-10]], axis=-1)
+    b, a = butter(3, CUTOFF / (SF / 2))
+    return lfilter(b, a, np.sqrt(delayed**2 + np.imag(hilbert(x))**2), axis=-1)
+
+
+@pytest.mark.parametrize('mode', ['double', 'single'])
+@pytest.mark.parametrize('detector', DETECTORS, ids=lambda f: f.__name__)
+def test_integer_input_matches_float_input(rf_int16, detector, mode):
+    # integer samples are promoted before abs/square (the int16 arithmetic used to overflow)
+    with precision.using(mode):
+        out_int = run(detector, rf_int16)
+        out_float = run(detector, rf_int16.astype(np.float64))
+    assert out_int.dtype == (np.float32 if mode == 'single' else np.float64)
+    np.testing.assert_array_equal(out_int, out_float)
+
+
+def test_complex_square_law_int16_reference(rf_int16):
+    np.testing.assert_allclose(run(ed.asynchronous_complex_square_law, rf_int16),
+                               reference_complex_square_law(rf_int16), rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize('detector', DETECTORS, ids=lambda f: f.__name__)
+def test_single_precision_close_to_double(rf_block, detector):
+    double = run(detector, rf_block)
+    with precision.using('single'):
+        single = run(detector, rf_block)
+    assert single.dtype == np.float32
+    scale = np.nanmax(np.abs(double))
+    np.testing.assert_allclose(np.nan_to_num(single), np.nan_to_num(double), rtol=0, atol=1e-5 * scale)
+
+
+def test_precision_names():
+    assert precision.get_precision() == 'double'
+    with precision.using('single'):
+        assert precision.complex_type() is np.complex64
+    assert precision.float_type() is np.float64
+    with pytest.raises(ValueError):
+        precision.set_precision('half')
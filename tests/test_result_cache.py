@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import envelop_detection as ed
+import precision
+import result_cache
+from display_scans import SF, detect_envelope_scanlines
+from result_cache import ResultCache, fingerprint
+
+
+def test_precision_mode_is_part_of_the_key(tmp_path, rf_block):
+    cache = ResultCache(str(tmp_path))
+    args = (rf_block, ed.asynchronous_full_wave)
+    double = cache.call(detect_envelope_scanlines, *args, cutoff_freq=0.1*SF)
+    with precision.using('single'):
+        single = cache.call(detect_envelope_scanlines, *args, cutoff_freq=0.1*SF)
+        expected = detect_envelope_scanlines(*args, cutoff_freq=0.1*SF)
+    assert double.dtype == np.float64
+    assert single.dtype == expected.dtype == np.float32
+    np.testing.assert_array_equal(single, expected)
+    assert len(cache.entries()) == 2
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    calls = []
+
+    def compute(a, scale=1.):
+        calls.append(1)
+        return a * scale
+
+    a = np.arange(10.)
+    first = cache.call(compute, a, scale=2.)
+    again = cache.call(compute, a.copy(), scale=2.)
+    np.testing.assert_array_equal(first, again)
+    assert len(calls) == 1
+    cache.call(compute, a, scale=3.)
+    cache.call(compute, a + 1, scale=2.)
+    assert len(calls) == 3
+    assert len(cache.entries()) == 3
+
+
+def test_results_are_read_only_memmaps(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    result = cache.memoize(('pair',), lambda: (np.ones(4), np.zeros((2, 3), np.float32)))
+    for arr in result:
+        assert isinstance(arr, np.memmap) and not arr.flags.writeable
+    assert result[1].dtype == np.float32
+    named = cache.memoize(('dict',), lambda: {'a': np.arange(3)})
+    np.testing.assert_array_equal(named['a'], [0, 1, 2])
+
+
+def test_failed_producer_leaves_no_entry(tmp_path):
+    cache = ResultCache(str(tmp_path))
+
+    def broken():
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        cache.memoize(('broken',), broken)
+    # the temporary directory is removed and nothing is published under the key
+    assert os.listdir(str(tmp_path)) == []
+    assert cache.lookup(cache.key('broken')) is None
+    np.testing.assert_array_equal(cache.memoize(('broken',), lambda: np.ones(2)), [1, 1])
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for i in range(3):
+        cache.memoize((i,), lambda: np.zeros(1000))
+        os.utime(cache.lookup(cache.key(i)), (i + 1, i + 1))
+    entry_size = max(size for _, size, _ in cache.entries())
+    cache.max_bytes = int(3.5 * entry_size)
+    cache.lookup(cache.key(0))      # entry 0 becomes the most recently used
+    cache.memoize((3,), lambda: np.zeros(1000))
+    assert cache.lookup(cache.key(1)) is None
+    assert all(cache.lookup(cache.key(i)) is not None for i in (0, 2, 3))
+
+
+def test_fingerprint_follows_project_dependencies(tmp_path, monkeypatch):
+    (tmp_path / 'dep_core.py').write_text('def step(x):\n    return x + 1\n')
+    (tmp_path / 'dep_api.py').write_text('import dep_core\n\n\ndef run(x):\n    return dep_core.step(x)\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    import dep_api
+    before = fingerprint(dep_api.run)
+    assert fingerprint(dep_api.run) == before
+    (tmp_path / 'dep_core.py').write_text('def step(x):\n    return x + 2  # changed\n')
+    assert fingerprint(dep_api.run) != before
+    # installed packages are not followed
+    assert fingerprint(np.mean) == fingerprint(np.mean)
+
+
+def test_fingerprint_is_stable_across_processes(tmp_path):
+    (tmp_path / 'dep_lambda.py').write_text('def run(x):\n    return list(map(lambda v: v + 1, x))\n')
+    code = ('import sys; sys.path[:0] = [%r, %r]; import dep_lambda, result_cache; '
+            'print(result_cache.fingerprint(dep_lambda.run))' % (str(tmp_path), os.path.dirname(result_cache.__file__)))
+    # repr() of the nested lambda code holds its address: hashed by content instead
+    runs = [subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+            for _ in range(2)]
+    assert runs[0] == runs[1] and 'at 0x' not in runs[0]
@@ -0,0 +1,61 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+import envelop_detection as ed
+from conftest import DATA
+from display_scans import SF, detect_envelope_scanlines
+from envelop_core import log_compress
+from rf_batch import dequantize, make_tasks, run_batch
+from rf_store import convert_block
+
+
+@pytest.fixture
+def rf_dir(tmp_path):
+    """ Small block (1 x 12 scanlines x 1024 samples x 4 RX) and its store at another SF and offset """
+    block = np.load(os.path.join(DATA, 'ex1-pulse-echo', 'tx4rx4-v1-block.npy'), mmap_mode='r')
+    path = str(tmp_path / 'tx4rx4-small-block.npy')
+    np.save(path, np.ascontiguousarray(block[:, 40:52, :1024]))
+    convert_block(path, str(tmp_path / 'tx4rx4-small-block.h5'), sf=SF / 2, sample_offset=100)
+    return tmp_path
+
+
+def expected_bmode(path, fs, cutoff=0.1*SF, dynamic_range=60):
+    summed = np.load(path)[0].sum(axis=2, dtype=np.float32)
+    env = detect_envelope_scanlines(summed, ed.asynchronous_full_wave, cutoff, fs)
+    return log_compress(env, dynamic_range)
+
+
+@pytest.mark.parametrize('pattern, fs, sample_offset', [('*-block.npy', SF, 0), ('*.h5', SF / 2, 100)])
+def test_process_files(rf_dir, tmp_path, pattern, fs, sample_offset):
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    tasks = make_tasks(str(rf_dir), str(out_dir), dtype='float32', chunk_size=5, pattern=pattern)
+    assert len(tasks) == 1
+    [result] = run_batch(tasks, jobs=2, threads=True)
+    assert result['status'] == 'ok', result.get('error')
+    assert result['shape'] == [12, 1024]
+
+    with np.load(result['output']) as out:
+        assert out['fs'] == fs and out['sample_offset'] == sample_offset
+        bmode = dequantize(out['bmode'], float(out['dynamic_range']))
+    np.testing.assert_allclose(bmode, expected_bmode(str(rf_dir / 'tx4rx4-small-block.npy'), fs), atol=1e-4)
+    if pattern == '*.h5':
+        # the store was closed by the worker
+        with h5py.File(tasks[0]['input'], 'a'):
+            pass
+
+
+def test_uint8_output_and_failed_file(rf_dir, tmp_path):
+    (rf_dir / 'broken-block.npy').write_bytes(b'not an array')
+    tasks = make_tasks(str(rf_dir), str(tmp_path))
+    results = {os.path.basename(r['input']): r for r in run_batch(tasks, jobs=2)}
+    assert results['broken-block.npy']['status'] == 'error'
+    ok = results['tx4rx4-small-block.npy']
+    with np.load(ok['output']) as out:
+        assert out['bmode'].dtype == np.uint8
+        bmode = dequantize(out['bmode'], 60)
+    expected = expected_bmode(str(rf_dir / 'tx4rx4-small-block.npy'), SF)
+    assert np.max(np.abs(bmode - expected)) <= 60 / 255 / 2 + 1e-4
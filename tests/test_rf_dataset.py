@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from rf_dataset import US_RFDataset
+
+
+@pytest.fixture
+def block_path(tmp_path):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / 'tx4rx4-v1-block.npy')
+    np.save(path, rng.integers(-2000, 2000, (1, 9, 64, 4), dtype=np.int16))
+    return path
+
+
+def test_views_on_the_memory_map(block_path):
+    eager = np.squeeze(np.load(block_path))
+    with US_RFDataset(block_path) as ds:
+        assert isinstance(ds.raw, np.memmap)
+        view = ds.select(slice(2, 5), slice(10, 40), slice(0, 2))
+        assert np.shares_memory(view, ds.raw)
+        np.testing.assert_array_equal(view, eager[2:5, 10:40, :2])
+        np.testing.assert_array_equal(ds[3], eager[3])
+    assert ds.rf is None
+    np.testing.assert_array_equal(view, eager[2:5, 10:40, :2])      # still valid after close
+
+
+@pytest.mark.parametrize('scanlines', [slice(None), slice(1, 8, 3), 4, -1, np.int64(2), [0, 5, 6, 7], np.array([8, 1])])
+@pytest.mark.parametrize('samples', [slice(None), slice(5, 50), 7])
+def test_rx_sum_matches_eager(block_path, scanlines, samples):
+    eager = np.squeeze(np.load(block_path))
+    ds = US_RFDataset(block_path)
+    expected = np.sum(eager[scanlines][..., samples, :], axis=-1).astype(np.float32)
+    for chunk_size in (1, 2, 16):
+        summed = ds.rx_sum(scanlines, samples, chunk_size=chunk_size)
+        assert summed.shape == expected.shape and summed.dtype == np.float32
+        np.testing.assert_array_equal(summed, expected)
+    np.testing.assert_array_equal(ds.rx_sum(scanlines, samples, [0, 3]),
+                                  eager[scanlines][..., samples, :][..., [0, 3]].sum(axis=-1))
+    np.testing.assert_array_equal(ds.rx_sum(scanlines, samples, 1), eager[scanlines][..., samples, 1])
+
+
+def test_rx_sum_into_out(block_path):
+    ds = US_RFDataset(block_path)
+    out = np.zeros((9, 64), np.float64)
+    assert ds.rx_sum(out=out, chunk_size=4) is not None
+    np.testing.assert_array_equal(out, np.squeeze(np.load(block_path)).sum(axis=2))
@@ -0,0 +1,90 @@
+import h5py
+import numpy as np
+import pytest
+
+from rf_store import US_RFStore, convert_block, convert_reco_image
+from us_classes import US_RecoImage, save_reco_image
+
+
+def make_image(path, dtype, frames=2, nx=6, nz=9):
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((frames, nx, nz)) + 1j * rng.standard_normal((frames, nx, nz))
+    x = np.linspace(-0.01, 0.01, nx).astype(np.real(np.zeros(1, dtype)).dtype)
+    z = np.linspace(0.01, 0.04, nz).astype(x.dtype)
+    save_reco_image(path, x, z, data.astype(dtype), np.arange(1, frames + 1))
+    return data.astype(dtype)
+
+
+def stored_dtype(path):
+    with h5py.File(path, 'r') as f:
+        return f['US/US_DATASET0000/data/real'].dtype, f['US/US_DATASET0000/scan/x_axis'].dtype
+
+
+@pytest.mark.parametrize('dtype, real', [(np.complex64, np.float32), (np.complex128, np.float64)])
+def test_save_reco_image_keeps_dtype(tmp_path, dtype, real):
+    path = str(tmp_path / 'image.hdf5')
+    data = make_image(path, dtype)
+    assert stored_dtype(path) == (real, real)
+    with US_RecoImage(path, dtype=dtype) as image:
+        np.testing.assert_array_equal(image.data, data)
+
+
+def test_save_reco_image_from_iterable(tmp_path):
+    path = str(tmp_path / 'image.hdf5')
+    frames = np.arange(2 * 3 * 4, dtype=np.float64).reshape(2, 3, 4) / 7
+    save_reco_image(path, np.arange(3.), np.arange(4.), iter(frames), [1, 2])
+    with US_RecoImage(path, dtype=np.complex128) as image:
+        np.testing.assert_array_equal(image.data.real, frames)
+
+
+@pytest.mark.parametrize('dtype, real', [(np.complex64, np.float32), (np.complex128, np.float64)])
+@pytest.mark.parametrize('compression', ['gzip', None])
+def test_convert_reco_image_is_lossless(tmp_path, dtype, real, compression):
+    src, dst = str(tmp_path / 'src.hdf5'), str(tmp_path / 'dst.hdf5')
+    data = make_image(src, dtype)
+    convert_reco_image(src, dst, compression=compression, chunk_lines=2)
+    assert stored_dtype(dst) == (real, real)
+    with US_RecoImage(dst, dtype=dtype) as image:
+        np.testing.assert_array_equal(image.data, data)
+
+
+def test_convert_reco_image_explicit_narrowing(tmp_path):
+    src, dst = str(tmp_path / 'src.hdf5'), str(tmp_path / 'dst.hdf5')
+    data = make_image(src, np.complex128)
+    convert_reco_image(src, dst, dtype=np.float32)
+    assert stored_dtype(dst)[0] == np.float32
+    with US_RecoImage(dst, dtype=np.complex128) as image:
+        np.testing.assert_array_equal(image.data, data.astype(np.complex64))
+
+
+def test_convert_block_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    block = rng.integers(-2000, 2000, (1, 5, 64, 4), dtype=np.int16)
+    np.save(tmp_path / 'tx4rx4-v1-block.npy', block)
+    store = convert_block(str(tmp_path / 'tx4rx4-v1-block.npy'), str(tmp_path / 'store.h5'), chunk_scanlines=2)
+    with US_RFStore(store) as rf:
+        np.testing.assert_array_equal(rf.rf, block[0])
+        np.testing.assert_array_equal(rf.select([0, 2, 3]), block[0, [0, 2, 3]])
+        np.testing.assert_array_equal(rf.rx_sum(), block[0].sum(axis=2, dtype=np.float32))
+        assert rf.n_tx == 4
+
+
+@pytest.mark.parametrize('scanlines', [3, -1, np.int64(2), [0, 2, 3], slice(1, 4)])
+@pytest.mark.parametrize('samples', [slice(None), slice(10, 30), 7])
+def test_store_keys_index_like_numpy(tmp_path, scanlines, samples):
+    rng = np.random.default_rng(1)
+    block = rng.integers(-2000, 2000, (1, 5, 64, 4), dtype=np.int16)
+    np.save(tmp_path / 'tx4rx4-v1-block.npy', block)
+    store = convert_block(str(tmp_path / 'tx4rx4-v1-block.npy'), str(tmp_path / 'store.h5'), chunk_scanlines=2,
+                          sf=20e6, sample_offset=50)
+    rf = block[0]
+    with US_RFStore(store) as st:
+        assert (st.SF, st.sample_offset) == (20e6, 50)
+        for channels in (slice(None), 1):
+            expected = rf[scanlines][..., samples, channels]
+            np.testing.assert_array_equal(st.select(scanlines, samples, channels), expected)
+        expected = rf[scanlines][..., samples, :].sum(axis=-1, dtype=np.float32)
+        summed = st.rx_sum(scanlines, samples, chunk_size=2)
+        assert summed.shape == expected.shape
+        np.testing.assert_array_equal(summed, expected)
+        np.testing.assert_array_equal(st.rx_sum(scanlines, samples, 2), rf[scanlines][..., samples, 2])
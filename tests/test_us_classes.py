@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from us_classes import US_RecoImage
+
+KEYS = [(0, 0, 0), (2, 5, 7), 1, (slice(None), 3), (slice(0, 2), slice(4, 9), 11), (Ellipsis, 2)]
+
+
+@pytest.mark.parametrize('magnitude', [False, True])
+@pytest.mark.parametrize('dtype', [np.complex64, np.complex128])
+@pytest.mark.parametrize('key', KEYS)
+def test_lazy_matches_eager(reco_file, magnitude, dtype, key):
+    with US_RecoImage(reco_file, dtype=dtype, magnitude=magnitude) as eager, \
+            US_RecoImage(reco_file, lazy=True, dtype=dtype, magnitude=magnitude) as lazy:
+        expected = eager.data[key]
+        value = lazy.data[key]
+        assert np.shape(value) == np.shape(expected)
+        assert np.asarray(value).dtype == np.asarray(expected).dtype
+        np.testing.assert_array_equal(value, expected)
+
+
+def test_lazy_array_conversion(reco_file):
+    with US_RecoImage(reco_file) as eager, US_RecoImage(reco_file, lazy=True) as lazy:
+        np.testing.assert_array_equal(np.asarray(lazy.data), eager.data)
+        assert len(lazy.data) == 3
+
+
+def test_contrast_regions_shared_and_bounded(phantom_path):
+    import us_classes
+    from us_classes import US_ContrastEngine, US_Phantom
+    pht = US_Phantom(phantom_path)
+    x = np.linspace(-0.018, 0.018, 120, dtype=np.float32)
+    z = np.linspace(0.01, 0.05, 200, dtype=np.float32)
+    assert not hasattr(US_ContrastEngine, '_regions_cache')
+    first = US_ContrastEngine(pht, x, z)
+    assert US_ContrastEngine(pht, x.copy(), z.copy()).regions is first.regions
+    assert US_ContrastEngine(pht, x, z, padding=2).regions is not first.regions
+    # a long batch over many grids keeps at most maxsize region sets alive
+    for n in range(40):
+        US_ContrastEngine(pht, x + np.float32(n * 1e-5), z)
+    info = us_classes._contrast_regions.cache_info()
+    assert info.currsize <= info.maxsize
+
+
+def test_contrast_regions_geometry(phantom_path):
+    from us_classes import US_ContrastEngine, US_Phantom
+    pht = US_Phantom(phantom_path)
+    x = np.linspace(-0.018, 0.018, 120, dtype=np.float32)
+    z = np.linspace(0.01, 0.05, 200, dtype=np.float32)
+    engine = US_ContrastEngine(pht, x, z)
+    X, Z = np.meshgrid(x, z)
+    for k, region in enumerate(engine.regions):
+        r = pht.occlusionDiameter[k] / 2
+        inside = (X - pht.occlusionCenterX[k])**2 + (Z - pht.occlusionCenterZ[k])**2 <= r**2
+        np.testing.assert_array_equal(engine.region_mask(k, 'occlusion'), inside)
+        assert np.all(engine.region_mask(k, 'inside') <= inside)
+        assert not np.any(engine.region_mask(k, 'outside') & inside)